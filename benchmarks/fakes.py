@@ -0,0 +1,457 @@
+"""
+Local stand-ins for the bot's external services, used by the load test.
+
+Each stand-in answers the calls the services really make (the OpenAI chat and
+embedding clients, PostgREST over an httpx transport, the Sheets, Drive and
+Calendar API clients, an SMTP server on localhost and the Telegram bot API)
+after a delay drawn from a LatencyModel, and fails a configurable share of
+calls the way the real service would (5xx responses, HttpError, SMTP 451).
+Blocking clients (OpenAI chat, Google APIs) sleep in the calling thread, as
+the real clients block.
+"""
+from typing import Callable, Dict, List, Optional
+from types import SimpleNamespace
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import httplib2
+import numpy as np
+from googleapiclient.errors import HttpError
+
+from utils.text_analysis import default_analyzer
+
+class LatencyModel:
+    def __init__(self, median_ms: float, p99_ms: float, error_rate: float = 0.0, seed: int = 0):
+        """
+        Log-normal call latency with a given median and 99th percentile.
+
+        Args:
+            median_ms, p99_ms: Latency distribution
+            error_rate: Share of calls that fail
+            seed: Seed for this model's random stream
+        """
+        self.median_ms = median_ms
+        self.p99_ms = max(p99_ms, median_ms)
+        self.error_rate = error_rate
+        self.scale = 1.0  # Multiplies every delay; < 1 runs the same load faster
+        self.sigma = math.log(self.p99_ms / median_ms) / 2.326 if median_ms > 0 else 0.0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()  # Blocking stand-ins are called from worker threads
+        self.calls = 0
+        self.errors = 0
+
+    @classmethod
+    def parse(cls, spec: str, seed: int = 0) -> "LatencyModel":
+        """'median_ms:p99_ms[:error_rate]', e.g. '400:1500:0.01'."""
+        parts = [float(part) for part in spec.split(':')]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Expected median_ms:p99_ms[:error_rate], got {spec!r}")
+        return cls(parts[0], parts[1], parts[2] if len(parts) == 3 else 0.0, seed)
+
+    def sample(self) -> tuple:
+        """(delay in seconds, whether this call fails)."""
+        with self.lock:
+            self.calls += 1
+            delay = self.median_ms * math.exp(self.sigma * self.rng.gauss(0, 1)) if self.median_ms > 0 else 0.0
+            failed = self.rng.random() < self.error_rate
+            self.errors += failed
+        return delay * self.scale / 1000, failed
+
+    def block(self) -> bool:
+        """Sleep in the calling thread; returns True when the call should fail."""
+        delay, failed = self.sample()
+        time.sleep(delay)
+        return failed
+
+    async def wait(self) -> bool:
+        """Sleep on the event loop; returns True when the call should fail."""
+        delay, failed = self.sample()
+        await asyncio.sleep(delay)
+        return failed
+
+    def stats(self) -> Dict:
+        return {"calls": self.calls, "errors": self.errors}
+
+def _http_error(status: int) -> HttpError:
+    return HttpError(httplib2.Response({'status': status}), b'{"error": "load test"}')
+
+def fake_embedding(text: str, dimensions: int = 1536) -> List[float]:
+    """Deterministic unit vector for a text."""
+    rng = np.random.default_rng(zlib.crc32(text.encode()))
+    vector = rng.standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+# OpenAI
+
+class FakeChatCompletions:
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.analyzer = default_analyzer()
+
+    def create(self, model: str, messages: List[Dict], response_format: Optional[Dict] = None, **kwargs):
+        """Blocking chat completion: JSON analysis when JSON is requested, otherwise a short reply."""
+        if self.latency.block():
+            raise Exception("Fake OpenAI: 500 Internal Server Error")
+        prompt = messages[-1]['content']
+        if response_format and response_format.get('type') == 'json_object':
+            text = prompt.rsplit('Message:', 1)[-1].strip()
+            analysis = self.analyzer.analyze(text)
+            subjects = analysis['entities']['subjects']
+            content = json.dumps({
+                'intent': analysis['intent'],
+                'entities': {'subject': subjects[0] if subjects else None, 'query': text},
+                'escalation_required': analysis['requires_escalation'],
+                'sentiment': analysis['sentiment']
+            })
+        else:
+            content = "Thanks for your message! Here is what I found for you."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+class FakeOpenAI:
+    """Stand-in for openai.OpenAI as used by LLMService."""
+
+    def __init__(self, latency: LatencyModel):
+        self.chat = SimpleNamespace(completions=FakeChatCompletions(latency))
+
+class FakeEmbeddings:
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+
+    async def create(self, model: str, input: str, dimensions: Optional[int] = None):
+        if await self.latency.wait():
+            raise Exception("Fake OpenAI: 503 Service Unavailable")
+        return SimpleNamespace(data=[SimpleNamespace(embedding=fake_embedding(input, dimensions or 1536))])
+
+class FakeAsyncOpenAI:
+    """Stand-in for openai.AsyncOpenAI as used by VectorStore."""
+
+    def __init__(self, latency: LatencyModel):
+        self.embeddings = FakeEmbeddings(latency)
+
+# Supabase (PostgREST)
+
+class FakeSupabase:
+    def __init__(self, latency: LatencyModel, documents: int = 500, seed: int = 0):
+        """
+        PostgREST stand-in served through an httpx transport.
+
+        Answers match_documents(_with_embeddings) and documents reads from a synthetic corpus,
+        accepts conversation_history writes, and returns empty results for
+        everything else.
+        """
+        self.latency = latency
+        self.rng = random.Random(seed)
+        subjects = ['math', 'science', 'english', 'history', 'physics', 'chemistry', 'biology']
+        categories = ['pricing', 'schedule', 'programs', 'tutors', 'faq']
+        self.documents = [
+            {
+                'id': i,
+                'content': f"{subjects[i % len(subjects)].title()} {categories[i % len(categories)]} note {i}",
+                'metadata': {'subject': subjects[i % len(subjects)], 'category': categories[i % len(categories)],
+                             'source': f"doc-{i // 5}"},
+                'embedding': json.dumps(fake_embedding(f"doc-{i}"))
+            }
+            for i in range(documents)
+        ]
+        self.rows_inserted = 0
+        self.client_row_ids = set()  # For upserts that ignore duplicates
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if await self.latency.wait():
+            return httpx.Response(503, json={'message': 'load test'})
+        path = request.url.path.rsplit('/rest/v1/', 1)[-1]
+        params = request.url.params
+
+        if path in ('rpc/match_documents', 'rpc/match_documents_with_embeddings'):
+            count = json.loads(request.content or b'{}').get('match_count', 3)
+            start = self.rng.randrange(len(self.documents))
+            results = [self.documents[(start + i) % len(self.documents)] for i in range(count)]
+            matches = []
+            for rank, doc in enumerate(results):
+                match = {'id': doc['id'], 'content': doc['content'], 'metadata': doc['metadata'],
+                         'similarity': 0.9 - 0.01 * rank}
+                if path.endswith('_with_embeddings'):
+                    match['embedding'] = doc['embedding']
+                matches.append(match)
+            return httpx.Response(200, json=matches)
+        if path == 'documents' and request.method == 'GET':
+            ids = params.get('id')
+            if ids:
+                wanted = {int(value) for value in re.findall(r'\d+', ids)}
+                return httpx.Response(200, json=[doc for doc in self.documents if doc['id'] in wanted])
+            offset, limit = int(params.get('offset', 0)), int(params.get('limit', len(self.documents)))
+            return httpx.Response(200, json=self.documents[offset:offset + limit])
+        if request.method == 'POST' and not path.startswith('rpc/'):
+            rows = json.loads(request.content or b'[]')
+            rows = rows if isinstance(rows, list) else [rows]
+            if 'ignore-duplicates' in request.headers.get('prefer', ''):
+                rows = [row for row in rows if row.get('client_row_id') not in self.client_row_ids]
+                self.client_row_ids.update(row['client_row_id'] for row in rows if row.get('client_row_id'))
+            self.rows_inserted += len(rows)
+            return httpx.Response(201, json=rows)
+        return httpx.Response(200, json=[])
+
+# Google APIs
+
+class FakeRequest:
+    def __init__(self, latency: LatencyModel, result: Callable[[], Dict]):
+        """An API request whose execute() blocks like googleapiclient's."""
+        self.latency = latency
+        self.result = result
+
+    def execute(self):
+        if self.latency.block():
+            raise _http_error(503)
+        return self.result()
+
+class _Namespace:
+    def __init__(self, **methods):
+        for name, method in methods.items():
+            setattr(self, name, method)
+
+class FakeSheetsAPI:
+    """Sheets v4 client holding an availability sheet; appended rows are kept and counted."""
+
+    def __init__(self, latency: LatencyModel, tutors: int = 8, availability_sheet: str = 'Availability'):
+        self.latency = latency
+        subjects = ['math', 'science', 'english', 'physics', 'chemistry']
+        weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+        rows = [['Tutor', 'Day', 'Start', 'End', 'Subject']]
+        for tutor in range(tutors):
+            for day in weekdays:
+                rows.append([f"Tutor {tutor}", day, '09:00', '17:00', subjects[tutor % len(subjects)]])
+        self.sheets = {availability_sheet: rows}
+        self.appended = 0
+
+    def _append(self, range: str, body: Dict, **kwargs) -> Dict:
+        rows = body.get('values', [])
+        self.sheets.setdefault(range.split('!')[0], []).extend(rows)
+        self.appended += len(rows)
+        return {'updates': {'updatedRows': len(rows)}}
+
+    def _get(self, range: str) -> Dict:
+        sheet, _, cells = range.partition('!')
+        rows = self.sheets.get(sheet, [])
+        column = re.fullmatch(r'([A-Z]+):\1', cells)
+        if column:
+            # Single-column ranges such as F:F
+            index = 0
+            for letter in column.group(1):
+                index = index * 26 + ord(letter) - ord('A') + 1
+            rows = [[row[index - 1]] if len(row) >= index else [] for row in rows]
+        return {'values': rows}
+
+    def spreadsheets(self):
+        values = _Namespace(
+            get=lambda spreadsheetId, range, **kwargs: FakeRequest(self.latency, lambda: self._get(range)),
+            append=lambda spreadsheetId, **kwargs: FakeRequest(self.latency, lambda: self._append(**kwargs))
+        )
+        return _Namespace(
+            values=lambda: values,
+            get=lambda spreadsheetId, **kwargs: FakeRequest(self.latency, lambda: {
+                'properties': {'title': 'Load test'},
+                'sheets': [{'properties': {'title': title}} for title in self.sheets]
+            }),
+            batchUpdate=lambda spreadsheetId, body, **kwargs: FakeRequest(self.latency, lambda: {})
+        )
+
+class FakeDriveAPI:
+    """Drive v3 client reporting a spreadsheet that never changes."""
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+
+    def files(self):
+        return _Namespace(get=lambda **kwargs: FakeRequest(
+            self.latency, lambda: {'modifiedTime': '2026-01-01T00:00:00.000Z'}))
+
+class FakeBatchRequest:
+    def __init__(self, latency: LatencyModel, callback: Callable):
+        self.latency = latency
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: FakeRequest, request_id: str) -> None:
+        self.requests.append((request_id, request))
+
+    def execute(self) -> None:
+        if self.latency.block():
+            raise _http_error(503)
+        for request_id, request in self.requests:
+            self.callback(request_id, request.result(), None)
+
+class FakeCalendarAPI:
+    """Calendar v3 client with random busy events over the coming weeks."""
+
+    def __init__(self, latency: LatencyModel, events: int = 200, days: int = 14, seed: int = 0):
+        self.latency = latency
+        rng = random.Random(seed)
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.stored = {}
+        for i in range(events):
+            start = today + timedelta(days=rng.randrange(days), hours=rng.randrange(8, 18))
+            self.stored[f"evt{i}"] = {
+                'id': f"evt{i}",
+                'status': 'confirmed',
+                'start': {'dateTime': start.isoformat()},
+                'end': {'dateTime': (start + timedelta(hours=1)).isoformat()}
+            }
+        self.inserted = 0
+
+    def _list(self, syncToken: Optional[str] = None, **kwargs) -> Dict:
+        # Later syncs are incremental and nothing changes between them
+        items = [] if syncToken else list(self.stored.values())
+        return {'items': items, 'nextSyncToken': 'sync-token', 'timeZone': 'UTC'}
+
+    def _insert(self, body: Dict, **kwargs) -> Dict:
+        self.inserted += 1
+        event = dict(body, status='confirmed')
+        event.setdefault('id', f"ins{self.inserted}")
+        self.stored[event['id']] = event
+        return event
+
+    def events(self):
+        return _Namespace(
+            list=lambda **kwargs: FakeRequest(self.latency, lambda: self._list(**kwargs)),
+            insert=lambda calendarId, body, **kwargs: FakeRequest(self.latency, lambda: self._insert(body)),
+            delete=lambda calendarId, eventId, **kwargs: FakeRequest(
+                self.latency, lambda: self.stored.pop(eventId, None) and {})
+        )
+
+    def freebusy(self):
+        return _Namespace(query=lambda body: FakeRequest(self.latency, lambda: {
+            'calendars': {item['id']: {'busy': []} for item in body.get('items', [])}
+        }))
+
+    def new_batch_http_request(self, callback: Callable) -> FakeBatchRequest:
+        return FakeBatchRequest(self.latency, callback)
+
+# SMTP
+
+class FakeSMTPServer:
+    def __init__(self, latency: LatencyModel, host: str = '127.0.0.1'):
+        """
+        Minimal SMTP server on localhost (EHLO, AUTH, MAIL, RCPT, DATA, NOOP, RSET, QUIT).
+
+        The latency applies to each accepted message; failed messages get a
+        451 so the client sees a per-message rejection.
+        """
+        self.latency = latency
+        self.host = host
+        self.port: Optional[int] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.messages = 0
+        self.connections = 0
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._session, self.host, 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+
+        async def reply(line: str) -> None:
+            writer.write(line.encode() + b"\r\n")
+            await writer.drain()
+
+        try:
+            await reply("220 localhost fake SMTP")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                command = line.decode(errors='replace').strip()
+                verb = command.split(' ', 1)[0].upper()
+                if verb in ('EHLO', 'HELO'):
+                    await reply("250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 35882577")
+                elif verb == 'AUTH':
+                    await reply("235 2.7.0 Authentication successful")
+                elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                    await reply("250 OK")
+                elif verb == 'DATA':
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    while (await reader.readline()) not in (b".\r\n", b""):
+                        pass
+                    if await self.latency.wait():
+                        await reply("451 4.3.0 Temporary failure (load test)")
+                    else:
+                        self.messages += 1
+                        await reply("250 OK queued")
+                elif verb == 'QUIT':
+                    await reply("221 Bye")
+                    return
+                else:
+                    await reply("502 Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+# Telegram
+
+class FakeBot:
+    """The part of telegram.Bot the handlers use."""
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+
+    async def send_chat_action(self, chat_id: int, action: str, **kwargs) -> bool:
+        if await self.latency.wait():
+            raise Exception("Fake Telegram: Timed out")
+        return True
+
+class FakeApplication:
+    def __init__(self, bot: FakeBot):
+        self.bot = bot
+
+class FakeUser:
+    def __init__(self, user_id: int, first_name: str, last_name: Optional[str] = None,
+                 username: Optional[str] = None):
+        self.id = user_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+
+class FakeMessage:
+    def __init__(self, text: str, from_user: FakeUser, chat_id: int, message_id: int,
+                 latency: LatencyModel, on_reply: Optional[Callable[["FakeMessage", str], None]] = None):
+        """A received message; reply_text goes through the Telegram latency model."""
+        self.text = text
+        self.from_user = from_user
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.latency = latency
+        self.on_reply = on_reply
+        self.replies: List[str] = []
+
+    async def reply_text(self, text: str, **kwargs):
+        if await self.latency.wait():
+            raise Exception("Fake Telegram: Timed out")
+        self.replies.append(text)
+        if self.on_reply is not None:
+            self.on_reply(self, text)
+        return SimpleNamespace(text=text)
+
+class FakeUpdate:
+    def __init__(self, update_id: int, message: FakeMessage):
+        self.update_id = update_id
+        self.message = message
+        self.effective_message = message
+        self.effective_user = message.from_user
@@ -0,0 +1,462 @@
+"""
+End-to-end load test of the Telegram message handler, fully offline.
+
+Builds TelegramBot with the real services wired as in main.py (LLMService,
+VectorStore, availability and reservations, the escalation manager, the
+outbox, conversation memory and Gmail's SMTP pool), with every external
+backend replaced by the stand-ins in benchmarks.fakes. Synthetic or recorded
+updates are replayed at a target rate with Poisson arrivals, and the run
+reports throughput, reply latency percentiles, event-loop lag, memory, the
+per-stage breakdown from utils.tracing and per-backend call counts.
+
+Reply latency is measured from each update's scheduled arrival, so a stalled
+event loop shows up as latency instead of silently lowering the offered load.
+Thresholds (--max-p95-ms, --max-loop-lag-ms, --max-error-rate) make the
+command exit with status 1, so it can gate a deploy.
+
+Recorded updates are JSON lines, either Telegram Update objects as returned
+by getUpdates or {"user_id": ..., "text": ...}.
+
+Usage:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --rate 20 --messages 2000 --users 300
+    python -m benchmarks.load_test --latency openai=800:3000:0.02 --latency-scale 0.2
+    python -m benchmarks.load_test --updates recorded_updates.jsonl --json
+"""
+import os
+
+# The services read API keys from config at import; none of them reach a network here
+os.environ.setdefault('OPENAI_API_KEY', 'sk-load-test')
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.fakes import (
+    LatencyModel,
+    FakeOpenAI,
+    FakeAsyncOpenAI,
+    FakeSupabase,
+    FakeSheetsAPI,
+    FakeDriveAPI,
+    FakeCalendarAPI,
+    FakeSMTPServer,
+    FakeBot,
+    FakeApplication,
+    FakeUser,
+    FakeMessage,
+    FakeUpdate
+)
+from benchmarks.text_analysis_benchmark import synthetic_messages
+from config.config import WRITE_BEHIND_BATCH_SIZE, SHEETS_BATCH_SIZE, SHEETS_FLUSH_INTERVAL
+from services.supabase_data import SupabaseDataLayer
+from services.vector_store import VectorStore
+from services.google_sheets import GoogleSheetsService
+from services.google_calendar import GoogleCalendarService
+from services.calendar_cache import CalendarEventCache
+from services.availability import AvailabilityService
+from services.reservations import ReservationLedger
+from services.gmail_service import GmailService
+from services.escalation_manager import EscalationManager
+from services.llm_service import LLMService
+from services.memory.conversation_memory import ConversationMemory
+from services.telegram_bot import TelegramBot
+from services.outbox import Outbox, CONVERSATION_ROWS, ESCALATION_EMAILS, ESCALATION_UPDATES, SHEET_ROWS
+from utils import tracing
+
+# Backend -> "median_ms:p99_ms[:error_rate]"
+DEFAULT_LATENCY = {
+    'openai': '300:1200',  # Chat completions; LLMService's client blocks the calling thread
+    'embeddings': '80:300',
+    'supabase': '20:120',
+    'sheets': '150:600',
+    'calendar': '120:500',
+    'smtp': '100:400',
+    'telegram': '40:200'  # reply_text and chat actions
+}
+ERROR_REPLY_PREFIX = "I apologize"  # Start of the bot's error replies
+
+def synthetic_updates(count: int, users: int, seed: int) -> List[Dict]:
+    """Messages from `users` parents; a few parents send most of the messages."""
+    rng = np.random.default_rng(seed)
+    texts = synthetic_messages(count, seed)
+    # Zipf-like activity: user k is picked with weight 1 / (k + 1)
+    weights = 1.0 / np.arange(1, users + 1)
+    user_ids = rng.choice(users, size=count, p=weights / weights.sum())
+    return [
+        {'update_id': i, 'user_id': 100000 + int(user), 'first_name': f"Parent {int(user)}", 'text': text}
+        for i, (user, text) in enumerate(zip(user_ids, texts))
+    ]
+
+def load_updates(path: str) -> List[Dict]:
+    """Read recorded updates (Telegram Update JSON or {"user_id", "text"} per line)."""
+    updates = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            message = record.get('message')
+            if message is not None:
+                if not message.get('text'):
+                    continue
+                sender = message.get('from') or {}
+                record = {
+                    'user_id': sender.get('id', message.get('chat', {}).get('id')),
+                    'first_name': sender.get('first_name', 'Parent'),
+                    'last_name': sender.get('last_name'),
+                    'username': sender.get('username'),
+                    'text': message['text']
+                }
+            record.setdefault('update_id', len(updates))
+            updates.append(record)
+    return updates
+
+def percentiles(values: List[float]) -> Dict:
+    if not values:
+        return {"count": 0}
+    ordered = np.sort(np.asarray(values))
+    return {
+        "count": len(ordered),
+        "mean": float(ordered.mean()),
+        "p50": float(np.percentile(ordered, 50)),
+        "p95": float(np.percentile(ordered, 95)),
+        "p99": float(np.percentile(ordered, 99)),
+        "max": float(ordered[-1])
+    }
+
+def rss_mb() -> float:
+    """Resident set size from /proc, falling back to the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class LoadTest:
+    def __init__(self, latency: Dict[str, LatencyModel], workdir: str, search_mode: str = 'rpc'):
+        """Stand-ins for every backend plus the bot wired to them."""
+        self.latency = latency
+        self.workdir = workdir
+        self.search_mode = search_mode
+        self.supabase = FakeSupabase(latency['supabase'])
+        self.sheets_api = FakeSheetsAPI(latency['sheets'])
+        self.calendar_api = FakeCalendarAPI(latency['calendar'])
+        self.smtp = FakeSMTPServer(latency['smtp'])
+        self.first_reply: Dict[int, tuple] = {}  # update_id -> (time, text)
+
+    async def build(self) -> None:
+        """Construct the services the way TeachProBot does, pointed at the stand-ins."""
+        await self.smtp.start()
+        self.db = SupabaseDataLayer('http://supabase.local', 'load-test-key', transport=self.supabase.transport())
+        self.vector_store = VectorStore(self.db, search_mode=self.search_mode)
+        self.vector_store.openai_client = FakeAsyncOpenAI(self.latency['embeddings'])
+        self.sheets_service = GoogleSheetsService(
+            None, 'load-test-sheet',
+            service=self.sheets_api, drive=FakeDriveAPI(self.latency['sheets'])
+        )
+        self.calendar_service = GoogleCalendarService(None, 'tutors@load.test', service=self.calendar_api)
+        self.calendar_service.event_cache = CalendarEventCache(
+            self.calendar_service.service,
+            [self.calendar_service.calendar_id]
+        )
+        self.reservations = ReservationLedger(self.calendar_service)
+        self.calendar_service.ledger = self.reservations
+        self.availability_service = AvailabilityService(
+            self.sheets_service,
+            self.calendar_service,
+            ledger=self.reservations
+        )
+        self.gmail_service = GmailService(
+            'bot@load.test', 'load-test-password', 'support@load.test',
+            smtp_host=self.smtp.host, smtp_port=self.smtp.port, use_ssl=False
+        )
+        self.llm_service = LLMService('sk-load-test')
+        self.llm_service.client = FakeOpenAI(self.latency['openai'])
+
+        self.outbox = Outbox(os.path.join(self.workdir, 'outbox.sqlite3'))
+        self.conversation_memory = ConversationMemory(
+            self.db,
+            write_buffer=self.outbox.channel(CONVERSATION_ROWS)
+        )
+        self.outbox.register_batch(
+            CONVERSATION_ROWS,
+            self.conversation_memory.insert_rows,
+            batch_size=WRITE_BEHIND_BATCH_SIZE,
+            keyed=True  # Resends are ignored via client_row_id
+        )
+        self.escalation_manager = EscalationManager(self.gmail_service, outbox=self.outbox)
+        self.outbox.register(ESCALATION_EMAILS, self.escalation_manager.deliver_escalation)
+        self.outbox.register(ESCALATION_UPDATES, self.escalation_manager.deliver_update)
+        self.outbox.register_batch(
+            SHEET_ROWS,
+            self.sheets_service.append_row_batch,
+            batch_size=SHEETS_BATCH_SIZE,
+            linger=SHEETS_FLUSH_INTERVAL,
+            keyed=True  # Rows carry their key in a Row ID column
+        )
+
+        self.telegram_bot = TelegramBot(
+            'load-test-token',
+            self.llm_service,
+            self.vector_store,
+            self.sheets_service,
+            self.gmail_service,
+            outbox=self.outbox,
+            conversation_memory=self.conversation_memory,
+            availability_service=self.availability_service,
+            escalation_manager=self.escalation_manager
+        )
+        self.telegram_bot.application = FakeApplication(FakeBot(self.latency['telegram']))
+
+    async def start(self) -> None:
+        """Start background work in main.py's order and wait for the first availability refresh."""
+        self.gmail_service.start()
+        await self.outbox.start()
+        await self.calendar_service.event_cache.start()
+        self.reservations.start()
+        await self.availability_service.refresh()
+        self.availability_service.start()
+        self.escalation_manager.start()
+
+    async def stop(self) -> None:
+        await self.escalation_manager.stop()
+        await self.availability_service.stop()
+        await self.reservations.stop()
+        await self.calendar_service.event_cache.stop()
+        await self.outbox.stop()
+        await self.gmail_service.stop()
+        await self.db.close()
+        await self.smtp.stop()
+
+    def _on_reply(self, message: FakeMessage, text: str) -> None:
+        self.first_reply.setdefault(message.message_id, (time.perf_counter(), text))
+
+    def _update(self, record: Dict) -> FakeUpdate:
+        user = FakeUser(int(record['user_id']), record.get('first_name') or 'Parent',
+                        record.get('last_name'), record.get('username'))
+        message = FakeMessage(record['text'], user, user.id, int(record['update_id']),
+                              self.latency['telegram'], on_reply=self._on_reply)
+        return FakeUpdate(int(record['update_id']), message)
+
+    async def _watch_loop(self, lags: List[float], memory: List[float], interval: float = 0.02) -> None:
+        """Record how late the event loop wakes up, and RSS every 25 wake-ups."""
+        ticks = 0
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append((time.perf_counter() - started - interval) * 1000)
+            ticks += 1
+            if ticks % 25 == 0:
+                memory.append(rss_mb())
+
+    async def replay(self, records: List[Dict], rate: float, seed: int, drain_timeout: float) -> Dict:
+        """
+        Deliver updates with exponential inter-arrival times at `rate` per second.
+
+        Returns:
+            Report dict (see `run`)
+        """
+        rng = random.Random(seed)
+        lags: List[float] = []
+        memory: List[float] = [rss_mb()]
+        watcher = asyncio.get_running_loop().create_task(self._watch_loop(lags, memory))
+        scheduled: Dict[int, float] = {}
+        tasks = []
+
+        started = time.perf_counter()
+        offset = 0.0
+        for record in records:
+            offset += rng.expovariate(rate)
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update = self._update(record)
+            scheduled[update.update_id] = started + offset
+            tasks.append(asyncio.ensure_future(self.telegram_bot.handle_message(update, None)))
+        offered_seconds = time.perf_counter() - started
+
+        done, pending = await asyncio.wait(tasks, timeout=drain_timeout) if tasks else (set(), set())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        finished = time.perf_counter()
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        memory.append(rss_mb())
+
+        latencies, errors = [], 0
+        for update_id, arrival in scheduled.items():
+            reply = self.first_reply.get(update_id)
+            if reply is None:
+                continue
+            replied_at, text = reply
+            if text.startswith(ERROR_REPLY_PREFIX):
+                errors += 1
+            else:
+                latencies.append((replied_at - arrival) * 1000)
+        last_reply = max((reply[0] for reply in self.first_reply.values()), default=finished)
+        return {
+            "messages": len(records),
+            "offered_rate": rate,
+            "offered_seconds": offered_seconds,
+            "throughput": len(self.first_reply) / max(last_reply - started, 1e-9),
+            "replies": len(latencies),
+            "error_replies": errors,
+            "unanswered": len(scheduled) - len(self.first_reply),
+            "timed_out": len(pending),
+            "error_rate": (errors + len(scheduled) - len(self.first_reply)) / max(len(scheduled), 1),
+            "latency_ms": percentiles(latencies),
+            "loop_lag_ms": percentiles(lags),
+            "rss_mb": {"start": memory[0], "peak": max(memory), "end": memory[-1]}
+        }
+
+    async def run(self, records: List[Dict], rate: float, seed: int, drain_timeout: float,
+                  settle: float = 2.0) -> Dict:
+        """
+        Build, start, replay and stop.
+
+        After the last reply the services get `settle` seconds to deliver
+        queued side effects (outbox rows, escalation emails) before stopping.
+
+        Returns:
+            Dict with throughput, error counts, latency_ms and loop_lag_ms
+            percentiles, rss_mb, per-stage latency, per-backend calls,
+            outbox entry states and side effects (rows stored, emails sent,
+            escalations)
+        """
+        await self.build()
+        await self.start()
+        tracing.tracer.reset()
+        try:
+            report = await self.replay(records, rate, seed, drain_timeout)
+            await asyncio.sleep(settle)
+            await asyncio.to_thread(self.outbox.flush)
+            report["outbox"] = self.outbox.stats()
+        finally:
+            await self.stop()
+        stages = tracing.tracer.metrics()
+        report["stages_ms"] = dict(sorted(stages.items(), key=lambda item: -item[1]["count"] * item[1]["mean_ms"]))
+        report["slow_traces"] = {"count": tracing.tracer.slow_traces, "sampled": tracing.tracer.sampled_traces,
+                                 "sink": tracing.tracer.sink_path}
+        report["backends"] = {name: model.stats() for name, model in self.latency.items()}
+        report["side_effects"] = {
+            "conversation_rows": self.supabase.rows_inserted,
+            "emails": self.smtp.messages,
+            "smtp_connections": self.smtp.connections,
+            "bookings": self.calendar_api.inserted
+        }
+        report["escalations"] = self.escalation_manager.metrics()
+        return report
+
+def print_report(report: Dict) -> None:
+    latency, lag, rss = report["latency_ms"], report["loop_lag_ms"], report["rss_mb"]
+    print(f"{report['messages']:,} messages offered at {report['offered_rate']:g}/s over "
+          f"{report['offered_seconds']:.1f}s; throughput {report['throughput']:.2f} replies/s")
+    print(f"replies {report['replies']:,}, error replies {report['error_replies']:,}, "
+          f"unanswered {report['unanswered']:,} (error rate {report['error_rate']:.2%})\n")
+    print(f"{'':<22}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for label, values in (("reply latency (ms)", latency), ("event-loop lag (ms)", lag)):
+        if values.get("count"):
+            print(f"{label:<22}{values['p50']:>10.1f}{values['p95']:>10.1f}{values['p99']:>10.1f}{values['max']:>10.1f}")
+    print(f"\nRSS {rss['start']:.0f} MB at start, {rss['peak']:.0f} MB peak, {rss['end']:.0f} MB at end\n")
+
+    print(f"{'stage':<44}{'count':>8}{'mean':>10}{'p95':>10}{'p99':>10}{'errors':>8}")
+    for name, stats in report["stages_ms"].items():
+        print(f"{name:<44}{stats['count']:>8}{stats['mean_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['errors']:>8}")
+    print("\nbackend calls: " + ", ".join(
+        f"{name} {stats['calls']:,} ({stats['errors']} failed)" for name, stats in report["backends"].items()))
+    print("side effects: " + ", ".join(f"{name} {value:,}" for name, value in report["side_effects"].items()))
+    print("outbox: " + ", ".join(
+        f"{destination} {counts}" for destination, counts in report.get("outbox", {}).items()))
+    slow = report["slow_traces"]
+    if slow["sampled"]:
+        print(f"{slow['sampled']} slow traces written to {slow['sink']}")
+
+def check_thresholds(report: Dict, args) -> List[str]:
+    failures = []
+    p95 = report["latency_ms"].get("p95")
+    if args.max_p95_ms is not None and (p95 is None or p95 > args.max_p95_ms):
+        failures.append(f"p95 reply latency {p95} ms exceeds {args.max_p95_ms} ms")
+    lag = report["loop_lag_ms"].get("p99")
+    if args.max_loop_lag_ms is not None and lag is not None and lag > args.max_loop_lag_ms:
+        failures.append(f"p99 event-loop lag {lag:.1f} ms exceeds {args.max_loop_lag_ms} ms")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']:.2%} exceeds {args.max_error_rate:.2%}")
+    return failures
+
+async def run(args) -> int:
+    latency = {}
+    for offset, (name, spec) in enumerate(DEFAULT_LATENCY.items()):
+        latency[name] = LatencyModel.parse(spec, seed=args.seed + offset)
+    for override in args.latency:
+        name, _, spec = override.partition('=')
+        if name not in latency:
+            raise SystemExit(f"Unknown backend {name!r}; choose from {', '.join(latency)}")
+        latency[name] = LatencyModel.parse(spec, seed=args.seed + list(latency).index(name))
+    for model in latency.values():
+        model.scale = args.latency_scale
+
+    records = load_updates(args.updates) if args.updates else synthetic_updates(args.messages, args.users, args.seed)
+    if args.updates and args.messages:
+        records = records[:args.messages]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        tracing.tracer.sink_path = args.trace_sink or os.path.join(workdir, 'slow_traces.jsonl')
+        # Services print their errors; keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            report = await LoadTest(latency, workdir, search_mode=args.search_mode).run(
+                records, args.rate, args.seed, args.drain_timeout, args.settle
+            )
+        tracing.tracer.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+    failures = check_thresholds(report, args)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=5.0, help="Offered updates per second")
+    parser.add_argument("--messages", type=int, default=100, help="Updates to send (caps recorded updates)")
+    parser.add_argument("--users", type=int, default=50, help="Distinct synthetic senders")
+    parser.add_argument("--updates", help="Replay recorded updates from a JSONL file")
+    parser.add_argument("--latency", action="append", default=[], metavar="BACKEND=MEDIAN:P99[:ERRORS]",
+                        help=f"Override a backend's latency/error model; backends: {', '.join(DEFAULT_LATENCY)}")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply every backend delay")
+    parser.add_argument("--search-mode", choices=["rpc", "two_stage"], default="rpc")
+    parser.add_argument("--drain-timeout", type=float, default=120.0,
+                        help="Seconds to wait for in-flight updates after the last arrival")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="Seconds left for queued emails and rows to be delivered before stopping")
+    parser.add_argument("--trace-sink", help="Keep slow traces in this JSONL file")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--max-p95-ms", type=float)
+    parser.add_argument("--max-loop-lag-ms", type=float)
+    parser.add_argument("--max-error-rate", type=float)
+    parser.add_argument("--verbose", action="store_true", help="Keep service INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("services.gmail_service").setLevel(logging.WARNING)
+    sys.exit(asyncio.run(run(args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Recall@k versus latency for coarse-to-fine retrieval.
+
+Runs the two-stage LocalVectorIndex search against an exact full-dimension scan
+over the documents table and reports recall@k and per-query latency for a grid
+of truncated dimensions and candidate multipliers.
+
+Usage:
+    python -m benchmarks.retrieval_benchmark                 # documents table
+    python -m benchmarks.retrieval_benchmark --queries q.txt # real queries (embeds via OpenAI)
+    python -m benchmarks.retrieval_benchmark --synthetic 20000
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from services.vector_index import LocalVectorIndex
+
+async def _with_store(fn):
+    """Run fn(store) against a VectorStore on the configured Supabase project."""
+    from services.supabase_data import SupabaseDataLayer
+    from services.vector_store import VectorStore
+    db = SupabaseDataLayer(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+    try:
+        return await fn(VectorStore(db))
+    finally:
+        await db.close()
+
+def load_corpus(args) -> List[Dict]:
+    """Load the document set, or generate a synthetic one."""
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        # Decaying per-dimension scale mimics the front-loaded information of
+        # text-embedding-3 vectors so that truncation behaves realistically.
+        scale = 1.0 / np.sqrt(np.arange(1, args.dimensions + 1))
+        centers = rng.normal(size=(max(args.synthetic // 50, 1), args.dimensions)) * scale
+        labels = rng.integers(0, centers.shape[0], size=args.synthetic)
+        vectors = centers[labels] + rng.normal(size=(args.synthetic, args.dimensions)) * scale * 0.5
+        return [
+            {'id': i, 'content': f'doc {i}', 'metadata': {}, 'embedding': vector}
+            for i, vector in enumerate(vectors)
+        ]
+
+    return asyncio.run(_with_store(lambda store: store.load_documents()))
+
+def load_queries(args, corpus: List[Dict]) -> List[np.ndarray]:
+    """Embed real queries from a file, or perturb sampled document vectors."""
+    if args.queries:
+        with open(args.queries) as f:
+            lines = [line.strip() for line in f if line.strip()]
+
+        async def embed(store):
+            return [await store._generate_embedding(line) for line in lines]
+
+        return [np.asarray(vector, dtype=np.float32) for vector in asyncio.run(_with_store(embed))]
+
+    rng = np.random.default_rng(args.seed + 1)
+    picks = rng.choice(len(corpus), size=min(args.num_queries, len(corpus)), replace=False)
+    queries = []
+    for i in picks:
+        vector = np.asarray(corpus[i]['embedding'], dtype=np.float32)
+        noise = rng.normal(size=vector.shape).astype(np.float32) * np.linalg.norm(vector) / np.sqrt(vector.size)
+        queries.append(vector + noise * args.noise)
+    return queries
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+def run(args) -> None:
+    corpus = load_corpus(args)
+    if not corpus:
+        print("No documents with embeddings found.")
+        return
+    queries = load_queries(args, corpus)
+    print(f"Corpus: {len(corpus)} documents, {len(queries)} queries, k={args.k}\n")
+
+    baseline = LocalVectorIndex()
+    baseline.build(corpus)
+    truth = []
+    exact_times = []
+    for query in queries:
+        start = time.perf_counter()
+        hits = baseline.exact_search(query, limit=args.k)
+        exact_times.append((time.perf_counter() - start) * 1000)
+        truth.append({hit['id'] for hit in hits})
+
+    header = f"{'mode':<22}{'recall@k':>10}{'mean ms':>10}{'p95 ms':>10}{'speedup':>10}"
+    print(header)
+    print('-' * len(header))
+    exact_mean = float(np.mean(exact_times))
+    print(f"{'exact full-dim':<22}{1.0:>10.3f}{exact_mean:>10.3f}{percentile(exact_times, 95):>10.3f}{1.0:>10.2f}")
+
+    for dims in args.coarse_dims:
+        for multiplier in args.multipliers:
+            index = LocalVectorIndex(coarse_dimensions=dims, candidate_multiplier=multiplier)
+            index.build(corpus)
+            recalls = []
+            times = []
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                hits = index.search(query, limit=args.k)
+                times.append((time.perf_counter() - start) * 1000)
+                recalls.append(len({hit['id'] for hit in hits} & expected) / max(len(expected), 1))
+            mean = float(np.mean(times))
+            label = f"two-stage d={dims} x{multiplier}"
+            print(f"{label:<22}{np.mean(recalls):>10.3f}{mean:>10.3f}{percentile(times, 95):>10.3f}{exact_mean / mean:>10.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--k', type=int, default=3, help='Results per query (recall@k)')
+    parser.add_argument('--queries', help='File with one query per line (embedded via OpenAI)')
+    parser.add_argument('--num-queries', type=int, default=200, help='Sampled queries when no file is given')
+    parser.add_argument('--noise', type=float, default=0.3, help='Relative noise added to sampled queries')
+    parser.add_argument('--synthetic', type=int, default=0, help='Use N synthetic documents instead of Supabase')
+    parser.add_argument('--dimensions', type=int, default=1536, help='Synthetic embedding size')
+    parser.add_argument('--coarse-dims', type=int, nargs='+', default=[64, 128, 256, 512])
+    parser.add_argument('--multipliers', type=int, nargs='+', default=[5, 10, 20])
+    parser.add_argument('--seed', type=int, default=7)
+    run(parser.parse_args())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Message analysis throughput: legacy per-list scans versus the compiled analyzer.
+
+Generates synthetic parent messages and times the original MessageProcessor
+logic (a substring scan per keyword list plus three regexes compiled on each
+call) against TextAnalyzer.analyze, analyze_batch, and analyze_batch over a
+process pool. Also reports how often the two disagree on intent and
+sentiment, which is where whole-word matching changes results.
+
+Usage:
+    python -m benchmarks.text_analysis_benchmark
+    python -m benchmarks.text_analysis_benchmark --messages 200000 --processes 4
+"""
+import argparse
+import re
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from config.config import ESCALATION_KEYWORDS
+from utils.text_analysis import TextAnalyzer
+
+VOCABULARY = (
+    "i would like to book a session for my son daughter in grade 7 next week please what is the "
+    "price of the math course can the tutor help with chemistry homework we are happy unhappy "
+    "thanks the teacher was great but the schedule is bad angry urgent speak to someone about "
+    "fees curriculum english history physics biology instructor appointment on monday at"
+).split()
+EXTRAS = ["10:30 am", "4pm", "12/05/2024", "5 March 2025", "3rd grade", "maths"]
+
+def synthetic_messages(count: int, seed: int) -> List[str]:
+    rng = np.random.default_rng(seed)
+    messages = []
+    for _ in range(count):
+        words = list(rng.choice(VOCABULARY, size=int(rng.integers(5, 40))))
+        if rng.random() < 0.3:
+            words.insert(int(rng.integers(0, len(words))), str(rng.choice(EXTRAS)))
+        messages.append(" ".join(words).capitalize())
+    return messages
+
+def legacy_analyze(message: str) -> Dict:
+    """The original MessageProcessor analysis, one scan per list."""
+    message_lower = message.lower()
+    requires_escalation = any(keyword in message_lower for keyword in ESCALATION_KEYWORDS)
+    if any(word in message_lower for word in ['schedule', 'book', 'appointment']):
+        intent = 'schedule'
+    elif any(word in message_lower for word in ['price', 'cost', 'fee']):
+        intent = 'pricing'
+    elif any(word in message_lower for word in ['program', 'course', 'curriculum']):
+        intent = 'program_info'
+    elif any(word in message_lower for word in ['teacher', 'tutor', 'instructor']):
+        intent = 'teacher_info'
+    else:
+        intent = 'general_inquiry'
+    date_pattern = r'\d{1,2}[-/]\d{1,2}[-/]\d{2,4}|\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4}'
+    time_pattern = r'\d{1,2}:\d{2}\s*(?:AM|PM|am|pm)?|\d{1,2}\s*(?:AM|PM|am|pm)'
+    grade_pattern = r'grade\s+\d{1,2}|\d{1,2}(?:st|nd|rd|th)\s+grade'
+    subjects = ['math', 'science', 'english', 'history', 'physics', 'chemistry', 'biology']
+    entities = {
+        'dates': re.findall(date_pattern, message),
+        'times': re.findall(time_pattern, message),
+        'subjects': [subject for subject in subjects if subject in message.lower()],
+        'grades': re.findall(grade_pattern, message.lower())
+    }
+    positive_words = ['good', 'great', 'excellent', 'happy', 'thanks', 'thank']
+    negative_words = ['bad', 'poor', 'terrible', 'unhappy', 'angry', 'upset']
+    positive_count = sum(1 for word in positive_words if word in message.lower())
+    negative_count = sum(1 for word in negative_words if word in message.lower())
+    sentiment = 'positive' if positive_count > negative_count else 'negative' if negative_count > positive_count else 'neutral'
+    return {'requires_escalation': requires_escalation, 'intent': intent, 'entities': entities, 'sentiment': sentiment}
+
+def timed(label: str, fn, count: int, baseline: float = None) -> float:
+    started = time.perf_counter()
+    results = fn()
+    seconds = time.perf_counter() - started
+    speedup = f"{baseline / seconds:>9.1f}x" if baseline else f"{'':>10}"
+    print(f"{label:<34}{count / seconds:>14,.0f}{seconds:>10.2f}{speedup}")
+    return seconds, results
+
+def run(args) -> None:
+    messages = synthetic_messages(args.messages, args.seed)
+    analyzer = TextAnalyzer()
+    print(f"{len(messages):,} messages, average {np.mean([len(m) for m in messages]):.0f} characters\n")
+    print(f"{'method':<34}{'messages/s':>14}{'seconds':>10}{'speedup':>10}")
+
+    legacy_seconds, legacy = timed("legacy per-list scan", lambda: [legacy_analyze(m) for m in messages], len(messages))
+    _, single = timed("compiled analyze()", lambda: [analyzer.analyze(m) for m in messages], len(messages), legacy_seconds)
+    timed("compiled analyze_batch()", lambda: analyzer.analyze_batch(messages), len(messages), legacy_seconds)
+    if args.processes > 1:
+        timed(f"analyze_batch(processes={args.processes})",
+              lambda: analyzer.analyze_batch(messages, processes=args.processes), len(messages), legacy_seconds)
+
+    for field in ('requires_escalation', 'intent', 'sentiment'):
+        differ = sum(old[field] != new[field] for old, new in zip(legacy, single))
+        print(f"\n{field}: {differ:,} of {len(messages):,} differ from the legacy substring matching", end="")
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes for the pooled batch run")
+    parser.add_argument("--seed", type=int, default=7)
+    run(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,11 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 # Supabase Configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+SUPABASE_TIMEOUT = 10.0  # Seconds per PostgREST request
+SUPABASE_CONNECT_TIMEOUT = 5.0
+SUPABASE_MAX_CONNECTIONS = 20  # Pooled HTTP connections shared by every service
+SUPABASE_MAX_KEEPALIVE_CONNECTIONS = 10
+SUPABASE_SLOW_QUERY_MS = 500  # Queries slower than this are logged
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
@@ -18,10 +23,79 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GOOGLE_CREDENTIALS_PATH = os.getenv('GOOGLE_CREDENTIALS_PATH')
 GOOGLE_SHEETS_ID = os.getenv('GOOGLE_SHEETS_ID')
 HUMAN_ESCALATION_EMAIL = os.getenv('HUMAN_ESCALATION_EMAIL')
+SHEETS_REQUESTS_PER_MINUTE = 60  # Client-side throttle, kept under the per-user Sheets quota
+SHEETS_MAX_RETRIES = 5  # Retries for quota (429) and transient 5xx errors
+SHEETS_BATCH_SIZE = 500  # Rows per values.append call
+SHEETS_FLUSH_INTERVAL = 2.0  # Seconds a partial batch waits for more rows
+SHEET_SNAPSHOT_CHECK_INTERVAL = 30.0  # Seconds between Drive modifiedTime checks for cached sheets
 
 # Vector Store Configuration
 VECTOR_STORE_COLLECTION = 'teachpro_docs'
 EMBEDDING_MODEL = 'text-embedding-3-small'
+VECTOR_SEARCH_MODE = os.getenv('VECTOR_SEARCH_MODE', 'rpc')  # 'rpc' or 'two_stage'
+COARSE_EMBEDDING_DIMENSIONS = 256  # Truncated size used for the candidate scan
+COARSE_CANDIDATE_MULTIPLIER = 10  # Candidates kept per requested result
+
+# Retrieval Filter Configuration
+DOCUMENT_PARTITION_KEY = 'category'  # Metadata key the local index is partitioned on
+INTENT_DOCUMENT_CATEGORIES = {
+    'pricing': 'pricing',
+    'payment': 'pricing',
+    'billing': 'pricing',
+    'schedule': 'scheduling',
+    'scheduling': 'scheduling',
+    'booking': 'scheduling',
+    'availability': 'scheduling',
+    'program_info': 'programs',
+    'curriculum': 'programs',
+    'teacher_info': 'tutors',
+    'tutor_info': 'tutors',
+    'progress': 'progress',
+    'policy': 'policies'
+}
+SUBJECTS = ['math', 'science', 'english', 'history', 'physics', 'chemistry', 'biology']
+SUBJECT_ALIASES = {
+    'maths': 'math',
+    'mathematics': 'math'
+}
+
+# Diversity (MMR) Reranking Configuration
+MMR_ENABLED = os.getenv('MMR_ENABLED', 'true').lower() == 'true'
+MMR_LAMBDA = 0.5  # 1.0 = pure relevance, 0.0 = pure diversity
+MMR_FETCH_MULTIPLIER = 4  # Candidates over-fetched per requested result
+MMR_MAX_PER_SOURCE = 2  # Results allowed from the same metadata source
+
+# Persistence Configuration
+WRITE_BEHIND_BATCH_SIZE = 200  # Rows per bulk insert
+WRITE_BEHIND_FLUSH_INTERVAL = 1.0  # Seconds before a partial batch is flushed
+WRITE_BEHIND_MAX_PENDING = 10000  # Queued rows before producers are pushed back
+
+# User Preferences Cache Configuration
+PREFERENCES_CACHE_SIZE = 10000  # Users kept in memory (LRU beyond this)
+PREFERENCES_CACHE_TTL = 300  # Seconds before a cached entry is re-read
+
+# Conversation History Configuration
+SESSION_HISTORY_LIMIT = 10  # Messages kept in the in-memory session tail
+HISTORY_HYDRATION_LIMIT = 10  # Messages loaded from Supabase on a user's first message
+HISTORY_LOOKBACK_DAYS = 90  # Recent-history reads only scan partitions in this window
+HISTORY_RETENTION_MONTHS = 12  # Monthly partitions older than this are archived and dropped
+HISTORY_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', 'data/history_archive')
+MESSAGE_HISTORY_SIZE = 20  # Messages MessageProcessor keeps per user (oldest overwritten)
+MESSAGE_HISTORY_IDLE_TIMEOUT = 3600  # Seconds of inactivity before a user's history is dropped
+MESSAGE_HISTORY_MAX_USERS = 10000  # Users with in-memory history (least recently active evicted)
+DATABASE_URL = os.getenv('DATABASE_URL')  # Direct Postgres connection for maintenance jobs
+
+# Outbox Configuration (durable queue for emails, Sheets and Supabase writes)
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'data/outbox.sqlite3')
+OUTBOX_COMMIT_INTERVAL = 0.05  # Seconds of enqueues grouped into one fsync
+OUTBOX_POLL_INTERVAL = 1.0  # Seconds between checks for retries that became due
+OUTBOX_MAX_ATTEMPTS = 10  # Attempts before an entry is marked dead
+
+# Tracing Configuration (per-update stage timings)
+TRACE_SLOW_MS = 3000  # Traces slower than this are candidates for the JSONL sink
+TRACE_SLOW_SAMPLE_RATE = 1.0  # Fraction of slow traces written to the sink
+TRACE_SINK_PATH = os.getenv('TRACE_SINK_PATH', 'data/slow_traces.jsonl')
+TRACE_MAX_SPANS = 200  # Spans kept per trace; later spans still feed the histograms
 
 # Response Configuration
 MAX_RESPONSE_LENGTH = 1000
@@ -30,6 +104,21 @@ CONFIDENCE_THRESHOLD = 0.7
 # Calendar Configuration
 CALENDAR_ID = os.getenv('CALENDAR_ID')
 TIMEZONE = 'UTC'
+CALENDAR_SYNC_INTERVAL = 60  # Seconds between incremental event syncs
+CALENDAR_SYNC_HORIZON_DAYS = 60  # Days ahead a full sync lists; resynced once half has elapsed
+
+# Availability Configuration (tutor hours come from this sheet: Tutor, Day, Start, End[, Subject, Calendar])
+AVAILABILITY_SHEET = 'Availability'
+AVAILABILITY_DAYS_AHEAD = 14  # Days of open slots kept precomputed
+AVAILABILITY_REFRESH_INTERVAL = 300  # Seconds between background refreshes
+AVAILABILITY_SLOT_MINUTES = 60  # Length of an offered session
+AVAILABILITY_MAX_SLOTS = 20  # Slots handed to the LLM per question
+
+# Reservation Configuration
+RESERVATION_HOLD_SECONDS = 300  # How long an offered slot stays held for a parent
+RESERVATION_BATCH_SIZE = 50  # Event inserts per Calendar batch request (API maximum)
+RESERVATION_CONFIRM_LINGER = 0.2  # Seconds a confirmation waits to share a batch
+RESERVATION_SWEEP_INTERVAL = 5  # Seconds between expired-hold sweeps
 
 # Escalation Configuration
 ESCALATION_KEYWORDS = [
@@ -40,7 +129,39 @@ ESCALATION_KEYWORDS = [
     'help me',
     'urgent'
 ]
+ESCALATION_DEDUPE_WINDOW = 1800  # Seconds a user's escalations keep joining the same case
+ESCALATION_DIGEST_MODE = os.getenv('ESCALATION_DIGEST_MODE', 'false').lower() == 'true'
+ESCALATION_FLUSH_INTERVAL = 300  # Seconds between case updates / digests
+ESCALATION_MAX_EMAILS_PER_HOUR = 30
+ESCALATION_BREAKER_THRESHOLD = 5  # Failed sends in a row before delivery pauses
+ESCALATION_BREAKER_COOLDOWN = 300  # Seconds delivery stays paused
+
+# Text Analysis Configuration (keywords match whole words, plus plural/-ed/-ing forms)
+INTENT_KEYWORDS = {  # Checked in order: the first intent with a match wins
+    'schedule': ['schedule', 'book', 'appointment'],
+    'pricing': ['price', 'cost', 'fee'],
+    'program_info': ['program', 'course', 'curriculum'],
+    'teacher_info': ['teacher', 'tutor', 'instructor']
+}
+POSITIVE_WORDS = ['good', 'great', 'excellent', 'happy', 'thanks', 'thank']
+NEGATIVE_WORDS = ['bad', 'poor', 'terrible', 'unhappy', 'angry', 'upset']
+TOPIC_KEYWORDS = {  # Conversation topics, checked in order
+    'schedule': ['schedule', 'booking', 'appointment', 'session'],
+    'pricing': ['price', 'cost', 'fee', 'payment'],
+    'curriculum': ['curriculum', 'syllabus', 'course', 'subject'],
+    'support': ['help', 'support', 'assist', 'issue']
+}
+RECLASSIFY_PAGE_SIZE = 5000  # conversation_history rows fetched and written back per request
+RECLASSIFY_CHUNK_SIZE = 1000  # Rows per process-pool task
 
 # Gmail Configuration
 GMAIL_EMAIL = os.getenv('GMAIL_EMAIL')
-GMAIL_APP_PASSWORD = os.getenv('GMAIL_APP_PASSWORD') 
\ No newline at end of file
+GMAIL_APP_PASSWORD = os.getenv('GMAIL_APP_PASSWORD')
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '465'))
+SMTP_USE_SSL = os.getenv('SMTP_USE_SSL', 'true').lower() == 'true'  # False for a local test server
+SMTP_POOL_SIZE = 2  # Persistent SMTP connections (and sending workers)
+SMTP_QUEUE_SIZE = 100  # Emails waiting to be sent before senders wait
+SMTP_TIMEOUT = 30.0
+SMTP_IDLE_TIMEOUT = 240.0  # Reconnect instead of reusing a connection idle this long
+SMTP_HEALTH_CHECK_INTERVAL = 30.0  # NOOP a connection idle this long before reuse
\ No newline at end of file
@@ -0,0 +1,91 @@
+-- One-off conversion of an existing, unpartitioned conversation_history table
+-- to the monthly partitioned layout defined in schema.sql.
+-- Run once (psql -f) in a maintenance window; the bot should be stopped so no
+-- rows are written while the data is copied.
+-- Requires the functions from schema.sql (ensure_conversation_history_partitions,
+-- refresh_conversation_summaries and the conversation_summaries triggers).
+
+BEGIN;
+
+-- Move the old table and its indexes out of the way
+ALTER TABLE conversation_history RENAME TO conversation_history_unpartitioned;
+ALTER INDEX IF EXISTS idx_conversation_history_user_timestamp
+    RENAME TO idx_conversation_history_unpartitioned_user_timestamp;
+ALTER INDEX IF EXISTS idx_conversation_history_metadata
+    RENAME TO idx_conversation_history_unpartitioned_metadata;
+ALTER INDEX IF EXISTS idx_conversation_history_timestamp_id
+    RENAME TO idx_conversation_history_unpartitioned_timestamp_id;
+DROP TRIGGER IF EXISTS trg_conversation_summaries_insert ON conversation_history_unpartitioned;
+DROP TRIGGER IF EXISTS trg_conversation_summaries_delete ON conversation_history_unpartitioned;
+
+CREATE TABLE conversation_history (
+    id BIGSERIAL,
+    user_id UUID NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    metadata JSONB DEFAULT '{}',
+    timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE INDEX idx_conversation_history_user_timestamp
+ON conversation_history(user_id, timestamp DESC);
+
+CREATE INDEX idx_conversation_history_metadata
+ON conversation_history USING GIN (metadata);
+
+CREATE INDEX idx_conversation_history_timestamp_id
+ON conversation_history(timestamp, id);
+
+-- Monthly partitions from the oldest stored month to three months ahead
+SELECT ensure_conversation_history_partitions(
+    (
+        EXTRACT(YEAR FROM age(date_trunc('month', NOW()), date_trunc('month', MIN(timestamp)))) * 12
+        + EXTRACT(MONTH FROM age(date_trunc('month', NOW()), date_trunc('month', MIN(timestamp))))
+    )::INT + 3,
+    MIN(timestamp)
+)
+FROM conversation_history_unpartitioned
+HAVING MIN(timestamp) IS NOT NULL;
+
+SELECT ensure_conversation_history_partitions();
+
+CREATE TABLE conversation_history_default
+PARTITION OF conversation_history DEFAULT;
+
+INSERT INTO conversation_history (id, user_id, role, content, metadata, timestamp, created_at)
+SELECT id, user_id, role, content, metadata, timestamp, created_at
+FROM conversation_history_unpartitioned;
+
+SELECT setval(
+    pg_get_serial_sequence('conversation_history', 'id'),
+    (SELECT COALESCE(MAX(id), 0) + 1 FROM conversation_history),
+    false
+);
+
+CREATE TRIGGER trg_conversation_summaries_insert
+AFTER INSERT ON conversation_history
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION conversation_summaries_apply_inserts();
+
+CREATE TRIGGER trg_conversation_summaries_delete
+AFTER DELETE ON conversation_history
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION conversation_summaries_apply_deletes();
+
+ALTER TABLE conversation_history ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can only access their own conversation history"
+ON conversation_history
+FOR ALL
+USING (auth.uid() = user_id);
+
+-- Summaries were built from the old table; rebuild them from the copy
+SELECT refresh_conversation_summaries();
+
+DROP TABLE conversation_history_unpartitioned;
+
+COMMIT;
@@ -0,0 +1,9 @@
+-- Adds the client_row_id column and unique index from schema.sql to an
+-- existing conversation_history table. Outbox batches upsert on
+-- (client_row_id, timestamp), so run this before deploying that change.
+-- Safe to run more than once.
+
+ALTER TABLE conversation_history ADD COLUMN IF NOT EXISTS client_row_id UUID;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_conversation_history_client_row_id
+ON conversation_history(client_row_id, timestamp);
@@ -0,0 +1,66 @@
+-- Adds conversation_summaries_archived from schema.sql to an existing
+-- database and seeds it with the counts of partitions that
+-- history_retention.py has already dropped, taken as whatever
+-- conversation_summaries counts beyond the rows still in conversation_history.
+-- Run once, before replacing jsonb_sum_counts,
+-- archive_conversation_partition_counts and refresh_conversation_summaries
+-- with the versions in schema.sql. Counts already lost to an earlier full
+-- refresh can only be restored from the archive files.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS conversation_summaries_archived (
+    user_id UUID NOT NULL,
+    partition_name TEXT NOT NULL,
+    total_messages BIGINT NOT NULL DEFAULT 0,
+    role_counts JSONB NOT NULL DEFAULT '{}',
+    intent_counts JSONB NOT NULL DEFAULT '{}',
+    first_message_at TIMESTAMPTZ,
+    last_message_at TIMESTAMPTZ,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, partition_name)
+);
+
+ALTER TABLE conversation_summaries_archived ENABLE ROW LEVEL SECURITY;
+
+WITH live AS (
+    SELECT
+        u.user_id,
+        u.total,
+        u.first_at,
+        (SELECT jsonb_object_agg(r.role, r.n)
+         FROM (SELECT role, COUNT(*) AS n FROM conversation_history
+               WHERE user_id = u.user_id GROUP BY role) AS r) AS role_counts,
+        (SELECT jsonb_object_agg(i.intent, i.n)
+         FROM (SELECT metadata->>'intent' AS intent, COUNT(*) AS n FROM conversation_history
+               WHERE user_id = u.user_id AND role = 'user' AND metadata ? 'intent'
+               GROUP BY 1) AS i) AS intent_counts
+    FROM (
+        SELECT user_id, COUNT(*) AS total, MIN(timestamp) AS first_at
+        FROM conversation_history
+        GROUP BY user_id
+    ) AS u
+)
+INSERT INTO conversation_summaries_archived
+    (user_id, partition_name, total_messages, role_counts, intent_counts, first_message_at, last_message_at)
+SELECT
+    s.user_id,
+    'before_migration_003',
+    s.total_messages - COALESCE(l.total, 0),
+    (SELECT COALESCE(jsonb_object_agg(d.key, d.n), '{}'::JSONB)
+     FROM (SELECT key, value::BIGINT - COALESCE((l.role_counts->>key)::BIGINT, 0) AS n
+           FROM jsonb_each_text(s.role_counts)) AS d
+     WHERE d.n > 0),
+    (SELECT COALESCE(jsonb_object_agg(d.key, d.n), '{}'::JSONB)
+     FROM (SELECT key, value::BIGINT - COALESCE((l.intent_counts->>key)::BIGINT, 0) AS n
+           FROM jsonb_each_text(s.intent_counts)) AS d
+     WHERE d.n > 0),
+    s.first_message_at,
+    -- Archived rows are older than every live row
+    LEAST(s.last_message_at, l.first_at)
+FROM conversation_summaries AS s
+LEFT JOIN live AS l ON l.user_id = s.user_id
+WHERE s.total_messages > COALESCE(l.total, 0)
+ON CONFLICT (user_id, partition_name) DO NOTHING;
+
+COMMIT;
@@ -1,13 +1,18 @@
--- Create conversation_history table
+-- Create conversation_history table, partitioned by month on timestamp so
+-- inserts and indexes stay small and old months can be detached and archived.
+-- To convert an existing unpartitioned table run
+-- database/migrations/001_partition_conversation_history.sql instead.
 CREATE TABLE IF NOT EXISTS conversation_history (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     user_id UUID NOT NULL,  -- Using UUID type
     role TEXT NOT NULL,
     content TEXT NOT NULL,
     metadata JSONB DEFAULT '{}',  -- Added metadata field
     timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    client_row_id UUID,  -- Derived from the outbox idempotency key; NULL for direct inserts
+    PRIMARY KEY (id, timestamp)  -- Partition key must be part of the primary key
+) PARTITION BY RANGE (timestamp);
 
 -- Create indexes for faster queries
 CREATE INDEX IF NOT EXISTS idx_conversation_history_user_timestamp 
@@ -16,6 +21,331 @@ ON conversation_history(user_id, timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_conversation_history_metadata 
 ON conversation_history USING GIN (metadata);
 
+-- Keyset pagination for bulk exports: ORDER BY timestamp, id
+CREATE INDEX IF NOT EXISTS idx_conversation_history_timestamp_id
+ON conversation_history(timestamp, id);
+
+-- Outbox resends upsert with ON CONFLICT DO NOTHING on this key, so a batch
+-- that was written but not acknowledged is not stored twice
+CREATE UNIQUE INDEX IF NOT EXISTS idx_conversation_history_client_row_id
+ON conversation_history(client_row_id, timestamp);
+
+-- Create monthly partitions (UTC) from p_from's month through p_months_ahead
+-- months later; existing partitions are left alone. Run daily, e.g. with
+-- pg_cron: SELECT cron.schedule('conversation-history-partitions', '0 3 * * *',
+--          'SELECT ensure_conversation_history_partitions()');
+-- services/memory/history_retention.py also calls it on every run.
+CREATE OR REPLACE FUNCTION ensure_conversation_history_partitions(
+    p_months_ahead INT DEFAULT 3,
+    p_from TIMESTAMPTZ DEFAULT NOW()
+) RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', p_from AT TIME ZONE 'UTC');
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    FOR i IN 0..p_months_ahead LOOP
+        partition_name := format('conversation_history_y%sm%s',
+                                 to_char(month_start, 'YYYY'), to_char(month_start, 'MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF conversation_history FOR VALUES FROM (%L) TO (%L)',
+                partition_name,
+                month_start AT TIME ZONE 'UTC',
+                (month_start + INTERVAL '1 month') AT TIME ZONE 'UTC'
+            );
+            created := created + 1;
+        END IF;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$;
+
+-- Catches rows outside every monthly partition so inserts never fail
+CREATE TABLE IF NOT EXISTS conversation_history_default
+PARTITION OF conversation_history DEFAULT;
+
+SELECT ensure_conversation_history_partitions();
+
+-- Per-user conversation aggregates, maintained incrementally by triggers so
+-- summaries are a single-row read that covers the whole history
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    user_id UUID PRIMARY KEY,
+    total_messages BIGINT NOT NULL DEFAULT 0,
+    role_counts JSONB NOT NULL DEFAULT '{}',    -- {"user": 12, "assistant": 12}
+    intent_counts JSONB NOT NULL DEFAULT '{}',  -- intents of user messages (metadata->>'intent')
+    first_message_at TIMESTAMPTZ,
+    last_message_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Add two {"key": count} objects key by key; keys that sum to zero are dropped
+CREATE OR REPLACE FUNCTION jsonb_add_counts(a JSONB, b JSONB)
+RETURNS JSONB
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::JSONB)
+    FROM (
+        SELECT key, SUM(value::BIGINT) AS total
+        FROM (
+            SELECT * FROM jsonb_each_text(COALESCE(a, '{}'::JSONB))
+            UNION ALL
+            SELECT * FROM jsonb_each_text(COALESCE(b, '{}'::JSONB))
+        ) AS pairs
+        GROUP BY key
+        HAVING SUM(value::BIGINT) <> 0
+    ) AS sums;
+$$;
+
+-- Fold a statement's inserted rows into the summaries, one upsert per user
+CREATE OR REPLACE FUNCTION conversation_summaries_apply_inserts()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO conversation_summaries AS s
+        (user_id, total_messages, role_counts, intent_counts, first_message_at, last_message_at, updated_at)
+    SELECT
+        u.user_id,
+        u.total,
+        (SELECT jsonb_object_agg(r.role, r.n)
+         FROM (SELECT role, COUNT(*) AS n FROM new_rows
+               WHERE user_id = u.user_id GROUP BY role) AS r),
+        COALESCE(
+            (SELECT jsonb_object_agg(i.intent, i.n)
+             FROM (SELECT metadata->>'intent' AS intent, COUNT(*) AS n FROM new_rows
+                   WHERE user_id = u.user_id AND role = 'user' AND metadata ? 'intent'
+                   GROUP BY 1) AS i),
+            '{}'::JSONB
+        ),
+        u.first_at,
+        u.last_at,
+        NOW()
+    FROM (
+        SELECT user_id, COUNT(*) AS total, MIN(timestamp) AS first_at, MAX(timestamp) AS last_at
+        FROM new_rows
+        GROUP BY user_id
+    ) AS u
+    ON CONFLICT (user_id) DO UPDATE
+    SET total_messages = s.total_messages + EXCLUDED.total_messages,
+        role_counts = jsonb_add_counts(s.role_counts, EXCLUDED.role_counts),
+        intent_counts = jsonb_add_counts(s.intent_counts, EXCLUDED.intent_counts),
+        first_message_at = LEAST(s.first_message_at, EXCLUDED.first_message_at),
+        last_message_at = GREATEST(s.last_message_at, EXCLUDED.last_message_at),
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$;
+
+-- Sum {"key": count} objects across rows
+CREATE OR REPLACE AGGREGATE jsonb_sum_counts(JSONB) (
+    SFUNC = jsonb_add_counts,
+    STYPE = JSONB,
+    INITCOND = '{}'
+);
+
+-- Per-user counts of partitions dropped by services/memory/history_retention.py,
+-- one row per user and partition. Refreshes add them back so summaries keep
+-- covering the whole history after the rows themselves are gone.
+CREATE TABLE IF NOT EXISTS conversation_summaries_archived (
+    user_id UUID NOT NULL,
+    partition_name TEXT NOT NULL,
+    total_messages BIGINT NOT NULL DEFAULT 0,
+    role_counts JSONB NOT NULL DEFAULT '{}',
+    intent_counts JSONB NOT NULL DEFAULT '{}',
+    first_message_at TIMESTAMPTZ,
+    last_message_at TIMESTAMPTZ,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, partition_name)
+);
+
+-- Record a detached partition's per-user counts before it is dropped.
+-- Running it again for the same partition replaces its rows.
+CREATE OR REPLACE FUNCTION archive_conversation_partition_counts(p_partition TEXT)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    recorded INTEGER;
+BEGIN
+    DELETE FROM conversation_summaries_archived WHERE partition_name = p_partition;
+
+    EXECUTE format($sql$
+        INSERT INTO conversation_summaries_archived
+            (user_id, partition_name, total_messages, role_counts, intent_counts, first_message_at, last_message_at)
+        SELECT
+            u.user_id,
+            %1$L,
+            u.total,
+            (SELECT jsonb_object_agg(r.role, r.n)
+             FROM (SELECT role, COUNT(*) AS n FROM %1$I
+                   WHERE user_id = u.user_id GROUP BY role) AS r),
+            COALESCE(
+                (SELECT jsonb_object_agg(i.intent, i.n)
+                 FROM (SELECT metadata->>'intent' AS intent, COUNT(*) AS n FROM %1$I
+                       WHERE user_id = u.user_id AND role = 'user' AND metadata ? 'intent'
+                       GROUP BY 1) AS i),
+                '{}'::JSONB
+            ),
+            u.first_at,
+            u.last_at
+        FROM (
+            SELECT user_id, COUNT(*) AS total, MIN(timestamp) AS first_at, MAX(timestamp) AS last_at
+            FROM %1$I
+            GROUP BY user_id
+        ) AS u
+    $sql$, p_partition);
+
+    GET DIAGNOSTICS recorded = ROW_COUNT;
+    RETURN recorded;
+END;
+$$;
+
+-- Recompute summaries exactly from conversation_history plus the archived
+-- counts of dropped partitions (all users when NULL).
+-- Used after deletes and to backfill: SELECT refresh_conversation_summaries();
+CREATE OR REPLACE FUNCTION refresh_conversation_summaries(p_user_ids UUID[] DEFAULT NULL)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM conversation_summaries
+    WHERE p_user_ids IS NULL OR user_id = ANY(p_user_ids);
+
+    WITH live AS (
+        SELECT user_id, COUNT(*) AS total, MIN(timestamp) AS first_at, MAX(timestamp) AS last_at
+        FROM conversation_history
+        WHERE p_user_ids IS NULL OR user_id = ANY(p_user_ids)
+        GROUP BY user_id
+    ),
+    parts AS (
+        SELECT
+            u.user_id,
+            u.total,
+            (SELECT jsonb_object_agg(r.role, r.n)
+             FROM (SELECT role, COUNT(*) AS n FROM conversation_history
+                   WHERE user_id = u.user_id GROUP BY role) AS r) AS role_counts,
+            COALESCE(
+                (SELECT jsonb_object_agg(i.intent, i.n)
+                 FROM (SELECT metadata->>'intent' AS intent, COUNT(*) AS n FROM conversation_history
+                       WHERE user_id = u.user_id AND role = 'user' AND metadata ? 'intent'
+                       GROUP BY 1) AS i),
+                '{}'::JSONB
+            ) AS intent_counts,
+            u.first_at,
+            u.last_at
+        FROM live AS u
+        UNION ALL
+        SELECT user_id, total_messages, role_counts, intent_counts, first_message_at, last_message_at
+        FROM conversation_summaries_archived
+        WHERE p_user_ids IS NULL OR user_id = ANY(p_user_ids)
+    )
+    INSERT INTO conversation_summaries
+        (user_id, total_messages, role_counts, intent_counts, first_message_at, last_message_at, updated_at)
+    SELECT
+        user_id,
+        SUM(total),
+        jsonb_sum_counts(role_counts),
+        jsonb_sum_counts(intent_counts),
+        MIN(first_at),
+        MAX(last_at),
+        NOW()
+    FROM parts
+    GROUP BY user_id;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION conversation_summaries_apply_deletes()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM refresh_conversation_summaries(ARRAY(SELECT DISTINCT user_id FROM old_rows));
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_conversation_summaries_insert ON conversation_history;
+CREATE TRIGGER trg_conversation_summaries_insert
+AFTER INSERT ON conversation_history
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION conversation_summaries_apply_inserts();
+
+DROP TRIGGER IF EXISTS trg_conversation_summaries_delete ON conversation_history;
+CREATE TRIGGER trg_conversation_summaries_delete
+AFTER DELETE ON conversation_history
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION conversation_summaries_apply_deletes();
+
+-- Bulk write-back for services/memory/history_reclassify.py. p_rows is a JSON
+-- array of {"id", "timestamp", "tags"}; tags are merged into metadata. The
+-- timestamp lets each row be found in its partition. Metadata updates do not
+-- fire the summary triggers, so the same statement moves each changed user
+-- message's intent count in conversation_summaries from its old intent to its
+-- new one; no refresh is needed and archived counts are left alone.
+CREATE OR REPLACE FUNCTION reclassify_conversation_history(p_rows JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    updated INTEGER;
+BEGIN
+    WITH r AS (
+        SELECT (item->>'id')::BIGINT AS id,
+               (item->>'timestamp')::TIMESTAMPTZ AS ts,
+               item->'tags' AS tags
+        FROM jsonb_array_elements(p_rows) AS item
+    ),
+    -- Read in the statement's snapshot, so these are the intents before the update
+    previous AS (
+        SELECT h.id, h.timestamp, h.metadata->>'intent' AS intent
+        FROM conversation_history AS h
+        JOIN r ON h.id = r.id AND h.timestamp = r.ts
+    ),
+    changed AS (
+        UPDATE conversation_history AS h
+        SET metadata = COALESCE(h.metadata, '{}'::JSONB) || r.tags
+        FROM r
+        JOIN previous ON previous.id = r.id AND previous.timestamp = r.ts
+        WHERE h.id = r.id AND h.timestamp = r.ts
+        RETURNING h.user_id, h.role, previous.intent AS old_intent, h.metadata->>'intent' AS new_intent
+    ),
+    deltas AS (
+        SELECT user_id, jsonb_object_agg(intent, n) AS delta
+        FROM (
+            SELECT user_id, intent, SUM(n) AS n
+            FROM (
+                SELECT user_id, new_intent AS intent, 1 AS n
+                FROM changed WHERE role = 'user' AND new_intent IS NOT NULL
+                UNION ALL
+                SELECT user_id, old_intent, -1
+                FROM changed WHERE role = 'user' AND old_intent IS NOT NULL
+            ) AS moves
+            GROUP BY user_id, intent
+            HAVING SUM(n) <> 0
+        ) AS per_intent
+        GROUP BY user_id
+    ),
+    summaries AS (
+        UPDATE conversation_summaries AS s
+        SET intent_counts = jsonb_add_counts(s.intent_counts, deltas.delta),
+            updated_at = NOW()
+        FROM deltas
+        WHERE s.user_id = deltas.user_id
+        RETURNING s.user_id
+    )
+    SELECT COUNT(*) INTO updated FROM changed;
+
+    RETURN updated;
+END;
+$$;
+
 -- Create user_preferences table
 CREATE TABLE IF NOT EXISTS user_preferences (
     id BIGSERIAL PRIMARY KEY,
@@ -29,9 +359,40 @@ CREATE TABLE IF NOT EXISTS user_preferences (
 CREATE INDEX IF NOT EXISTS idx_user_preferences_user_id 
 ON user_preferences(user_id);
 
+-- Merge a partial document into a user's preferences in a single statement.
+-- Top-level keys in p_patch replace the stored ones; other keys are kept.
+CREATE OR REPLACE FUNCTION merge_user_preferences(p_user_id UUID, p_patch JSONB)
+RETURNS JSONB
+LANGUAGE sql
+AS $$
+    INSERT INTO user_preferences AS up (user_id, preferences, updated_at)
+    VALUES (p_user_id, p_patch, NOW())
+    ON CONFLICT (user_id) DO UPDATE
+    SET preferences = up.preferences || EXCLUDED.preferences,
+        updated_at = NOW()
+    RETURNING up.preferences;
+$$;
+
+-- Batch variant: p_patches is [{"user_id": "<uuid>", "patch": {...}}, ...]
+-- with at most one entry per user.
+CREATE OR REPLACE FUNCTION merge_user_preferences_batch(p_patches JSONB)
+RETURNS TABLE (user_id UUID, preferences JSONB)
+LANGUAGE sql
+AS $$
+    INSERT INTO user_preferences AS up (user_id, preferences, updated_at)
+    SELECT (item->>'user_id')::UUID, item->'patch', NOW()
+    FROM jsonb_array_elements(p_patches) AS item
+    ON CONFLICT (user_id) DO UPDATE
+    SET preferences = up.preferences || EXCLUDED.preferences,
+        updated_at = NOW()
+    RETURNING up.user_id, up.preferences;
+$$;
+
 -- Create RLS policies
 ALTER TABLE conversation_history ENABLE ROW LEVEL SECURITY;
 ALTER TABLE user_preferences ENABLE ROW LEVEL SECURITY;
+ALTER TABLE conversation_summaries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE conversation_summaries_archived ENABLE ROW LEVEL SECURITY;
 
 -- Policy for conversation_history
 CREATE POLICY "Users can only access their own conversation history"
@@ -39,8 +400,87 @@ ON conversation_history
 FOR ALL
 USING (auth.uid() = user_id);
 
+-- Policy for conversation_summaries
+CREATE POLICY "Users can only access their own conversation summary"
+ON conversation_summaries
+FOR ALL
+USING (auth.uid() = user_id);
+
 -- Policy for user_preferences
 CREATE POLICY "Users can only access their own preferences"
 ON user_preferences
 FOR ALL
-USING (auth.uid() = user_id);
\ No newline at end of file
+USING (auth.uid() = user_id);
+
+-- Documents used for retrieval (pgvector)
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS documents (
+    id BIGSERIAL PRIMARY KEY,
+    content TEXT,
+    metadata JSONB DEFAULT '{}',  -- e.g. {"category": "pricing", "subjects": ["math"], "source": "..."}
+    embedding VECTOR(1536)
+);
+
+-- Metadata filters: containment for match_documents, category for partitioned scans
+CREATE INDEX IF NOT EXISTS idx_documents_metadata
+ON documents USING GIN (metadata jsonb_path_ops);
+
+CREATE INDEX IF NOT EXISTS idx_documents_category
+ON documents ((metadata->>'category'));
+
+-- Similarity search restricted to documents whose metadata contains the filter
+CREATE OR REPLACE FUNCTION match_documents (
+    query_embedding VECTOR(1536),
+    match_count INT DEFAULT NULL,
+    filter JSONB DEFAULT '{}'
+) RETURNS TABLE (
+    id BIGINT,
+    content TEXT,
+    metadata JSONB,
+    similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        d.id,
+        d.content,
+        d.metadata,
+        1 - (d.embedding <=> query_embedding) AS similarity
+    FROM documents d
+    WHERE d.metadata @> filter
+    ORDER BY d.embedding <=> query_embedding
+    LIMIT match_count;
+END;
+$$;
+
+-- match_documents plus each match's embedding, so MMR reranking needs no second query
+CREATE OR REPLACE FUNCTION match_documents_with_embeddings (
+    query_embedding VECTOR(1536),
+    match_count INT DEFAULT NULL,
+    filter JSONB DEFAULT '{}'
+) RETURNS TABLE (
+    id BIGINT,
+    content TEXT,
+    metadata JSONB,
+    similarity FLOAT,
+    embedding VECTOR(1536)
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        d.id,
+        d.content,
+        d.metadata,
+        1 - (d.embedding <=> query_embedding) AS similarity,
+        d.embedding
+    FROM documents d
+    WHERE d.metadata @> filter
+    ORDER BY d.embedding <=> query_embedding
+    LIMIT match_count;
+END;
+$$;
@@ -5,20 +5,35 @@ import warnings
 from typing import Dict, List, Optional
 
 from dotenv import load_dotenv
-from supabase import create_client, Client
 from telegram import Update
 from telegram.ext import CommandHandler, MessageHandler, filters, ContextTypes
 
+from services.supabase_data import SupabaseDataLayer
 from services.vector_store import VectorStore
 from services.google_sheets import GoogleSheetsService
 from services.google_calendar import GoogleCalendarService
+from services.calendar_cache import CalendarEventCache
+from services.availability import AvailabilityService
+from services.reservations import ReservationLedger
 from services.gmail_service import GmailService
+from services.escalation_manager import EscalationManager
 from services.llm_service import LLMService
 from services.conversation_logger import ConversationLogger
 from services.memory.conversation_memory import ConversationMemory
 from services.memory.user_preferences import UserPreferences
 from services.memory.session_manager import SessionManager
 from services.telegram_bot import TelegramBot
+from services.outbox import Outbox, CONVERSATION_ROWS, ESCALATION_EMAILS, ESCALATION_UPDATES, SHEET_ROWS
+from utils.tracing import tracer
+from config.config import (
+    OUTBOX_PATH,
+    OUTBOX_COMMIT_INTERVAL,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    WRITE_BEHIND_BATCH_SIZE,
+    SHEETS_BATCH_SIZE,
+    SHEETS_FLUSH_INTERVAL
+)
 
 # Suppress Google API client warnings
 warnings.filterwarnings('ignore', message='file_cache is only supported with oauth2client<4.0.0')
@@ -59,17 +74,14 @@ class TeachProBot:
             # Check environment variables
             check_required_env_vars()
             
-            # Initialize Supabase client
-            self.supabase: Client = create_client(
+            # One pooled async Supabase connection shared by every service
+            self.db = SupabaseDataLayer(
                 os.getenv('SUPABASE_URL'),
                 os.getenv('SUPABASE_KEY')
             )
 
             # Initialize services
-            self.vector_store = VectorStore(
-                os.getenv('SUPABASE_URL'),
-                os.getenv('SUPABASE_KEY')
-            )
+            self.vector_store = VectorStore(self.db)
             self.sheets_service = GoogleSheetsService(
                 os.getenv('GOOGLE_CREDENTIALS_PATH'),
                 os.getenv('GOOGLE_SHEETS_ID')
@@ -78,20 +90,66 @@ class TeachProBot:
                 os.getenv('GOOGLE_CREDENTIALS_PATH'),
                 os.getenv('CALENDAR_ID')
             )
+            # Busy times are read from a locally synced copy of the calendars
+            self.calendar_service.event_cache = CalendarEventCache(
+                self.calendar_service.service,
+                [self.calendar_service.calendar_id]
+            )
+            # Short-lived holds keep concurrent bookings of one slot from colliding
+            self.reservations = ReservationLedger(self.calendar_service)
+            self.calendar_service.ledger = self.reservations
+            self.availability_service = AvailabilityService(
+                self.sheets_service,
+                self.calendar_service,
+                ledger=self.reservations
+            )
             self.gmail_service = GmailService(
                 os.getenv('GMAIL_EMAIL'),
                 os.getenv('GMAIL_APP_PASSWORD'),
                 os.getenv('HUMAN_ESCALATION_EMAIL')
             )
             self.llm_service = LLMService(os.getenv('OPENAI_API_KEY'))
+
+            # Durable outbox for every external side effect
+            self.outbox = Outbox(
+                OUTBOX_PATH,
+                commit_interval=OUTBOX_COMMIT_INTERVAL,
+                poll_interval=OUTBOX_POLL_INTERVAL,
+                max_attempts=OUTBOX_MAX_ATTEMPTS
+            )
+
+            # Initialize memory services
+            self.conversation_memory = ConversationMemory(
+                self.db,
+                write_buffer=self.outbox.channel(CONVERSATION_ROWS)
+            )
             self.conversation_logger = ConversationLogger(
                 self.sheets_service,
-                self.supabase
+                self.db,
+                write_buffer=self.conversation_memory.write_buffer,
+                outbox=self.outbox
             )
 
-            # Initialize memory services
-            self.conversation_memory = ConversationMemory(self.supabase)
-            self.user_preferences = UserPreferences(self.supabase)
+            # Outbox destinations: conversation rows drain as bulk inserts
+            self.outbox.register_batch(
+                CONVERSATION_ROWS,
+                self.conversation_memory.insert_rows,
+                batch_size=WRITE_BEHIND_BATCH_SIZE,
+                keyed=True  # Resends are ignored via client_row_id
+            )
+            # One email thread per escalation case, rate-limited behind a circuit breaker
+            self.escalation_manager = EscalationManager(self.gmail_service, outbox=self.outbox)
+            self.outbox.register(ESCALATION_EMAILS, self.escalation_manager.deliver_escalation)
+            self.outbox.register(ESCALATION_UPDATES, self.escalation_manager.deliver_update)
+            # Sheet rows are grouped into one values.append per sheet
+            self.outbox.register_batch(
+                SHEET_ROWS,
+                self.sheets_service.append_row_batch,
+                batch_size=SHEETS_BATCH_SIZE,
+                linger=SHEETS_FLUSH_INTERVAL,
+                keyed=True  # Rows carry their key in a Row ID column
+            )
+            self.user_preferences = UserPreferences(self.db)
             self.session_manager = SessionManager(timeout_seconds=3600)  # 1 hour timeout
             
             # Initialize Telegram bot
@@ -100,7 +158,11 @@ class TeachProBot:
                 self.llm_service,
                 self.vector_store,
                 self.sheets_service,
-                self.gmail_service
+                self.gmail_service,
+                outbox=self.outbox,
+                conversation_memory=self.conversation_memory,
+                availability_service=self.availability_service,
+                escalation_manager=self.escalation_manager
             )
             
         except Exception as e:
@@ -116,9 +178,9 @@ class TeachProBot:
             self.session_manager.create_session(user_id)
             
             # Initialize user preferences if needed
-            prefs = self.user_preferences.get_preferences(user_id)
+            prefs = await self.user_preferences.get_preferences(user_id)
             if not prefs:
-                self.user_preferences.save_preferences(user_id, {
+                await self.user_preferences.save_preferences(user_id, {
                     "name": f"{update.effective_user.first_name} {update.effective_user.last_name if update.effective_user.last_name else ''}",
                     "username": update.effective_user.username,
                     "language": "en",
@@ -144,10 +206,29 @@ class TeachProBot:
     async def run(self):
         """Run the bot."""
         try:
+            self.gmail_service.start()
+            # Replays anything left undelivered by a previous run
+            await self.outbox.start()
+            await self.calendar_service.event_cache.start()
+            self.reservations.start()
+            self.availability_service.start()
+            self.escalation_manager.start()
             await self.telegram_bot.run()
         except Exception as e:
             logger.error(f"Error running bot: {str(e)}")
             raise
+        finally:
+            await self.escalation_manager.stop()
+            await self.availability_service.stop()
+            await self.reservations.stop()
+            await self.calendar_service.event_cache.stop()
+            # Commit queued side effects before exiting
+            await self.outbox.stop()
+            await self.gmail_service.stop()
+            logger.info(f"Supabase query latency: {self.db.metrics()}")
+            logger.info(f"Stage latency: {tracer.metrics()}")
+            tracer.close()
+            await self.db.close()
 
 async def main():
     """Main function to run the bot."""
@@ -0,0 +1,262 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+import asyncio
+from config.config import (
+    TIMEZONE,
+    AVAILABILITY_SHEET,
+    AVAILABILITY_DAYS_AHEAD,
+    AVAILABILITY_REFRESH_INTERVAL,
+    AVAILABILITY_SLOT_MINUTES,
+    AVAILABILITY_MAX_SLOTS
+)
+from services.slot_engine import cut_slots, merge_intervals, subtract_intervals, to_epoch
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+class AvailabilityRule:
+    __slots__ = ("tutor", "weekday", "day", "start", "end", "subject", "calendar_id")
+
+    def __init__(self, tutor: str, weekday: Optional[int], day: Optional[date], start: time, end: time,
+                 subject: str, calendar_id: str):
+        self.tutor = tutor
+        self.weekday = weekday  # 0 = Monday, for weekly hours
+        self.day = day  # For one-off dates
+        self.start = start
+        self.end = end
+        self.subject = subject
+        self.calendar_id = calendar_id
+
+    def applies_to(self, day: date) -> bool:
+        return self.day == day if self.day is not None else self.weekday == day.weekday()
+
+def _parse_clock(value: str) -> time:
+    value = str(value).strip().lower().replace('.', ':')
+    for fmt in ('%H:%M', '%H', '%I:%M %p', '%I %p', '%I:%M%p', '%I%p'):
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised time: {value}")
+
+def parse_rules(rows: List[list], default_calendar_id: str) -> List[AvailabilityRule]:
+    """
+    Parse tutor hours from sheet rows.
+
+    The first row is the header; Tutor, Day, Start and End are required and
+    Subject and Calendar are optional. Day is a weekday name or a YYYY-MM-DD
+    date. Rows that cannot be parsed are skipped.
+    """
+    if not rows:
+        return []
+    header = [str(cell).strip().lower() for cell in rows[0]]
+    column = {name: header.index(name) for name in ('tutor', 'day', 'start', 'end', 'subject', 'calendar')
+              if name in header}
+    if not all(name in column for name in ('tutor', 'day', 'start', 'end')):
+        print(f"Availability sheet is missing columns; found {header}")
+        return []
+
+    def cell(row: list, name: str) -> str:
+        index = column.get(name)
+        return str(row[index]).strip() if index is not None and index < len(row) else ''
+
+    rules = []
+    for row in rows[1:]:
+        try:
+            tutor = cell(row, 'tutor')
+            day_value = cell(row, 'day').lower()
+            if not tutor or not day_value:
+                continue
+            weekday, day = None, None
+            if day_value in WEEKDAYS:
+                weekday = WEEKDAYS.index(day_value)
+            elif day_value[:3] in [name[:3] for name in WEEKDAYS]:
+                weekday = [name[:3] for name in WEEKDAYS].index(day_value[:3])
+            else:
+                day = date.fromisoformat(day_value)
+            start, end = _parse_clock(cell(row, 'start')), _parse_clock(cell(row, 'end'))
+            if end <= start:
+                continue
+            rules.append(AvailabilityRule(
+                tutor, weekday, day, start, end,
+                cell(row, 'subject').lower(),
+                cell(row, 'calendar') or default_calendar_id
+            ))
+        except ValueError:
+            continue
+    return rules
+
+class AvailabilityService:
+    def __init__(self, sheets_service, calendar_service, sheet_name: str = AVAILABILITY_SHEET,
+                 days_ahead: int = AVAILABILITY_DAYS_AHEAD,
+                 refresh_interval: float = AVAILABILITY_REFRESH_INTERVAL,
+                 slot_minutes: int = AVAILABILITY_SLOT_MINUTES, timezone: str = TIMEZONE,
+                 ledger=None):
+        """
+        Open tutoring slots for the coming days, precomputed and served from memory.
+
+        A background task merges tutor hours from the availability sheet with
+        busy times from Google Calendar every `refresh_interval` seconds.
+        Days whose hours and busy times did not change keep their computed
+        slots, so a refresh only redoes the days that changed. Slots held or
+        booked through the reservation `ledger` are left out when read.
+        """
+        self.sheets_service = sheets_service
+        self.calendar_service = calendar_service
+        self.sheet_name = sheet_name
+        self.days_ahead = days_ahead
+        self.refresh_interval = refresh_interval
+        self.slot_minutes = slot_minutes
+        self.tz = ZoneInfo(timezone)
+        self.ledger = ledger
+
+        self.rules: List[AvailabilityRule] = []
+        self.rules_snapshot = None  # Sheet snapshot the rules were parsed from
+        self.day_slots: Dict[date, Tuple[tuple, List[Dict]]] = {}  # day -> (inputs, slots)
+        self.updated_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def _load_rules(self) -> List[AvailabilityRule]:
+        """Re-parse the availability sheet only when its snapshot changed."""
+        snapshot = self.sheets_service.get_snapshot(self.sheet_name)
+        if snapshot is not self.rules_snapshot:
+            self.rules = parse_rules(snapshot.rows, self.calendar_service.calendar_id)
+            self.rules_snapshot = snapshot
+        return self.rules
+
+    def _day_bounds(self, day: date) -> Tuple[datetime, datetime]:
+        start = datetime.combine(day, time.min, tzinfo=self.tz)
+        return start, start + timedelta(days=1)
+
+    def _compute_day(self, day: date, rules: List[AvailabilityRule],
+                     busy: Dict[str, List[Tuple[datetime, datetime]]]) -> Tuple[tuple, List[Dict]]:
+        """Slots for one day, reusing the previous result when its inputs are unchanged."""
+        day_start, day_end = self._day_bounds(day)
+        day_rules = [rule for rule in rules if rule.applies_to(day)]
+        day_busy = {
+            rule.calendar_id: tuple(
+                (start, end) for start, end in busy.get(rule.calendar_id, [])
+                if start < day_end and end > day_start
+            )
+            for rule in day_rules
+        }
+        inputs = (
+            tuple((rule.tutor, rule.start, rule.end, rule.subject, rule.calendar_id) for rule in day_rules),
+            tuple(sorted(day_busy.items()))
+        )
+        previous = self.day_slots.get(day)
+        if previous is not None and previous[0] == inputs:
+            return previous
+
+        slots = []
+        for rule in day_rules:
+            window = (
+                to_epoch(datetime.combine(day, rule.start, tzinfo=self.tz)),
+                to_epoch(datetime.combine(day, rule.end, tzinfo=self.tz))
+            )
+            busy_epochs = merge_intervals((to_epoch(start), to_epoch(end)) for start, end in day_busy[rule.calendar_id])
+            free = subtract_intervals([window], busy_epochs)
+            for start, end in cut_slots(free, self.slot_minutes * 60):
+                slots.append({
+                    'tutor': rule.tutor,
+                    'subject': rule.subject,
+                    'calendar_id': rule.calendar_id,
+                    'start_ts': start,
+                    'end_ts': end,
+                    'start': datetime.fromtimestamp(start, self.tz),
+                    'end': datetime.fromtimestamp(end, self.tz)
+                })
+        slots.sort(key=lambda slot: (slot['start'], slot['tutor']))
+        return inputs, slots
+
+    def _refresh_sync(self) -> int:
+        """Fetch both sources and recompute changed days; returns days recomputed."""
+        rules = self._load_rules()
+        today = datetime.now(self.tz).date()
+        days = [today + timedelta(days=offset) for offset in range(self.days_ahead)]
+        window_start, _ = self._day_bounds(days[0])
+        _, window_end = self._day_bounds(days[-1])
+
+        calendar_ids = sorted({rule.calendar_id for rule in rules if rule.calendar_id})
+        busy = self.calendar_service.get_busy_times(window_start, window_end, calendar_ids) if calendar_ids else {}
+
+        day_slots = {}
+        recomputed = 0
+        for day in days:
+            result = self._compute_day(day, rules, busy)
+            recomputed += result is not self.day_slots.get(day)
+            day_slots[day] = result
+        # Swap in one assignment so readers never see a half-built table
+        self.day_slots = day_slots
+        self.updated_at = datetime.now(self.tz)
+        return recomputed
+
+    async def refresh(self) -> int:
+        """Refresh in a worker thread; the Google clients are blocking."""
+        return await asyncio.to_thread(self._refresh_sync)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error refreshing availability: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        """Start refreshing in the background on the running event loop."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def get_availability(self, subject: Optional[str] = None, tutor: Optional[str] = None,
+                         limit: int = AVAILABILITY_MAX_SLOTS) -> Dict:
+        """
+        Upcoming open slots from memory; never calls an API.
+
+        Slots under a live reservation hold are skipped. Calendar IDs (tutor
+        email addresses) stay internal: the slots end up in the LLM prompt.
+
+        Args:
+            subject: Only tutors listed for this subject (rows without a subject always match)
+            tutor: Only this tutor (case-insensitive)
+            limit: Maximum number of slots
+
+        Returns:
+            Dict with 'updated_at' and 'slots' (tutor, subject, start, end as ISO strings)
+        """
+        now = datetime.now(self.tz)
+        subject = (subject or '').strip().lower()
+        tutor = (tutor or '').strip().lower()
+        slots = []
+        for day in sorted(self.day_slots):
+            for slot in self.day_slots[day][1]:
+                if slot['start'] < now:
+                    continue
+                if subject and slot['subject'] and slot['subject'] != subject:
+                    continue
+                if tutor and slot['tutor'].lower() != tutor:
+                    continue
+                if self.ledger is not None and self.ledger.is_held(slot['calendar_id'], slot['start_ts'], slot['end_ts']):
+                    continue
+                slots.append({
+                    'tutor': slot['tutor'],
+                    'subject': slot['subject'],
+                    'start': slot['start'].isoformat(),
+                    'end': slot['end'].isoformat()
+                })
+                if len(slots) >= limit:
+                    break
+            if len(slots) >= limit:
+                break
+        return {
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'slots': slots
+        }
@@ -0,0 +1,322 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+import asyncio
+import bisect
+import threading
+from googleapiclient.errors import HttpError
+from config.config import CALENDAR_SYNC_INTERVAL, CALENDAR_SYNC_HORIZON_DAYS
+
+class CachedEvent:
+    __slots__ = ("id", "start", "end", "busy")
+
+    def __init__(self, id: str, start: float, end: float, busy: bool):
+        self.id = id
+        self.start = start  # Epoch seconds
+        self.end = end
+        self.busy = busy  # False for events marked "show as available"
+
+class EventIndex:
+    def __init__(self):
+        """
+        Events sorted by start for overlap queries.
+
+        An overlap query for [a, b) binary-searches the first event that can
+        still reach `a` (start >= a - longest event) and scans to `b`.
+        """
+        self.starts: List[float] = []
+        self.events: List[CachedEvent] = []
+        self.max_duration = 0.0
+
+    def rebuild(self, events: List[CachedEvent]) -> None:
+        self.events = sorted(events, key=lambda event: event.start)
+        self.starts = [event.start for event in self.events]
+        self.max_duration = max((event.end - event.start for event in self.events), default=0.0)
+
+    def overlapping(self, start: float, end: float) -> List[CachedEvent]:
+        first = bisect.bisect_left(self.starts, start - self.max_duration)
+        last = bisect.bisect_left(self.starts, end)
+        return [event for event in self.events[first:last] if event.end > start]
+
+class CalendarState:
+    def __init__(self, calendar_id: str):
+        self.calendar_id = calendar_id
+        self.events: Dict[str, CachedEvent] = {}
+        self.sync_token: Optional[str] = None
+        self.index = EventIndex()
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.synced_at: Optional[datetime] = None
+        self.window_end: Optional[datetime] = None  # End of the last full sync's window
+        # Local writes made while a sync is listing, replayed over its result
+        self.local_writes: Optional[List[tuple]] = None
+
+class CalendarEventCache:
+    def __init__(self, service, calendar_ids: Optional[List[str]] = None, sync_interval: float = CALENDAR_SYNC_INTERVAL,
+                 keep_past_days: int = 1, horizon_days: int = CALENDAR_SYNC_HORIZON_DAYS):
+        """
+        Local copy of calendar events kept current with incremental sync.
+
+        Each calendar is listed in full once, from `keep_past_days` ago to
+        `horizon_days` ahead; later syncs send the stored syncToken and
+        receive only changed or deleted events. A 410 Gone response (expired
+        token), or half the horizon having elapsed, triggers a full resync.
+        Busy-time queries are answered from a per-calendar interval index,
+        without API calls. Calendars are only ever listed by `start` and the
+        background task; a calendar first seen in a query is reported as
+        unknown and synced by the task right away.
+
+        Args:
+            service: Calendar API client (googleapiclient resource)
+            calendar_ids: Calendars to keep in sync; others are added on first use
+            sync_interval: Seconds between background syncs
+            keep_past_days: Events that ended longer ago than this are dropped
+            horizon_days: Days ahead covered by a full sync
+        """
+        self.service = service
+        self.sync_interval = sync_interval
+        self.keep_past = keep_past_days * 86400
+        self.horizon = timedelta(days=horizon_days)
+        self.calendars: Dict[str, CalendarState] = {
+            calendar_id: CalendarState(calendar_id) for calendar_id in (calendar_ids or [])
+        }
+        self.calendars_lock = threading.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.running = False
+        self.stats = {"full_syncs": 0, "incremental_syncs": 0, "events_changed": 0, "unknown_reads": 0}
+
+    def _state(self, calendar_id: str) -> CalendarState:
+        with self.calendars_lock:
+            state = self.calendars.get(calendar_id)
+            if state is None:
+                state = self.calendars[calendar_id] = CalendarState(calendar_id)
+                self._wake()
+            return state
+
+    def _wake(self) -> None:
+        """Ask the background task to sync now (callable from any thread)."""
+        if self.wakeup is not None and self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    @staticmethod
+    def _parse_boundary(value: Dict, tz: ZoneInfo) -> float:
+        """Epoch seconds of an event start/end, which is a dateTime or an all-day date."""
+        if 'dateTime' in value:
+            return datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')).timestamp()
+        day = datetime.fromisoformat(value['date']).date()
+        zone = ZoneInfo(value['timeZone']) if value.get('timeZone') else tz
+        return datetime.combine(day, time.min, tzinfo=zone).timestamp()
+
+    def _apply(self, state: CalendarState, items: List[Dict], tz: ZoneInfo) -> int:
+        """Apply listed events (including cancellations) to a calendar's state."""
+        changed = 0
+        for item in items:
+            event_id = item.get('id')
+            if not event_id:
+                continue
+            changed += 1
+            if item.get('status') == 'cancelled' or 'start' not in item or 'end' not in item:
+                state.events.pop(event_id, None)
+                continue
+            try:
+                start = self._parse_boundary(item['start'], tz)
+                end = self._parse_boundary(item['end'], tz)
+            except (KeyError, ValueError):
+                continue
+            state.events[event_id] = CachedEvent(event_id, start, end, item.get('transparency') != 'transparent')
+        state.dirty = state.dirty or changed > 0
+        return changed
+
+    def _list(self, calendar_id: str, sync_token: Optional[str],
+              window: Optional[Tuple[datetime, datetime]] = None) -> Tuple[List[Dict], str, str]:
+        """
+        List all pages of a full or incremental sync; returns (items, next sync token, time zone).
+
+        A full sync is limited to `window`; the API rejects timeMin/timeMax
+        together with a syncToken.
+        """
+        items = []
+        page_token = None
+        while True:
+            params = {'calendarId': calendar_id, 'singleEvents': True, 'maxResults': 2500}
+            if sync_token:
+                params['syncToken'] = sync_token
+            else:
+                params['showDeleted'] = False
+                params['timeMin'] = window[0].isoformat()
+                params['timeMax'] = window[1].isoformat()
+            if page_token:
+                params['pageToken'] = page_token
+            result = self.service.events().list(**params).execute()
+            items.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return items, result.get('nextSyncToken'), result.get('timeZone') or 'UTC'
+
+    def sync(self, calendar_id: str) -> int:
+        """
+        Bring one calendar up to date; returns the number of changed events.
+
+        Falls back to a full resync when the stored token has expired or the
+        full sync's window is half used up.
+        """
+        state = self._state(calendar_id)
+        now = datetime.now(timezone.utc)
+        window = (now - timedelta(seconds=self.keep_past), now + self.horizon)
+        with state.lock:
+            # Events that slid into view since the last full sync were never listed
+            expiring = state.window_end is not None and state.window_end - now < self.horizon / 2
+            sync_token = None if expiring else state.sync_token
+            state.local_writes = []
+
+        # Listing pages can take seconds; readers and local writes must not wait for it
+        try:
+            try:
+                full = sync_token is None
+                items, sync_token, tz_name = self._list(calendar_id, sync_token, window)
+            except HttpError as e:
+                if getattr(e.resp, 'status', None) != 410:
+                    raise
+                # Sync token invalidated by Google: start over
+                items, sync_token, tz_name = self._list(calendar_id, None, window)
+                full = True
+        except Exception:
+            with state.lock:
+                state.local_writes = None
+            raise
+
+        with state.lock:
+            if full:
+                state.events = {}
+                state.dirty = True
+                state.window_end = window[1]
+                self.stats["full_syncs"] += 1
+            else:
+                self.stats["incremental_syncs"] += 1
+            changed = self._apply(state, items, ZoneInfo(tz_name))
+            # The listing may predate bookings or deletions made while it ran
+            for event, event_id, tz in state.local_writes:
+                if event is not None:
+                    self._apply(state, [event], ZoneInfo(tz))
+                elif state.events.pop(event_id, None) is not None:
+                    state.dirty = True
+            state.local_writes = None
+            self.stats["events_changed"] += changed
+            state.sync_token = sync_token
+            self._prune(state)
+            self._publish(state)
+            state.synced_at = datetime.now(timezone.utc)
+            return changed
+
+    def sync_all(self) -> int:
+        """Sync every known calendar; a failing calendar keeps its last state."""
+        changed = 0
+        for calendar_id in list(self.calendars):
+            try:
+                changed += self.sync(calendar_id)
+            except Exception as e:
+                print(f"Error syncing calendar {calendar_id}: {str(e)}")
+        return changed
+
+    def _prune(self, state: CalendarState) -> None:
+        """Forget events that ended before the retention window."""
+        cutoff = datetime.now(timezone.utc).timestamp() - self.keep_past
+        expired = [event_id for event_id, event in state.events.items() if event.end < cutoff]
+        for event_id in expired:
+            del state.events[event_id]
+        state.dirty = state.dirty or bool(expired)
+
+    def _publish(self, state: CalendarState) -> None:
+        """
+        Swap in a rebuilt index after a change; caller holds the lock.
+
+        Readers take `state.index` without locking, so it is replaced with one
+        assignment and never modified in place.
+        """
+        if state.dirty:
+            index = EventIndex()
+            index.rebuild(list(state.events.values()))
+            state.index = index
+            state.dirty = False
+
+    def apply_event(self, calendar_id: str, event: Dict, tz: str = 'UTC') -> None:
+        """Record an event we just wrote so reads see it before the next sync."""
+        state = self._state(calendar_id)
+        with state.lock:
+            self._apply(state, [event], ZoneInfo(tz))
+            self._publish(state)
+            if state.local_writes is not None:
+                state.local_writes.append((event, event.get('id'), tz))
+
+    def remove_event(self, calendar_id: str, event_id: str) -> None:
+        state = self._state(calendar_id)
+        with state.lock:
+            if state.events.pop(event_id, None) is not None:
+                state.dirty = True
+                self._publish(state)
+            if state.local_writes is not None:
+                state.local_writes.append((None, event_id, 'UTC'))
+
+    def busy_intervals(self, calendar_id: str, start: datetime,
+                       end: datetime) -> Optional[List[Tuple[datetime, datetime]]]:
+        """
+        Busy (start, end) datetimes overlapping a range, from the local index.
+
+        Returns None for a calendar that has never been synced; it is queued
+        for the background task instead of being listed on the caller's thread.
+        Takes no lock for a known calendar, so it is safe on the event loop.
+        """
+        state = self.calendars.get(calendar_id) or self._state(calendar_id)
+        if state.synced_at is None:
+            self.stats["unknown_reads"] += 1
+            self._wake()
+            return None
+        events = state.index.overlapping(start.timestamp(), end.timestamp())
+        return [
+            (datetime.fromtimestamp(event.start, timezone.utc), datetime.fromtimestamp(event.end, timezone.utc))
+            for event in events if event.busy
+        ]
+
+    def get_busy_times(self, start: datetime, end: datetime, calendar_ids: List[str]) -> Dict[str, List[Tuple[datetime, datetime]]]:
+        """
+        Same shape as GoogleCalendarService.get_busy_times, served from the cache.
+
+        Calendars that have never been synced are left out of the result.
+        """
+        busy = {}
+        for calendar_id in dict.fromkeys(calendar_ids):
+            intervals = self.busy_intervals(calendar_id, start, end)
+            if intervals is not None:
+                busy[calendar_id] = sorted(intervals)
+        return busy
+
+    async def _run(self) -> None:
+        while self.running:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+            # wait_for can swallow a cancel that races a wakeup
+            if not self.running:
+                return
+            self.wakeup.clear()
+            await asyncio.to_thread(self.sync_all)
+
+    async def start(self) -> None:
+        """Seed every calendar, then keep syncing in the background."""
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.running = True
+        await asyncio.to_thread(self.sync_all)
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        self.running = False
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.wakeup = None
@@ -1,15 +1,27 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime
+import asyncio
 from services.google_sheets import GoogleSheetsService
-from supabase import Client
+from services.memory.identity import telegram_id_to_uuid
+from services.memory.write_behind import WriteBehindBuffer
+from services.outbox import Outbox, SHEET_ROWS
+from services.supabase_data import SupabaseDataLayer
+from utils.text_analysis import default_analyzer
 
 class ConversationLogger:
-    def __init__(self, sheets_service: GoogleSheetsService, supabase: Client):
+    def __init__(self, sheets_service: GoogleSheetsService, db: SupabaseDataLayer,
+                 write_buffer: Optional[WriteBehindBuffer] = None, outbox: Optional[Outbox] = None,
+                 sheet_buffer: Optional[WriteBehindBuffer] = None):
         self.sheets_service = sheets_service
-        self.supabase = supabase
+        self.db = db
+        self.write_buffer = write_buffer  # Shared conversation_history write-behind buffer
+        self.outbox = outbox  # Durable queue for sheet rows, if configured
+        # Without an outbox, rows can be batched in memory: a WriteBehindBuffer
+        # over sheets_service.append_row_batch taking {'sheet_name', 'row_data'} items
+        self.sheet_buffer = sheet_buffer
         self.conversation_sheet = "Conversations"  # Sheet name for logging conversations
 
-    def log_conversation(self, 
+    async def log_conversation(self, 
                         parent_info: Dict,
                         conversation_history: List[Dict],
                         task_completed: bool = False) -> bool:
@@ -22,17 +34,17 @@ class ConversationLogger:
             user_id = parent_info.get('user_id')
             
             # Log to Google Sheets
-            self._log_to_sheets(parent_name, conversation_history, task_completed)
+            await self._log_to_sheets(parent_name, conversation_history, task_completed)
             
             # Log to Supabase
-            self._log_to_supabase(user_id, conversation_history)
+            await self._log_to_supabase(user_id, conversation_history)
             
             return True
         except Exception as e:
             print(f"Error logging conversation: {str(e)}")
             return False
 
-    def _log_to_sheets(self, parent_name: str, conversation_history: List[Dict], task_completed: bool):
+    async def _log_to_sheets(self, parent_name: str, conversation_history: List[Dict], task_completed: bool):
         """Log conversation to Google Sheets"""
         try:
             # Analyze conversation to determine topic and help provided
@@ -48,52 +60,80 @@ class ConversationLogger:
                 "Yes" if task_completed else "No"  # Task completion status
             ]
 
-            # Append to sheet
-            self.sheets_service.append_row(
+            # Append to sheet, through the outbox or batch buffer when available
+            payload = {
+                'sheet_name': self.conversation_sheet,
+                'row_data': row_data
+            }
+            if self.outbox and self.outbox.enqueue(SHEET_ROWS, payload):
+                return
+            if self.sheet_buffer and self.sheet_buffer.submit(payload):
+                return
+            # The Sheets client is blocking; keep it off the event loop
+            await asyncio.to_thread(
+                self.sheets_service.append_row,
                 sheet_name=self.conversation_sheet,
                 row_data=row_data
             )
         except Exception as e:
             print(f"Error logging to Google Sheets: {str(e)}")
 
-    def _log_to_supabase(self, user_id: str, conversation_history: List[Dict]):
-        """Log conversation to Supabase"""
+    async def _log_to_supabase(self, user_id: int, conversation_history: List[Dict]):
+        """
+        Log conversation to Supabase.
+
+        Rows have the same shape as ConversationMemory's (UUID user_id, top-level
+        timestamp) since both go through the same conversation_history batches.
+        """
         try:
-            # Insert each message into the conversation_history table
-            for message in conversation_history:
-                self.supabase.table('conversation_history').insert({
-                    'user_id': user_id,
+            if user_id is None:
+                print("Error logging to Supabase: conversation has no user_id")
+                return
+            user_uuid = telegram_id_to_uuid(user_id)
+            logged_at = datetime.now().isoformat()
+            timestamp = datetime.utcnow().isoformat()
+            rows = [
+                {
+                    'user_id': user_uuid,
                     'role': message.get('role', 'unknown'),
                     'content': message.get('content', ''),
+                    'timestamp': timestamp,
                     'metadata': {
-                        'timestamp': datetime.now().isoformat(),
+                        'timestamp': logged_at,
                         'source': 'telegram_bot'
                     }
-                }).execute()
+                }
+                for message in conversation_history
+            ]
+
+            # Hand rows to the write buffer, waiting for room when it is full; only
+            # a stopped buffer's rows go out here, as one multi-row insert
+            if self.write_buffer:
+                rows = [row for row in rows if not await self.write_buffer.put(row)]
+            if rows:
+                await self.db.execute(
+                    self.db.table('conversation_history').insert(rows),
+                    "conversation_history.insert"
+                )
         except Exception as e:
             print(f"Error logging to Supabase: {str(e)}")
 
     def _extract_topic(self, conversation_history: List[Dict]) -> str:
         """
         Extract the main topic from conversation history
+
+        Uses the shared text analyzer, so keywords match whole words as in
+        live analysis and history reclassification.
         """
-        # Simple implementation - can be enhanced with more sophisticated analysis
         if not conversation_history:
             return "Unknown"
         
         # Look for topic-related keywords in the first few messages
-        topic_keywords = {
-            'schedule': ['schedule', 'booking', 'appointment', 'session'],
-            'pricing': ['price', 'cost', 'fee', 'payment'],
-            'curriculum': ['curriculum', 'syllabus', 'course', 'subject'],
-            'support': ['help', 'support', 'assist', 'issue']
-        }
-        
+        analyzer = default_analyzer()
         for msg in conversation_history[:3]:  # Check first 3 messages
-            content = msg.get('content', '').lower()
-            for topic, keywords in topic_keywords.items():
-                if any(keyword in content for keyword in keywords):
-                    return topic.capitalize()
+            topic = analyzer.topic(msg.get('content', ''))
+            if topic:
+                return topic.capitalize()
         
         return "General Inquiry"
 
@@ -0,0 +1,324 @@
+from typing import Dict, List, Optional
+from datetime import datetime
+import asyncio
+import logging
+import time
+from config.config import (
+    ESCALATION_DEDUPE_WINDOW,
+    ESCALATION_DIGEST_MODE,
+    ESCALATION_FLUSH_INTERVAL,
+    ESCALATION_MAX_EMAILS_PER_HOUR,
+    ESCALATION_BREAKER_THRESHOLD,
+    ESCALATION_BREAKER_COOLDOWN
+)
+from services.outbox import ESCALATION_EMAILS, ESCALATION_UPDATES, Deferred
+
+logger = logging.getLogger(__name__)
+
+class EscalationCase:
+    __slots__ = ("user_id", "user_info", "thread_id", "subject", "opened_at", "last_at",
+                 "messages", "unsent", "fallbacks", "emails", "history")
+
+    def __init__(self, user_id, user_info: Dict, thread_id: str, subject: str, now: float):
+        self.user_id = user_id
+        self.user_info = user_info
+        self.thread_id = thread_id  # Message-ID every email about this case replies to
+        self.subject = subject
+        self.opened_at = now
+        self.last_at = now
+        self.messages: List[str] = []
+        self.unsent = 0  # Messages not yet in any email
+        self.fallbacks = 0  # Escalations raised only because message analysis failed
+        self.emails = 0
+        self.history: List[Dict] = []
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, cooldown: float):
+        """Stop calling a failing dependency for `cooldown` seconds after `threshold` failures in a row."""
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        """
+        Claim permission for one call: always when closed, otherwise only the
+        single trial call once the cooldown has passed.
+
+        Every allowed call must be followed by `record`, which also releases
+        the trial.
+        """
+        state = self.state
+        if state == "half-open":
+            self.trial_in_flight = True
+        return state != "open"
+
+    def retry_after(self) -> float:
+        """Seconds until a call may be allowed (a short wait while a trial is in flight)."""
+        if self.opened_at is None:
+            return 0.0
+        if self.trial_in_flight:
+            return 1.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record(self, success: bool) -> None:
+        self.trial_in_flight = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        """'closed', 'half-open' (a trial may go through) or 'open'; does not claim the trial."""
+        if self.opened_at is None:
+            return "closed"
+        if self.trial_in_flight or time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+class EscalationManager:
+    def __init__(self, gmail_service, outbox=None, dedupe_window: float = ESCALATION_DEDUPE_WINDOW,
+                 digest_mode: bool = ESCALATION_DIGEST_MODE,
+                 flush_interval: float = ESCALATION_FLUSH_INTERVAL,
+                 max_emails_per_hour: int = ESCALATION_MAX_EMAILS_PER_HOUR,
+                 breaker_threshold: int = ESCALATION_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = ESCALATION_BREAKER_COOLDOWN):
+        """
+        Turn escalations into one email thread per case instead of one email per message.
+
+        The first escalation from a user opens a case and sends the usual
+        escalation email. Further escalations from that user within
+        `dedupe_window` seconds join the case and are sent every
+        `flush_interval` seconds as one reply in the case's thread (In-Reply-To
+        and References point at the first email). In digest mode every case
+        is sent only in a periodic digest. Escalations raised because message
+        analysis failed are never emailed on their own; they are flagged and
+        wait for the next update or digest, so an LLM outage cannot cause an
+        email storm.
+
+        Emails are limited to `max_emails_per_hour` overall; anything over
+        the budget waits for a later flush. After `breaker_threshold` failed
+        sends in a row the circuit breaker holds delivery for
+        `breaker_cooldown` seconds.
+
+        Args:
+            gmail_service: GmailService used for delivery
+            outbox: Optional Outbox; when given, emails are queued durably and
+                delivered through `deliver_escalation` / `deliver_update`
+        """
+        self.gmail_service = gmail_service
+        self.outbox = outbox
+        self.dedupe_window = dedupe_window
+        self.digest_mode = digest_mode
+        self.flush_interval = flush_interval
+        self.max_emails_per_hour = max_emails_per_hour
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+
+        self.cases: Dict[object, EscalationCase] = {}
+        # Token bucket: starts full, refills max_emails_per_hour per hour
+        self.tokens = float(max_emails_per_hour)
+        self.refilled_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"escalations": 0, "merged": 0, "fallbacks": 0, "emails": 0,
+                      "digests": 0, "deferred": 0, "breaker_rejections": 0}
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.max_emails_per_hour,
+                          self.tokens + (now - self.refilled_at) * self.max_emails_per_hour / 3600)
+        self.refilled_at = now
+        if self.tokens < 1 or self.breaker.state == "open":
+            self.stats["deferred"] += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    async def submit(self, user_info: Dict, message_text: str, conversation_history: List[Dict],
+                     analysis: Dict) -> str:
+        """
+        Record an escalation.
+
+        Returns:
+            'sent' (new case emailed), 'merged' (joined an open case),
+            or 'queued' (waiting for the next flush)
+        """
+        now = time.time()
+        user_id = user_info.get('user_id')
+        fallback = bool(analysis.get('fallback'))
+        self.stats["escalations"] += 1
+        self.stats["fallbacks"] += fallback
+
+        case = self.cases.get(user_id)
+        carried: List[str] = []
+        if case is not None and now - case.last_at > self.dedupe_window:
+            # A quiet case is closed: a new escalation starts a new thread. Messages
+            # it never got to send (rate limit, open breaker) move to the new case.
+            if case.unsent:
+                carried = case.messages[-case.unsent:]
+            case = None
+        if case is not None:
+            case.messages.append(message_text)
+            case.unsent += 1
+            case.fallbacks += fallback
+            case.last_at = now
+            case.history = conversation_history
+            self.stats["merged"] += 1
+            return "merged"
+
+        thread_id = f"<escalation.{user_id}.{int(now)}@teachpro-bot>"
+        subject = f'TeachPro: Escalation Request from {user_info.get("name", "Unknown User")}'
+        case = EscalationCase(user_id, user_info, thread_id, subject, now)
+        case.messages.extend(carried)
+        case.messages.append(message_text)
+        case.unsent = len(case.messages)
+        case.fallbacks = int(fallback)
+        case.history = conversation_history
+        self.cases[user_id] = case
+
+        if self.digest_mode or fallback or not self._take_token():
+            return "queued"
+        sent = await self._dispatch(ESCALATION_EMAILS, {
+            'parent_info': user_info,
+            'conversation_context': self._case_text(case) if carried else message_text,
+            'conversation_history': conversation_history,
+            'message_id': thread_id
+        }, thread_id)
+        if sent:
+            case.unsent = 0
+            case.emails += 1
+        return "sent" if sent else "queued"
+
+    async def _dispatch(self, destination: str, payload: Dict, key: str) -> bool:
+        """Queue through the outbox when there is one, otherwise send now."""
+        self.stats["emails"] += 1
+        if self.outbox:
+            return self.outbox.enqueue(destination, payload, idempotency_key=key) is not None
+        try:
+            if destination == ESCALATION_EMAILS:
+                return await self.deliver_escalation(**payload)
+            return await self.deliver_update(**payload)
+        except Exception as e:
+            logger.error(f"Error sending escalation email: {str(e)}")
+            return False
+
+    async def _guarded(self, send) -> bool:
+        if not self.breaker.allow():
+            self.stats["breaker_rejections"] += 1
+            # Rescheduled for when the breaker half-opens, without using up an attempt
+            raise Deferred(self.breaker.retry_after(), "Escalation email circuit breaker is open")
+        sent = False
+        try:
+            sent = await send()
+        finally:
+            # Also releases the half-open trial when the send raises or is cancelled
+            self.breaker.record(bool(sent))
+        return sent
+
+    async def deliver_escalation(self, **payload) -> bool:
+        """Outbox handler for first-of-case escalation emails."""
+        return await self._guarded(lambda: self.gmail_service.send_escalation_email_async(**payload))
+
+    async def deliver_update(self, **payload) -> bool:
+        """Outbox handler for case updates and digests."""
+        return await self._guarded(lambda: self.gmail_service.send_notification_email_async(**payload))
+
+    def _case_text(self, case: EscalationCase, new_only: bool = True) -> str:
+        info = case.user_info
+        messages = case.messages[-case.unsent:] if new_only and case.unsent else case.messages
+        lines = [
+            f"👤 {info.get('name', 'Not provided')} (@{info.get('username', 'Not provided')}, "
+            f"User ID: {info.get('user_id', 'Not provided')})",
+            f"Open since {datetime.fromtimestamp(case.opened_at).strftime('%Y-%m-%d %H:%M:%S')}, "
+            f"{len(case.messages)} escalated message(s), {case.emails} email(s) sent",
+        ]
+        if case.fallbacks:
+            lines.append(f"⚠️ {case.fallbacks} escalation(s) were raised only because automatic "
+                         "message analysis failed; please check whether a reply is really needed.")
+        lines.append("")
+        lines.extend(f"• {message}" for message in messages)
+        return "\n".join(lines)
+
+    async def flush(self) -> int:
+        """Send pending case updates (or one digest); returns the number of emails sent."""
+        now = time.time()
+        pending = [case for case in self.cases.values() if case.unsent]
+        sent = 0
+        if pending and self.digest_mode:
+            if self._take_token():
+                key = f"<escalation.digest.{int(now)}@teachpro-bot>"
+                body = "🔔 Escalation digest\n\n" + "\n\n---\n\n".join(self._case_text(case) for case in pending)
+                if await self._dispatch(ESCALATION_UPDATES, {
+                    'subject': f"TeachPro: Escalation digest ({len(pending)} case(s))",
+                    'body': body,
+                    'recipient': self.gmail_service.escalation_email,
+                    'message_id': key
+                }, key):
+                    self.stats["digests"] += 1
+                    sent += 1
+                    for case in pending:
+                        case.unsent = 0
+                        case.emails += 1
+        else:
+            for case in pending:
+                if not self._take_token():
+                    break
+                if not case.emails:
+                    # Deferred first email: send the full escalation to open the thread
+                    key = case.thread_id
+                    destination, payload = ESCALATION_EMAILS, {
+                        'parent_info': case.user_info,
+                        'conversation_context': self._case_text(case),
+                        'conversation_history': case.history,
+                        'message_id': case.thread_id
+                    }
+                else:
+                    key = f"<escalation.{case.user_id}.{int(case.opened_at)}.{case.emails}@teachpro-bot>"
+                    destination, payload = ESCALATION_UPDATES, {
+                        'subject': f"Re: {case.subject}",
+                        'body': f"🔔 Further messages on this escalation\n\n{self._case_text(case)}",
+                        'recipient': self.gmail_service.escalation_email,
+                        'message_id': key,
+                        'in_reply_to': case.thread_id
+                    }
+                if await self._dispatch(destination, payload, key):
+                    sent += 1
+                    case.unsent = 0
+                    case.emails += 1
+
+        # Forget cases that went quiet and have nothing left to send
+        for user_id in [user_id for user_id, case in self.cases.items()
+                        if not case.unsent and now - case.last_at > self.dedupe_window]:
+            del self.cases[user_id]
+        return sent
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing escalations: {str(e)}")
+
+    def start(self) -> None:
+        """Start periodic flushing on the running event loop."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop flushing and send what is pending one last time."""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing escalations: {str(e)}")
+
+    def metrics(self) -> Dict:
+        return dict(self.stats, open_cases=len(self.cases), breaker=self.breaker.state)
@@ -1,4 +1,3 @@
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import logging
@@ -6,19 +5,49 @@ from datetime import datetime
 from config.config import (
     GMAIL_EMAIL,
     GMAIL_APP_PASSWORD,
-    HUMAN_ESCALATION_EMAIL
+    HUMAN_ESCALATION_EMAIL,
+    SMTP_HOST,
+    SMTP_PORT,
+    SMTP_USE_SSL,
+    SMTP_POOL_SIZE,
+    SMTP_QUEUE_SIZE,
+    SMTP_TIMEOUT,
+    SMTP_IDLE_TIMEOUT,
+    SMTP_HEALTH_CHECK_INTERVAL
 )
+from services.smtp_pool import SMTPConnectionPool, AsyncMailer
+from utils.tracing import traced
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class GmailService:
-    def __init__(self, gmail_email: str, gmail_app_password: str, escalation_email: str):
-        """Initialize Gmail service with email and app password."""
+    def __init__(self, gmail_email: str, gmail_app_password: str, escalation_email: str,
+                 smtp_host: str = SMTP_HOST, smtp_port: int = SMTP_PORT, use_ssl: bool = SMTP_USE_SSL,
+                 pool_size: int = SMTP_POOL_SIZE, queue_size: int = SMTP_QUEUE_SIZE):
+        """
+        Initialize Gmail service with email and app password.
+
+        Emails go over pooled, persistent SMTP connections. The *_async
+        methods queue through an AsyncMailer once `start` has been awaited on
+        the event loop; the plain methods send from the calling thread.
+        """
         self.gmail_email = gmail_email
         self.gmail_app_password = gmail_app_password
         self.escalation_email = escalation_email
+        self.pool = SMTPConnectionPool(
+            smtp_host,
+            smtp_port,
+            gmail_email,
+            gmail_app_password,
+            use_ssl=use_ssl,
+            size=pool_size,
+            timeout=SMTP_TIMEOUT,
+            idle_timeout=SMTP_IDLE_TIMEOUT,
+            health_check_interval=SMTP_HEALTH_CHECK_INTERVAL
+        )
+        self.mailer = AsyncMailer(self.pool, queue_size=queue_size)
         logger.info(f"Initialized Gmail service with email: {gmail_email}")
 
     def _format_conversation_history(self, conversation_history: list) -> str:
@@ -35,22 +64,21 @@ class GmailService:
 
         return "\n\n".join(formatted_history)
 
-    def send_escalation_email(self, parent_info: dict, conversation_context: str, conversation_history: list = None):
-        """
-        Send an escalation email to the human support team
-        """
-        try:
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.gmail_email
-            msg['To'] = self.escalation_email
-            msg['Subject'] = f'TeachPro: Escalation Request from {parent_info.get("name", "Unknown User")}'
-
-            # Format the current time
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            # Create email body with improved formatting
-            body = f"""
+    def _build_escalation_message(self, parent_info: dict, conversation_context: str,
+                                  conversation_history: list = None, message_id: str = None) -> MIMEMultipart:
+        """Compose the escalation email."""
+        msg = MIMEMultipart()
+        msg['From'] = self.gmail_email
+        msg['To'] = self.escalation_email
+        msg['Subject'] = f'TeachPro: Escalation Request from {parent_info.get("name", "Unknown User")}'
+        if message_id:
+            msg['Message-ID'] = message_id
+
+        # Format the current time
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        # Create email body with improved formatting
+        body = f"""
 🔔 New Escalation Request
 
 📅 Time: {current_time}
@@ -71,55 +99,87 @@ Please follow up with the parent as soon as possible. The conversation has been
 
 Best regards,
 TeachPro Bot
-            """
-            
-            msg.attach(MIMEText(body, 'plain'))
-
-            # Connect to Gmail's SMTP server using SSL
-            logger.debug("Attempting to connect to Gmail SMTP server using SSL...")
-            server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-            logger.debug("Attempting to login...")
-            server.login(self.gmail_email, self.gmail_app_password)
-            logger.debug("Login successful, sending message...")
-            
-            # Send email
-            server.send_message(msg)
-            logger.debug("Message sent successfully")
-            server.quit()
-            logger.info("Email sent successfully")
-
-            return True
+        """
+
+        msg.attach(MIMEText(body, 'plain'))
+        return msg
+
+    def _build_notification_message(self, subject: str, body: str, recipient: str,
+                                    message_id: str = None, in_reply_to: str = None) -> MIMEMultipart:
+        """Compose a notification email, threaded under `in_reply_to` when given."""
+        msg = MIMEMultipart()
+        msg['From'] = self.gmail_email
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        if message_id:
+            msg['Message-ID'] = message_id
+        if in_reply_to:
+            msg['In-Reply-To'] = in_reply_to
+            msg['References'] = in_reply_to
+        msg.attach(MIMEText(body, 'plain'))
+        return msg
+
+    @traced("gmail.send")
+    def _send(self, msg: MIMEMultipart) -> bool:
+        """Send one message over a pooled connection from the calling thread."""
+        sent, error = self.pool.send_messages([msg])[0]
+        if not sent:
+            raise Exception(error)
+        logger.info("Email sent successfully")
+        return True
+
+    def send_escalation_email(self, parent_info: dict, conversation_context: str, conversation_history: list = None,
+                              message_id: str = None):
+        """
+        Send an escalation email to the human support team
+
+        A stable message_id lets a retried delivery be recognised as the same email.
+        """
+        try:
+            return self._send(self._build_escalation_message(
+                parent_info, conversation_context, conversation_history, message_id
+            ))
         except Exception as e:
             logger.error(f"Error sending escalation email: {str(e)}", exc_info=True)
             return False
 
-    def send_notification_email(self, subject: str, body: str, recipient: str):
+    @traced("gmail.send_escalation")
+    async def send_escalation_email_async(self, parent_info: dict, conversation_context: str,
+                                          conversation_history: list = None, message_id: str = None) -> bool:
+        """send_escalation_email without blocking the event loop."""
+        try:
+            msg = self._build_escalation_message(parent_info, conversation_context, conversation_history, message_id)
+            return await self.mailer.send(msg)
+        except Exception as e:
+            logger.error(f"Error sending escalation email: {str(e)}", exc_info=True)
+            return False
+
+    def send_notification_email(self, subject: str, body: str, recipient: str, message_id: str = None,
+                                in_reply_to: str = None):
         """
         Send a general notification email
         """
         try:
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.gmail_email
-            msg['To'] = recipient
-            msg['Subject'] = subject
-            
-            msg.attach(MIMEText(body, 'plain'))
-
-            # Connect to Gmail's SMTP server using SSL
-            logger.debug("Attempting to connect to Gmail SMTP server using SSL...")
-            server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-            logger.debug("Attempting to login...")
-            server.login(self.gmail_email, self.gmail_app_password)
-            logger.debug("Login successful, sending message...")
-            
-            # Send email
-            server.send_message(msg)
-            logger.debug("Message sent successfully")
-            server.quit()
-            logger.info("Email sent successfully")
-
-            return True
+            return self._send(self._build_notification_message(subject, body, recipient, message_id, in_reply_to))
+        except Exception as e:
+            logger.error(f"Error sending notification email: {str(e)}", exc_info=True)
+            return False
+
+    @traced("gmail.send_notification")
+    async def send_notification_email_async(self, subject: str, body: str, recipient: str,
+                                            message_id: str = None, in_reply_to: str = None) -> bool:
+        """send_notification_email without blocking the event loop."""
+        try:
+            msg = self._build_notification_message(subject, body, recipient, message_id, in_reply_to)
+            return await self.mailer.send(msg)
         except Exception as e:
             logger.error(f"Error sending notification email: {str(e)}", exc_info=True)
-            return False 
\ No newline at end of file
+            return False
+
+    def start(self) -> None:
+        """Start the queued sender on the running event loop."""
+        self.mailer.start()
+
+    async def stop(self) -> None:
+        """Deliver queued emails and close the SMTP connections."""
+        await self.mailer.stop()
@@ -1,26 +1,51 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
 from config.config import (
     GOOGLE_CREDENTIALS_PATH,
     CALENDAR_ID,
     TIMEZONE
 )
+from services.slot_engine import SlotEngine, TutorSchedule
+
+def _parse_time(value: str) -> datetime:
+    """Parse an RFC 3339 timestamp from the Calendar API."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
 
 class GoogleCalendarService:
-    def __init__(self, credentials_path: str, calendar_id: str):
-        self.credentials = service_account.Credentials.from_service_account_file(
-            credentials_path,
-            scopes=['https://www.googleapis.com/auth/calendar']
-        )
-        self.service = build('calendar', 'v3', credentials=self.credentials)
+    def __init__(self, credentials_path: str, calendar_id: str, service=None):
+        # A prebuilt API client (e.g. a local stand-in) skips loading credentials
+        self.credentials = None
+        if service is None:
+            self.credentials = service_account.Credentials.from_service_account_file(
+                credentials_path,
+                scopes=['https://www.googleapis.com/auth/calendar']
+            )
+        self.service = service or build('calendar', 'v3', credentials=self.credentials)
         self.calendar_id = calendar_id
+        # Optional CalendarEventCache; busy-time reads go to it instead of the API
+        self.event_cache = None
+        # Optional ReservationLedger; create_event books through it so slots can't be double-booked
+        self.ledger = None
 
     def create_event(self, summary: str, start_time: datetime, end_time: datetime,
                     description: str = None, attendees: list = None):
         """
         Create a new calendar event
+
+        With a reservation ledger attached the slot is held and confirmed
+        through it, and None is returned if the slot is already taken. Call
+        from a worker thread, not the ledger's event loop.
         """
+        if self.ledger is not None:
+            try:
+                return self.ledger.book_from_thread(
+                    self.calendar_id, start_time, end_time, summary, description, attendees
+                )
+            except Exception as e:
+                print(f"Error creating calendar event: {str(e)}")
+                return None
         try:
             event = {
                 'summary': summary,
@@ -46,6 +71,8 @@ class GoogleCalendarService:
                 sendUpdates='all'
             ).execute()
 
+            if self.event_cache is not None:
+                self.event_cache.apply_event(self.calendar_id, event, TIMEZONE)
             return event
         except Exception as e:
             print(f"Error creating calendar event: {str(e)}")
@@ -54,51 +81,74 @@ class GoogleCalendarService:
     def get_available_slots(self, date: datetime, duration_minutes: int = 60):
         """
         Get available time slots for a given date
+
+        Busy times come from one freebusy query (which also covers all-day
+        events) and free time is found with the slot engine's sweep. Slots are
+        back to back from the start of each free period, as (start, end)
+        datetimes in TIMEZONE.
         """
         try:
-            # Get events for the specified date
-            start_of_day = datetime(date.year, date.month, date.day)
+            tz = ZoneInfo(TIMEZONE)
+            start_of_day = datetime(date.year, date.month, date.day, tzinfo=tz)
             end_of_day = start_of_day + timedelta(days=1)
 
-            events_result = self.service.events().list(
-                calendarId=self.calendar_id,
-                timeMin=start_of_day.isoformat(),
-                timeMax=end_of_day.isoformat(),
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-
-            events = events_result.get('items', [])
-            
-            # Calculate available slots
-            busy_times = [(datetime.fromisoformat(event['start']['dateTime']),
-                          datetime.fromisoformat(event['end']['dateTime']))
-                         for event in events]
-
-            available_slots = []
-            current_time = start_of_day
-
-            while current_time < end_of_day:
-                slot_end = current_time + timedelta(minutes=duration_minutes)
-                is_available = True
-
-                for busy_start, busy_end in busy_times:
-                    if (current_time < busy_end and slot_end > busy_start):
-                        is_available = False
-                        current_time = busy_end
-                        break
-
-                if is_available:
-                    available_slots.append((current_time, slot_end))
-                    current_time = slot_end
-                else:
-                    current_time += timedelta(minutes=15)
-
-            return available_slots
+            whole_day = TutorSchedule(
+                self.calendar_id,
+                self.calendar_id,
+                working_hours={weekday: [(time.min, time.min)] for weekday in range(7)},
+                timezone=TIMEZONE
+            )
+            slots = SlotEngine(self).find_slots(
+                [whole_day],
+                start_of_day,
+                end_of_day,
+                duration_minutes=duration_minutes,
+                step_minutes=None,
+                k=None
+            )
+            return [(slot.start, slot.end) for slot in slots]
         except Exception as e:
             print(f"Error getting available slots: {str(e)}")
             return []
 
+    def get_busy_times(self, start: datetime, end: datetime, calendar_ids: list = None):
+        """
+        Busy intervals per calendar from one freebusy query.
+
+        When an event cache is attached the intervals come from it; only
+        calendars it has not synced yet are queried.
+
+        Args:
+            start: Window start (timezone-aware)
+            end: Window end (timezone-aware)
+            calendar_ids: Calendars to query (defaults to this service's calendar)
+
+        Returns:
+            Dict of calendar ID -> list of (start, end) datetimes, sorted
+        """
+        calendar_ids = list(dict.fromkeys(calendar_ids or [self.calendar_id]))
+        busy = {calendar_id: [] for calendar_id in calendar_ids}
+        if self.event_cache is not None:
+            cached = self.event_cache.get_busy_times(start, end, calendar_ids)
+            busy.update(cached)
+            calendar_ids = [calendar_id for calendar_id in calendar_ids if calendar_id not in cached]
+        # The API accepts at most 50 calendars per query
+        for offset in range(0, len(calendar_ids), 50):
+            result = self.service.freebusy().query(body={
+                'timeMin': start.isoformat(),
+                'timeMax': end.isoformat(),
+                'timeZone': TIMEZONE,
+                'items': [{'id': calendar_id} for calendar_id in calendar_ids[offset:offset + 50]]
+            }).execute()
+            for calendar_id, info in result.get('calendars', {}).items():
+                if info.get('errors'):
+                    raise Exception(f"freebusy failed for {calendar_id}: {info['errors']}")
+                busy[calendar_id] = sorted(
+                    (_parse_time(period['start']), _parse_time(period['end']))
+                    for period in info.get('busy', [])
+                )
+        return busy
+
     def delete_event(self, event_id: str):
         """
         Delete a calendar event
@@ -108,6 +158,8 @@ class GoogleCalendarService:
                 calendarId=self.calendar_id,
                 eventId=event_id
             ).execute()
+            if self.event_cache is not None:
+                self.event_cache.remove_event(self.calendar_id, event_id)
             return True
         except Exception as e:
             print(f"Error deleting calendar event: {str(e)}")
@@ -1,54 +1,181 @@
+from typing import Dict, List, Optional, Set
+from collections import OrderedDict
+import random
+import threading
+import time
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from config.config import (
     GOOGLE_CREDENTIALS_PATH,
-    GOOGLE_SHEETS_ID
+    GOOGLE_SHEETS_ID,
+    SHEETS_REQUESTS_PER_MINUTE,
+    SHEETS_MAX_RETRIES,
+    SHEET_SNAPSHOT_CHECK_INTERVAL
 )
+from services.sheet_snapshot import SheetSnapshot
+from utils.tracing import traced
+
+# Columns written to a newly created log sheet; Row ID holds the outbox key of rows appended through it
+DEFAULT_HEADERS = ['Timestamp', 'Parent Name', 'Topic', 'Help Provided', 'Task Completed', 'Row ID']
+
+def _column_letter(index: int) -> str:
+    """A1 column letter for a zero-based column index."""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+class RequestThrottle:
+    def __init__(self, requests_per_minute: float):
+        """Space requests evenly so bursts stay under a per-minute quota."""
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Block the calling thread until the next request slot."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
 class GoogleSheetsService:
-    def __init__(self, credentials_path: str, sheets_id: str):
-        self.credentials = service_account.Credentials.from_service_account_file(
-            credentials_path,
-            scopes=['https://www.googleapis.com/auth/spreadsheets']
-        )
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+    def __init__(self, credentials_path: str, sheets_id: str,
+                 requests_per_minute: float = SHEETS_REQUESTS_PER_MINUTE,
+                 max_retries: int = SHEETS_MAX_RETRIES,
+                 snapshot_check_interval: float = SHEET_SNAPSHOT_CHECK_INTERVAL,
+                 service=None, drive=None):
+        # Prebuilt API clients (e.g. local stand-ins) skip loading credentials
+        self.credentials = None
+        if service is None or drive is None:
+            self.credentials = service_account.Credentials.from_service_account_file(
+                credentials_path,
+                scopes=[
+                    'https://www.googleapis.com/auth/spreadsheets',
+                    'https://www.googleapis.com/auth/drive.metadata.readonly'
+                ]
+            )
+        self.service = service or build('sheets', 'v4', credentials=self.credentials)
+        self.drive = drive or build('drive', 'v3', credentials=self.credentials)
         self.sheets_id = sheets_id
+        self.throttle = RequestThrottle(requests_per_minute)
+        self.max_retries = max_retries
+        # Sheet titles, fetched once and refreshed only when a write suggests they changed
+        self.sheet_titles: Optional[Set[str]] = None
+        self.titles_lock = threading.Lock()
+        # Indexed sheet copies for search, reloaded when the file's modifiedTime changes
+        self.snapshots: Dict[str, SheetSnapshot] = {}
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_check_interval = snapshot_check_interval
+        self.modified_time: Optional[str] = None
+        self.modified_checked_at = 0.0
+        # Outbox keys of rows known to be in a sheet, and of rows whose append failed
+        # ambiguously (maybe written); only the outbox worker thread touches these
+        self.appended_keys: "OrderedDict[str, None]" = OrderedDict()
+        self.appended_keys_limit = 10000
+        self.unconfirmed_keys: Set[str] = set()
+
+    @traced("sheets.request")
+    def _execute(self, request):
+        """
+        Execute an API request under the throttle, retrying quota and server errors.
+
+        429 and 5xx responses are retried with exponential backoff and jitter
+        (honouring Retry-After when present); other errors are raised.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.throttle.wait()
+            try:
+                return request.execute()
+            except HttpError as e:
+                status = getattr(e.resp, 'status', None)
+                if status not in (429, 500, 502, 503, 504) or attempt == self.max_retries:
+                    raise
+                retry_after = e.resp.get('retry-after') if hasattr(e.resp, 'get') else None
+                delay = float(retry_after) if retry_after else min(64.0, 2 ** attempt)
+                time.sleep(delay + random.uniform(0, 1))
 
     def get_sheet_data(self, range_name: str):
         """
         Get data from a specific range in the Google Sheet
         """
         try:
-            result = self.service.spreadsheets().values().get(
+            result = self._execute(self.service.spreadsheets().values().get(
                 spreadsheetId=self.sheets_id,
                 range=range_name
-            ).execute()
-            
+            ))
+
             return result.get('values', [])
         except Exception as e:
             print(f"Error getting sheet data: {str(e)}")
             return []
 
-    def search_sheet(self, search_term: str, sheet_name: str = 'Sheet1'):
+    def _spreadsheet_modified_time(self) -> Optional[str]:
         """
-        Search for a term in the entire sheet
+        The spreadsheet's Drive modifiedTime, checked at most once per interval.
+
+        A failed check keeps the last known value so searches keep being
+        served from the existing snapshots.
         """
+        now = time.monotonic()
+        if self.modified_time is not None and now - self.modified_checked_at < self.snapshot_check_interval:
+            return self.modified_time
         try:
-            # Get all data from the sheet
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.sheets_id,
-                range=f'{sheet_name}!A:Z'
+            result = self.drive.files().get(
+                fileId=self.sheets_id,
+                fields='modifiedTime',
+                supportsAllDrives=True
             ).execute()
-            
-            values = result.get('values', [])
-            matches = []
+            self.modified_time = result.get('modifiedTime')
+        except Exception as e:
+            print(f"Error checking spreadsheet modified time: {str(e)}")
+        self.modified_checked_at = now
+        return self.modified_time
+
+    def get_snapshot(self, sheet_name: str = 'Sheet1') -> SheetSnapshot:
+        """
+        Indexed snapshot of a sheet, downloaded again only after the file changed.
+        """
+        modified_time = self._spreadsheet_modified_time()
+        with self.snapshot_lock:
+            snapshot = self.snapshots.get(sheet_name)
+            if snapshot is not None and modified_time is not None and snapshot.modified_time == modified_time:
+                return snapshot
+
+            # Reading under the lock lets concurrent searches share one download
+            result = self._execute(self.service.spreadsheets().values().get(
+                spreadsheetId=self.sheets_id,
+                range=sheet_name
+            ))
+            snapshot = SheetSnapshot(sheet_name, result.get('values', []), modified_time)
+            self.snapshots[sheet_name] = snapshot
+            return snapshot
 
-            # Search through the data
-            for row in values:
-                if any(search_term.lower() in str(cell).lower() for cell in row):
-                    matches.append(row)
+    def invalidate_snapshot(self, sheet_name: Optional[str] = None) -> None:
+        """Drop the snapshot of one sheet, or of every sheet."""
+        with self.snapshot_lock:
+            if sheet_name is None:
+                self.snapshots = {}
+            else:
+                self.snapshots.pop(sheet_name, None)
 
-            return matches
+    def search_sheet(self, search_term: str, sheet_name: str = 'Sheet1',
+                     filters: Optional[Dict] = None, limit: Optional[int] = None):
+        """
+        Search for a term in the entire sheet
+
+        Answered from the sheet's local snapshot; `filters` maps column header
+        names (or zero-based indexes) to exact cell values.
+        """
+        try:
+            return self.get_snapshot(sheet_name).search(search_term, filters=filters, limit=limit)
         except Exception as e:
             print(f"Error searching sheet: {str(e)}")
             return []
@@ -58,80 +185,185 @@ class GoogleSheetsService:
         Get metadata about the spreadsheet
         """
         try:
-            result = self.service.spreadsheets().get(
-                spreadsheetId=self.sheets_id
-            ).execute()
-            
+            result = self._execute(self.service.spreadsheets().get(
+                spreadsheetId=self.sheets_id,
+                fields='properties.title,sheets.properties.title'
+            ))
+
             return {
                 'title': result.get('properties', {}).get('title'),
-                'sheets': [sheet.get('properties', {}).get('title') 
+                'sheets': [sheet.get('properties', {}).get('title')
                           for sheet in result.get('sheets', [])]
             }
         except Exception as e:
             print(f"Error getting sheet metadata: {str(e)}")
             return {}
 
-    def append_row(self, sheet_name: str, row_data: list):
+    def invalidate_sheet_cache(self) -> None:
+        """Forget cached sheet titles so the next write re-reads them."""
+        with self.titles_lock:
+            self.sheet_titles = None
+
+    def _get_sheet_titles(self) -> Set[str]:
+        """Sheet titles from the cache, fetching them on first use."""
+        with self.titles_lock:
+            if self.sheet_titles is not None:
+                return self.sheet_titles
+        result = self._execute(self.service.spreadsheets().get(
+            spreadsheetId=self.sheets_id,
+            fields='sheets.properties.title'
+        ))
+        titles = {sheet.get('properties', {}).get('title') for sheet in result.get('sheets', [])}
+        with self.titles_lock:
+            self.sheet_titles = titles
+        return titles
+
+    def _append_values(self, sheet_name: str, rows: List[list]):
+        """Append rows with a single values.append call."""
+        return self._execute(self.service.spreadsheets().values().append(
+            spreadsheetId=self.sheets_id,
+            range=f'{sheet_name}!A:{_column_letter(max(len(row) for row in rows) - 1)}',
+            valueInputOption='USER_ENTERED',
+            insertDataOption='INSERT_ROWS',
+            body={'values': rows}
+        ))
+
+    def append_rows(self, sheet_name: str, rows: List[list]):
         """
-        Append a row to the specified sheet
+        Append many rows to a sheet in one request.
+
+        The sheet is checked against the cached titles, so a warm cache costs
+        no metadata call. If the write fails because the sheet was deleted or
+        renamed elsewhere, the cache is refreshed and the write retried once.
+        Raises on failure.
         """
+        if not rows:
+            return None
+        if not self.ensure_sheet_exists(sheet_name):
+            raise Exception(f"Failed to create or verify sheet: {sheet_name}")
+        # Our own write makes the cached copy stale before Drive reports it
+        self.invalidate_snapshot(sheet_name)
         try:
-            # Ensure the sheet exists first
+            return self._append_values(sheet_name, rows)
+        except HttpError as e:
+            if getattr(e.resp, 'status', None) != 400 or 'Unable to parse range' not in str(e):
+                raise
+            self.invalidate_sheet_cache()
             if not self.ensure_sheet_exists(sheet_name):
-                raise Exception(f"Failed to create or verify sheet: {sheet_name}")
+                raise
+            return self._append_values(sheet_name, rows)
 
-            # Prepare the request body
-            body = {
-                'values': [row_data]
-            }
-
-            # Make the API call
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=self.sheets_id,
-                range=f'{sheet_name}!A:E',  # Assuming columns A through E
-                valueInputOption='USER_ENTERED',
-                insertDataOption='INSERT_ROWS',
-                body=body
-            ).execute()
-
-            return result
+    def append_row(self, sheet_name: str, row_data: list):
+        """
+        Append a row to the specified sheet
+        """
+        try:
+            return self.append_rows(sheet_name, [row_data])
         except Exception as e:
             print(f"Error appending row to sheet: {str(e)}")
             return None
 
+    def _row_ids(self, sheet_name: str, columns: Set[int]) -> Set[str]:
+        """Values of the given columns of a sheet, i.e. the Row IDs already written."""
+        found: Set[str] = set()
+        for column in columns:
+            letter = _column_letter(column)
+            result = self._execute(self.service.spreadsheets().values().get(
+                spreadsheetId=self.sheets_id,
+                range=f'{sheet_name}!{letter}:{letter}'
+            ))
+            found.update(row[0] for row in result.get('values', []) if row)
+        return found
+
+    def append_row_batch(self, payloads: List[Dict], keys: Optional[List[str]] = None) -> None:
+        """
+        Write queued append_row payloads with one values.append per sheet.
+
+        With outbox keys, each row is written with its key in a trailing Row ID
+        column, and a resend never duplicates a row: keys already appended by
+        this process are skipped (a batch that partly succeeded across sheets),
+        and after an append failed without a clear outcome the sheet's Row ID
+        column is read once to skip rows that did land.
+
+        Args:
+            payloads: Dicts with 'sheet_name' and 'row_data', in order
+            keys: Outbox idempotency keys, one per payload
+
+        Raises if any sheet fails so the batch is retried.
+        """
+        by_sheet: Dict[str, List[tuple]] = {}
+        for index, payload in enumerate(payloads):
+            key = keys[index] if keys else None
+            if key is not None and key in self.appended_keys:
+                continue
+            row = list(payload['row_data'])
+            if key is not None:
+                row.append(key)
+            by_sheet.setdefault(payload['sheet_name'], []).append((key, row))
+
+        for sheet_name, entries in by_sheet.items():
+            uncertain = {len(row) - 1 for key, row in entries if key in self.unconfirmed_keys}
+            if uncertain:
+                present = self._row_ids(sheet_name, uncertain)
+                entries = [(key, row) for key, row in entries if key not in present]
+            sheet_keys = [key for key, _ in entries if key is not None]
+            try:
+                self.append_rows(sheet_name, [row for _, row in entries])
+            except HttpError as e:
+                # A rejected request wrote nothing; anything else may have been applied
+                if getattr(e.resp, 'status', 500) >= 500:
+                    self.unconfirmed_keys.update(sheet_keys)
+                raise
+            except Exception:
+                self.unconfirmed_keys.update(sheet_keys)
+                raise
+            for key in sheet_keys:
+                self.unconfirmed_keys.discard(key)
+                self.appended_keys[key] = None
+            while len(self.appended_keys) > self.appended_keys_limit:
+                self.appended_keys.popitem(last=False)
+
     def ensure_sheet_exists(self, sheet_name: str):
         """
         Ensure the specified sheet exists, create it if it doesn't
         """
         try:
-            # Get current sheets
-            metadata = self.get_sheet_metadata()
-            existing_sheets = metadata.get('sheets', [])
-
-            if sheet_name not in existing_sheets:
-                # Create new sheet
-                request = {
-                    'addSheet': {
-                        'properties': {
-                            'title': sheet_name
-                        }
+            # Get current sheets (cached after the first call)
+            if sheet_name in self._get_sheet_titles():
+                return True
+
+            # Create new sheet
+            request = {
+                'addSheet': {
+                    'properties': {
+                        'title': sheet_name
                     }
                 }
+            }
 
-                body = {
-                    'requests': [request]
-                }
+            body = {
+                'requests': [request]
+            }
 
-                self.service.spreadsheets().batchUpdate(
+            try:
+                self._execute(self.service.spreadsheets().batchUpdate(
                     spreadsheetId=self.sheets_id,
                     body=body
-                ).execute()
+                ))
+            except HttpError as e:
+                # Created concurrently (or the cache was stale): re-read the titles
+                if 'already exists' not in str(e):
+                    raise
+                self.invalidate_sheet_cache()
+                return sheet_name in self._get_sheet_titles()
 
-                # Add headers to the new sheet
-                headers = ['Timestamp', 'Parent Name', 'Topic', 'Help Provided', 'Task Completed']
-                self.append_row(sheet_name, headers)
+            # Add headers to the new sheet
+            self._append_values(sheet_name, [DEFAULT_HEADERS])
+            with self.titles_lock:
+                if self.sheet_titles is not None:
+                    self.sheet_titles.add(sheet_name)
 
             return True
         except Exception as e:
             print(f"Error ensuring sheet exists: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
@@ -2,6 +2,7 @@ from typing import Dict, List, Optional
 import openai
 import json
 from config.system_prompt import SYSTEM_PROMPT
+from utils.tracing import traced
 
 class LLMService:
     def __init__(self, openai_api_key: str):
@@ -10,6 +11,7 @@ class LLMService:
         self.model = "gpt-4o-mini"
         self.system_prompt = SYSTEM_PROMPT
 
+    @traced("llm.generate_response")
     def generate_response(
         self,
         message: str,
@@ -54,6 +56,7 @@ class LLMService:
             print(f"Error generating response: {str(e)}")
             return "I apologize, but I'm having trouble processing your request right now. Please try again later."
 
+    @traced("llm.analyze_message")
     def analyze_message(
         self,
         message: str,
@@ -99,7 +102,8 @@ class LLMService:
                     "intent": "unknown",
                     "entities": {},
                     "escalation_required": True,
-                    "sentiment": "neutral"
+                    "sentiment": "neutral",
+                    "fallback": True  # Not a real analysis; escalated only to be safe
                 }
 
         except Exception as e:
@@ -108,9 +112,11 @@ class LLMService:
                 "intent": "unknown",
                 "entities": {},
                 "escalation_required": True,
-                "sentiment": "neutral"
+                "sentiment": "neutral",
+                "fallback": True
             }
 
+    @traced("llm.schedule_confirmation")
     def generate_schedule_confirmation(
         self,
         event_details: Dict
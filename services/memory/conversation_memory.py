@@ -1,24 +1,72 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta
-from supabase import Client
-import uuid
+from config.config import (
+    HISTORY_LOOKBACK_DAYS,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_MAX_PENDING
+)
+from services.memory.identity import telegram_id_to_uuid, outbox_key_to_uuid
+from services.memory.write_behind import WriteBehindBuffer
+from services.supabase_data import SupabaseDataLayer
 
 class ConversationMemory:
-    def __init__(self, supabase_client: Client):
-        """Initialize conversation memory with Supabase client."""
-        self.supabase = supabase_client
+    def __init__(self, db: SupabaseDataLayer, write_behind: bool = True, write_buffer=None):
+        """
+        Initialize conversation memory with the shared Supabase data layer.
+
+        Rows go to `write_buffer` when given (e.g. an outbox channel), otherwise
+        to an in-memory write-behind buffer unless `write_behind` is False.
+        """
+        self.db = db
         self.table = "conversation_history"
+        self.summary_table = "conversation_summaries"  # Maintained by triggers in schema.sql
         self.default_history_limit = 20  # Increased from 5 to 20
 
+        # Buffered bulk writer for conversation_history; started by the bot's event loop
+        self.write_buffer = write_buffer or WriteBehindBuffer(
+            self.insert_rows,
+            max_batch_size=WRITE_BEHIND_BATCH_SIZE,
+            flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+            max_pending=WRITE_BEHIND_MAX_PENDING,
+            name=self.table
+        ) if write_behind else None
+
     def _telegram_id_to_uuid(self, telegram_id: int) -> str:
         """Convert a Telegram user ID to a UUID v5 using a namespace."""
-        # Use a fixed namespace UUID for consistency
-        namespace = uuid.UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')
-        # Convert the telegram_id to a string and use it as the name
-        return str(uuid.uuid5(namespace, str(telegram_id)))
+        return telegram_id_to_uuid(telegram_id)
+
+    async def insert_rows(self, rows: List[Dict], keys: Optional[List[str]] = None) -> None:
+        """
+        Insert many conversation_history rows in a single request.
+
+        With outbox idempotency keys, each row gets a client_row_id derived
+        from its key and the insert ignores rows already stored, so resending
+        a batch that was written but not acknowledged adds nothing.
+        """
+        if not rows:
+            return
+        if keys:
+            rows = [
+                dict(row, client_row_id=outbox_key_to_uuid(key))
+                for row, key in zip(rows, keys)
+            ]
+            query = self.db.table(self.table).upsert(
+                rows, on_conflict="client_row_id,timestamp", ignore_duplicates=True
+            )
+        else:
+            query = self.db.table(self.table).insert(rows)
+        await self.db.execute(query, "conversation_history.insert")
 
-    def save_message(self, user_id: int, message: Dict, metadata: Dict = None) -> None:
-        """Save a message to the conversation history with optional metadata."""
+    async def save_message(self, user_id: int, message: Dict, metadata: Dict = None) -> None:
+        """
+        Save a message to the conversation history with optional metadata.
+
+        The row is handed to the write buffer; a full write-behind buffer
+        makes this wait for room on the event loop rather than writing to
+        Supabase itself. Only when no buffer is running is the row inserted
+        directly.
+        """
         try:
             # Convert Telegram user_id to UUID
             user_uuid = self._telegram_id_to_uuid(user_id)
@@ -32,13 +80,22 @@ class ConversationMemory:
                 "metadata": metadata or {}
             }
             
-            self.supabase.table(self.table).insert(message_data).execute()
+            if self.write_buffer and await self.write_buffer.put(message_data):
+                return
+            await self.insert_rows([message_data])
         except Exception as e:
             print(f"Error saving message to conversation history: {str(e)}")
             raise
 
-    def get_recent_history(self, user_id: int, limit: int = None) -> List[Dict]:
-        """Get recent conversation history for a user."""
+    async def get_recent_history(self, user_id: int, limit: int = None, columns: str = "*",
+                           lookback_days: int = HISTORY_LOOKBACK_DAYS) -> List[Dict]:
+        """
+        Get recent conversation history for a user.
+
+        `columns` projects the select (e.g. "role,content") when only part of
+        each row is needed. Only the last `lookback_days` are read so Postgres
+        prunes the query to the most recent monthly partitions.
+        """
         try:
             # Convert Telegram user_id to UUID
             user_uuid = self._telegram_id_to_uuid(user_id)
@@ -46,13 +103,18 @@ class ConversationMemory:
             # Use default limit if none specified
             if limit is None:
                 limit = self.default_history_limit
+
+            since = (datetime.utcnow() - timedelta(days=lookback_days)).isoformat()
             
-            response = self.supabase.table(self.table)\
-                .select("*")\
-                .eq("user_id", user_uuid)\
-                .order("timestamp", desc=True)\
-                .limit(limit)\
-                .execute()
+            response = await self.db.execute(
+                self.db.table(self.table)
+                    .select(columns)
+                    .eq("user_id", user_uuid)
+                    .gte("timestamp", since)
+                    .order("timestamp", desc=True)
+                    .limit(limit),
+                "conversation_history.recent"
+            )
             
             # Convert to list of message dictionaries
             messages = []
@@ -61,7 +123,7 @@ class ConversationMemory:
                     "role": record["role"],
                     "content": record["content"],
                     "metadata": record.get("metadata", {}),
-                    "timestamp": record["timestamp"]
+                    "timestamp": record.get("timestamp")
                 })
             
             # Reverse to get chronological order
@@ -70,47 +132,58 @@ class ConversationMemory:
             print(f"Error retrieving conversation history: {str(e)}")
             return []
 
-    def get_conversation_summary(self, user_id: int) -> Dict:
-        """Get a summary of the conversation history."""
+    async def get_conversation_summary(self, user_id: int) -> Dict:
+        """
+        Get a summary of the whole conversation history.
+
+        Reads the single conversation_summaries row kept up to date by
+        database triggers, so the counts are exact however long the history is.
+        """
         try:
-            # Get recent history
-            history = self.get_recent_history(user_id)
-            
-            # Count messages by role
-            message_counts = {
-                "user": len([m for m in history if m["role"] == "user"]),
-                "assistant": len([m for m in history if m["role"] == "assistant"])
-            }
-            
-            # Get first and last message timestamps
-            if history:
-                first_message = history[0]
-                last_message = history[-1]
-                duration = datetime.fromisoformat(last_message["timestamp"]) - datetime.fromisoformat(first_message["timestamp"])
+            # Convert Telegram user_id to UUID
+            user_uuid = self._telegram_id_to_uuid(user_id)
+
+            response = await self.db.execute(
+                self.db.table(self.summary_table)
+                    .select("total_messages,role_counts,intent_counts,first_message_at,last_message_at")
+                    .eq("user_id", user_uuid)
+                    .limit(1),
+                "conversation_summaries.select"
+            )
+            summary = response.data[0] if response.data else {}
+
+            role_counts = summary.get("role_counts") or {}
+            message_counts = {"user": 0, "assistant": 0, **role_counts}
+
+            first_time = summary.get("first_message_at")
+            last_time = summary.get("last_message_at")
+            if first_time and last_time:
+                duration = datetime.fromisoformat(last_time) - datetime.fromisoformat(first_time)
             else:
                 duration = timedelta(0)
             
             return {
-                "total_messages": len(history),
+                "total_messages": summary.get("total_messages", 0),
                 "message_counts": message_counts,
-                "first_message_time": history[0]["timestamp"] if history else None,
-                "last_message_time": history[-1]["timestamp"] if history else None,
+                "intent_counts": summary.get("intent_counts") or {},
+                "first_message_time": first_time,
+                "last_message_time": last_time,
                 "conversation_duration": str(duration)
             }
         except Exception as e:
             print(f"Error getting conversation summary: {str(e)}")
             return {}
 
-    def clear_history(self, user_id: int) -> None:
+    async def clear_history(self, user_id: int) -> None:
         """Clear conversation history for a user."""
         try:
             # Convert Telegram user_id to UUID
             user_uuid = self._telegram_id_to_uuid(user_id)
             
-            self.supabase.table(self.table)\
-                .delete()\
-                .eq("user_id", user_uuid)\
-                .execute()
+            await self.db.execute(
+                self.db.table(self.table).delete().eq("user_id", user_uuid),
+                "conversation_history.delete"
+            )
         except Exception as e:
             print(f"Error clearing conversation history: {str(e)}")
             raise 
\ No newline at end of file
@@ -0,0 +1,298 @@
+"""
+Streaming export of conversation_history for analytics jobs.
+
+Rows are read with keyset pagination on (timestamp, id), so every page is an
+index range scan no matter how deep into the table the export is, and only
+one page is held in memory at a time. Output is JSONL (one file) or Parquet
+(a directory of part files). Progress is checkpointed so an interrupted
+export resumes where it stopped.
+
+Usage:
+    python -m services.memory.history_export --out history.jsonl
+    python -m services.memory.history_export --format parquet --out history_parquet/
+    python -m services.memory.history_export --out history.jsonl --resume
+"""
+from typing import Dict, Iterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import json
+import os
+import time
+
+from supabase import Client
+
+DEFAULT_COLUMNS = "id,user_id,role,content,metadata,timestamp"
+
+class ConversationHistoryExporter:
+    def __init__(self, supabase_client: Client, columns: str = DEFAULT_COLUMNS, page_size: int = 5000):
+        """Initialize the exporter with a Supabase client and column projection."""
+        self.supabase = supabase_client
+        self.table = "conversation_history"
+        self.columns = columns
+        self.page_size = page_size
+
+    def _fetch_page(self, after: Optional[Dict]) -> List[Dict]:
+        """Fetch the page of rows that sorts strictly after the (timestamp, id) cursor."""
+        query = self.supabase.table(self.table)\
+            .select(self.columns)\
+            .order("timestamp")\
+            .order("id")\
+            .limit(self.page_size)
+        if after:
+            ts = after["timestamp"]
+            query = query.or_(
+                f'timestamp.gt."{ts}",and(timestamp.eq."{ts}",id.gt.{after["id"]})'
+            )
+        return query.execute().data
+
+    def iter_pages(self, after: Optional[Dict] = None) -> Iterator[List[Dict]]:
+        """
+        Yield pages in (timestamp, id) order, starting after an optional cursor.
+
+        The next page is requested while the caller processes the current one,
+        so network latency overlaps with writing.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self._fetch_page, after)
+            while True:
+                page = pending.result()
+                if not page:
+                    return
+                if len(page) == self.page_size:
+                    last = page[-1]
+                    pending = executor.submit(
+                        self._fetch_page, {"timestamp": last["timestamp"], "id": last["id"]}
+                    )
+                yield page
+                if len(page) < self.page_size:
+                    return
+
+    def iter_rows(self, after: Optional[Dict] = None) -> Iterator[Dict]:
+        """Yield rows one at a time in (timestamp, id) order."""
+        for page in self.iter_pages(after):
+            yield from page
+
+    def export(self, writer, checkpoint_path: Optional[str] = None, resume: bool = False,
+               log_every: float = 10.0) -> int:
+        """
+        Stream the table into a writer, checkpointing after each durable write.
+
+        Args:
+            writer: JsonlWriter or ParquetWriter
+            checkpoint_path: Where progress is recorded (JSON)
+            resume: Continue from the checkpoint instead of starting over
+
+        Returns:
+            Total rows exported, including rows from earlier runs when resuming
+        """
+        checkpoint = load_checkpoint(checkpoint_path) if resume and checkpoint_path else {}
+        writer.open(checkpoint)
+        cursor = checkpoint.get("cursor")
+        total = checkpoint.get("rows", 0)
+
+        started = time.monotonic()
+        last_log = started
+        exported = 0
+        try:
+            for page in self.iter_pages(cursor):
+                writer.write(page)
+                last = page[-1]
+                cursor = {"timestamp": last["timestamp"], "id": last["id"]}
+                total += len(page)
+                exported += len(page)
+
+                state = writer.commit_state()
+                if state is not None and checkpoint_path:
+                    save_checkpoint(checkpoint_path, {"cursor": cursor, "rows": total, **state})
+
+                now = time.monotonic()
+                if now - last_log >= log_every:
+                    rate = exported / (now - started)
+                    print(f"Exported {total} rows ({rate:.0f} rows/s)")
+                    last_log = now
+        finally:
+            state = writer.close()
+            if checkpoint_path and cursor is not None:
+                save_checkpoint(checkpoint_path, {"cursor": cursor, "rows": total, **state})
+
+        return total
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        """Append rows as JSON lines to a single file."""
+        self.path = path
+        self.file = None
+
+    def open(self, checkpoint: Dict) -> None:
+        # Drop anything written after the last checkpoint so resumed rows are not duplicated
+        offset = checkpoint.get("offset")
+        if offset is not None and os.path.exists(self.path):
+            self.file = open(self.path, "r+", encoding="utf-8")
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        else:
+            self.file = open(self.path, "w", encoding="utf-8")
+
+    def write(self, rows: List[Dict]) -> None:
+        self.file.write("".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows))
+
+    def commit_state(self) -> Optional[Dict]:
+        """Make written rows durable and return the resume offset."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"offset": self.file.tell()}
+
+    def close(self) -> Dict:
+        state = self.commit_state()
+        self.file.close()
+        return state
+
+class ParquetWriter:
+    def __init__(self, directory: str, rows_per_file: int = 1_000_000, row_group_size: int = 50_000):
+        """
+        Write rows to a directory of Parquet part files.
+
+        A part file only becomes valid once closed, so the checkpoint advances
+        when a part is finished; a resumed export rewrites the unfinished part.
+        Requires pyarrow.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("Parquet export requires pyarrow (pip install pyarrow)") from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self.row_group_size = row_group_size
+        self.part = 0
+        self.part_rows = 0
+        self.buffer: List[Dict] = []
+        self.writer = None
+        self.schema = None
+        self.rows_written = 0
+        self.last_cursor: Optional[Dict] = None
+        self.committed: Optional[Dict] = None
+        self.pending_commit = False
+
+    def open(self, checkpoint: Dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.part = checkpoint.get("part", 0)
+        self.rows_written = checkpoint.get("rows", 0)
+        self.committed = dict(checkpoint) if checkpoint else None
+
+    def _column_type(self, name: str):
+        if name == "id":
+            return self.pa.int64()
+        if name in ("timestamp", "created_at"):
+            return self.pa.timestamp("us", tz="UTC")
+        return self.pa.string()
+
+    def _convert(self, name: str, value):
+        """Coerce a PostgREST value to the column's Arrow type."""
+        if value is None:
+            return None
+        if name in ("timestamp", "created_at"):
+            return datetime.fromisoformat(value)
+        if name == "id":
+            return int(value)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return str(value)
+
+    def _flush_buffer(self) -> None:
+        if not self.buffer:
+            return
+        if self.schema is None:
+            names = list(self.buffer[0].keys())
+            self.schema = self.pa.schema([(name, self._column_type(name)) for name in names])
+        if self.writer is None:
+            path = os.path.join(self.directory, f"part-{self.part:05d}.parquet")
+            self.writer = self.pq.ParquetWriter(path, self.schema, compression="zstd")
+        columns = {
+            name: [self._convert(name, row.get(name)) for row in self.buffer]
+            for name in self.schema.names
+        }
+        self.writer.write_table(self.pa.table(columns, schema=self.schema))
+        self.buffer = []
+
+    def _finish_part(self) -> None:
+        """Close the current part and record the cursor of its last row."""
+        self._flush_buffer()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.part += 1
+            self.part_rows = 0
+            self.committed = {"part": self.part, "cursor": self.last_cursor, "rows": self.rows_written}
+            self.pending_commit = True
+
+    def write(self, rows: List[Dict]) -> None:
+        for row in rows:
+            self.buffer.append(row)
+            self.part_rows += 1
+            self.rows_written += 1
+            self.last_cursor = {"timestamp": row["timestamp"], "id": row["id"]}
+            if len(self.buffer) >= self.row_group_size:
+                self._flush_buffer()
+            if self.part_rows >= self.rows_per_file:
+                self._finish_part()
+
+    def commit_state(self) -> Optional[Dict]:
+        """
+        Checkpoint only when a part file has been completed.
+
+        The state carries the cursor and row count of the last finished part,
+        which can trail the page just written.
+        """
+        if not self.pending_commit:
+            return None
+        self.pending_commit = False
+        return self.committed
+
+    def close(self) -> Dict:
+        self._finish_part()
+        self.pending_commit = False
+        return self.committed or {"part": self.part}
+
+def load_checkpoint(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_checkpoint(path: str, state: Dict) -> None:
+    """Atomically replace the checkpoint file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def main():
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="JSONL file or Parquet directory")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--columns", default=DEFAULT_COLUMNS, help="Comma-separated projection (must include id,timestamp)")
+    parser.add_argument("--page-size", type=int, default=5000)
+    parser.add_argument("--checkpoint", help="Checkpoint file (defaults to <out>.checkpoint.json)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    args = parser.parse_args()
+
+    load_dotenv()
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    exporter = ConversationHistoryExporter(supabase, columns=args.columns, page_size=args.page_size)
+    writer = JsonlWriter(args.out) if args.format == "jsonl" else ParquetWriter(args.out)
+    checkpoint = args.checkpoint or f"{args.out.rstrip(os.sep)}.checkpoint.json"
+
+    total = exporter.export(writer, checkpoint_path=checkpoint, resume=args.resume)
+    print(f"Export complete: {total} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Re-run intent, topic and sentiment tagging over all of conversation_history.
+
+Run this after the keyword rules in config.config change. Rows are streamed
+with the exporter's keyset pagination. Each page is split into chunks and
+tagged in a process pool with vectorized pandas/NumPy operations: a chunk
+is tokenised with one regex call, tokens become keyword codes through a hash
+lookup, and per-message tags come from NumPy reductions instead of
+per-message Python loops. Only rows whose tags changed are written back, one bulk RPC per
+page, and progress is checkpointed so an interrupted run resumes. The RPC
+moves the intent counts in conversation_summaries along with each page, so
+summaries are never rebuilt.
+
+Usage:
+    python -m services.memory.history_reclassify --dry-run
+    python -m services.memory.history_reclassify --processes 8
+    python -m services.memory.history_reclassify --resume
+"""
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import Counter
+import argparse
+import functools
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from config.config import (
+    INTENT_KEYWORDS,
+    TOPIC_KEYWORDS,
+    POSITIVE_WORDS,
+    NEGATIVE_WORDS,
+    RECLASSIFY_PAGE_SIZE,
+    RECLASSIFY_CHUNK_SIZE
+)
+from services.memory.history_export import ConversationHistoryExporter, load_checkpoint, save_checkpoint
+from utils.text_analysis import word_forms
+
+COLUMNS = "id,timestamp,role,content,metadata"
+TAG_FIELDS = ("intent", "topic", "sentiment")
+SEPARATOR = "\n"  # Joins messages for tokenising; also matched as a token
+TOKEN = re.compile(r"[a-z]+|\n")
+
+class TaggingRules:
+    def __init__(self, intent_keywords: Dict[str, List[str]] = INTENT_KEYWORDS,
+                 topic_keywords: Dict[str, List[str]] = TOPIC_KEYWORDS,
+                 positive_words: List[str] = POSITIVE_WORDS, negative_words: List[str] = NEGATIVE_WORDS,
+                 default_intent: str = 'general_inquiry', default_topic: str = 'general'):
+        """
+        Keyword rules flattened into per-word lookup arrays.
+
+        Word matching follows utils.text_analysis (whole words plus plural,
+        -ed and -ing forms), so batch tags agree with live analysis. Every
+        known word form gets a code; for each code the arrays hold its best
+        intent and topic rank and a bitmask of the sentiment words it counts
+        as (so "thanks" counts as both "thanks" and "thank", as it does live).
+        """
+        self.intents = np.array(list(intent_keywords) + [default_intent], dtype=object)
+        self.topics = np.array(list(topic_keywords) + [default_topic], dtype=object)
+
+        forms = sorted(
+            {form for groups in (intent_keywords, topic_keywords) for keywords in groups.values()
+             for keyword in keywords for form in word_forms(keyword)}
+            | {form for word in list(positive_words) + list(negative_words) for form in word_forms(word)}
+        )
+        # Phrases cannot match single tokens; the tagging rules are single words
+        self.forms = pd.Index([form for form in forms if ' ' not in form])
+        size = len(self.forms)
+
+        def ranks(groups: Dict[str, List[str]]) -> np.ndarray:
+            rank = np.full(size, len(groups), dtype=np.int64)
+            for position, keywords in enumerate(groups.values()):
+                codes = self.forms.get_indexer([form for keyword in keywords for form in word_forms(keyword)])
+                codes = codes[codes >= 0]
+                rank[codes] = np.minimum(rank[codes], position)
+            return rank
+
+        def masks(words: List[str]) -> np.ndarray:
+            if len(words) > 64:
+                raise ValueError("At most 64 words per sentiment list")
+            mask = np.zeros(size, dtype=np.uint64)
+            for bit, word in enumerate(words):
+                codes = self.forms.get_indexer(list(word_forms(word)))
+                mask[codes[codes >= 0]] |= np.uint64(1 << bit)
+            return mask
+
+        self.intent_rank = ranks(intent_keywords)
+        self.topic_rank = ranks(topic_keywords)
+        self.positive_mask = masks(list(positive_words))
+        self.negative_mask = masks(list(negative_words))
+        self.version = hashlib.sha1(json.dumps(
+            [intent_keywords, topic_keywords, positive_words, negative_words, default_intent, default_topic],
+            sort_keys=True
+        ).encode()).hexdigest()[:12]
+
+    @staticmethod
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+    def tag(self, content: pd.Series) -> pd.DataFrame:
+        """
+        Intent, topic and sentiment for every message in a Series.
+
+        All messages are joined into one string and tokenised with a single
+        regex call; a separator token marks where each message ends, so a
+        cumulative sum gives every token its row. Everything after that is
+        NumPy: a hash lookup turns tokens into codes and ufunc.at reductions
+        fold them into per-row results.
+
+        Returns:
+            DataFrame with the Series' index and columns intent, topic, sentiment
+        """
+        count = len(content)
+        text = SEPARATOR.join(content.fillna('').astype(str).str.replace(SEPARATOR, ' ', regex=False)).lower()
+        tokens = np.array(TOKEN.findall(text), dtype=object)
+        rows = np.cumsum(tokens == SEPARATOR)
+        codes = self.forms.get_indexer(tokens)
+        known = codes >= 0
+        rows, codes = rows[known], codes[known]
+
+        intent = np.full(count, len(self.intents) - 1, dtype=np.int64)
+        np.minimum.at(intent, rows, self.intent_rank[codes])
+        topic = np.full(count, len(self.topics) - 1, dtype=np.int64)
+        np.minimum.at(topic, rows, self.topic_rank[codes])
+        positive = np.zeros(count, dtype=np.uint64)
+        np.bitwise_or.at(positive, rows, self.positive_mask[codes])
+        negative = np.zeros(count, dtype=np.uint64)
+        np.bitwise_or.at(negative, rows, self.negative_mask[codes])
+        positive, negative = self._popcount(positive), self._popcount(negative)
+
+        return pd.DataFrame({
+            'intent': self.intents[intent],
+            'topic': self.topics[topic],
+            'sentiment': np.select([positive > negative, negative > positive], ['positive', 'negative'], 'neutral')
+        }, index=content.index)
+
+@functools.lru_cache(maxsize=1)
+def default_rules() -> TaggingRules:
+    return TaggingRules()
+
+def tag_rows(rows: List[Dict]) -> List[Dict]:
+    """
+    Tag user messages and return the updates to write back.
+
+    Runs in pool workers. Rows that already carry the same tags are skipped.
+    """
+    rules = default_rules()
+    rows = [row for row in rows if row.get('role') == 'user']
+    if not rows:
+        return []
+    tags = rules.tag(pd.Series([row.get('content') for row in rows], dtype=object))
+    updates = []
+    for row, intent, topic, sentiment in zip(rows, tags['intent'], tags['topic'], tags['sentiment']):
+        metadata = row.get('metadata') if isinstance(row.get('metadata'), dict) else {}
+        if (metadata.get('intent') == intent and metadata.get('topic') == topic
+                and metadata.get('sentiment') == sentiment and metadata.get('rules_version') == rules.version):
+            continue
+        updates.append({
+            'id': int(row['id']),
+            'timestamp': row['timestamp'],
+            'tags': {'intent': intent, 'topic': topic, 'sentiment': sentiment, 'rules_version': rules.version}
+        })
+    return updates
+
+class HistoryReclassifier:
+    def __init__(self, supabase_client, processes: Optional[int] = None,
+                 page_size: int = RECLASSIFY_PAGE_SIZE, chunk_size: int = RECLASSIFY_CHUNK_SIZE):
+        """Stream, tag in a process pool, and bulk-update conversation_history."""
+        self.supabase = supabase_client
+        self.exporter = ConversationHistoryExporter(supabase_client, columns=COLUMNS, page_size=page_size)
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    def _write(self, updates: List[Dict]) -> int:
+        """Apply one page of updates with a single RPC call."""
+        if not updates:
+            return 0
+        return self.supabase.rpc('reclassify_conversation_history', {'p_rows': updates}).execute().data or 0
+
+    def run(self, checkpoint_path: Optional[str] = None, resume: bool = False, dry_run: bool = False,
+            log_every: float = 10.0) -> Dict:
+        """
+        Reclassify every row after the checkpoint cursor.
+
+        Each page's write runs in the background while the next page is
+        tagged; the checkpoint only advances past pages that were written.
+
+        Returns:
+            Dict with rows scanned, rows updated and tag distribution
+        """
+        checkpoint = load_checkpoint(checkpoint_path) if resume and checkpoint_path else {}
+        cursor = checkpoint.get("cursor")
+        scanned, updated = checkpoint.get("scanned", 0), checkpoint.get("updated", 0)
+        distribution: Counter = Counter()
+        started = last_log = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=self.processes) as pool, ThreadPoolExecutor(max_workers=1) as writer:
+            pending: Optional[Tuple] = None
+
+            def settle(pending) -> None:
+                nonlocal updated
+                future, page_cursor, page_scanned = pending
+                updated += future.result()
+                if checkpoint_path:
+                    save_checkpoint(checkpoint_path, {"cursor": page_cursor, "scanned": page_scanned, "updated": updated})
+
+            for page in self.exporter.iter_pages(cursor):
+                chunks = [page[i:i + self.chunk_size] for i in range(0, len(page), self.chunk_size)]
+                updates = [update for chunk in pool.map(tag_rows, chunks) for update in chunk]
+                distribution.update(
+                    f"{field}={update['tags'][field]}" for update in updates for field in TAG_FIELDS
+                )
+                scanned += len(page)
+                last = page[-1]
+                page_cursor = {"timestamp": last["timestamp"], "id": last["id"]}
+
+                if pending is not None:
+                    settle(pending)
+                    pending = None
+                if dry_run:
+                    updated += len(updates)
+                else:
+                    pending = (writer.submit(self._write, updates), page_cursor, scanned)
+
+                now = time.monotonic()
+                if now - last_log >= log_every:
+                    print(f"Reclassified {scanned} rows, {updated} updated ({scanned / (now - started):.0f} rows/s)")
+                    last_log = now
+            if pending is not None:
+                settle(pending)
+
+        return {"scanned": scanned, "updated": updated, "changed_tags": dict(distribution)}
+
+def main():
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, help="Tagging worker processes (default: CPU count)")
+    parser.add_argument("--page-size", type=int, default=RECLASSIFY_PAGE_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=RECLASSIFY_CHUNK_SIZE)
+    parser.add_argument("--checkpoint", default="reclassify.checkpoint.json")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="Tag and report without writing")
+    args = parser.parse_args()
+
+    load_dotenv()
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    reclassifier = HistoryReclassifier(supabase, processes=args.processes, page_size=args.page_size,
+                                       chunk_size=args.chunk_size)
+    result = reclassifier.run(
+        checkpoint_path=None if args.dry_run else args.checkpoint,
+        resume=args.resume,
+        dry_run=args.dry_run
+    )
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Partition maintenance for the monthly partitioned conversation_history table.
+
+Each run makes sure partitions exist for the coming months, then archives
+every partition that lies entirely before the retention cutoff: it is
+detached (so live queries stop seeing it), copied out as gzipped CSV, checked
+against its row count and only then dropped. Its per-user counts are saved
+to conversation_summaries_archived in the same transaction as the drop, so
+conversation_summaries still covers the whole history when it is refreshed.
+
+Needs a direct Postgres connection (DATABASE_URL), not the PostgREST API.
+
+Usage:
+    python -m services.memory.history_retention
+    python -m services.memory.history_retention --retention-months 6 --dry-run
+"""
+from typing import Dict, List, Optional
+from datetime import datetime, timezone
+import argparse
+import csv
+import gzip
+import os
+import re
+
+import psycopg
+from psycopg import sql
+
+PARENT_TABLE = "conversation_history"
+PARTITION_NAME = re.compile(r"^conversation_history_y(\d{4})m(\d{2})$")
+
+def months_before(moment: datetime, months: int) -> datetime:
+    """First instant (UTC) of the month `months` before the month of `moment`."""
+    index = moment.year * 12 + (moment.month - 1) - months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+class HistoryRetention:
+    def __init__(self, dsn: str, archive_dir: str, retention_months: int = 12, months_ahead: int = 3):
+        """Initialize the job with a Postgres DSN and the archive directory."""
+        self.dsn = dsn
+        self.archive_dir = archive_dir
+        self.retention_months = retention_months
+        self.months_ahead = months_ahead
+
+    def _connect(self) -> psycopg.Connection:
+        return psycopg.connect(self.dsn, autocommit=True)
+
+    def ensure_partitions(self, conn: psycopg.Connection) -> int:
+        """Create any missing upcoming monthly partitions; returns how many were created."""
+        row = conn.execute(
+            "SELECT ensure_conversation_history_partitions(%s)", (self.months_ahead,)
+        ).fetchone()
+        return row[0]
+
+    def expired_partitions(self, conn: psycopg.Connection, now: Optional[datetime] = None) -> List[str]:
+        """
+        Monthly partitions whose whole range is older than the retention cutoff.
+
+        The default partition is never returned.
+        """
+        cutoff = months_before(now or datetime.now(timezone.utc), self.retention_months)
+        rows = conn.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            ORDER BY child.relname
+            """,
+            (PARENT_TABLE,)
+        ).fetchall()
+
+        expired = []
+        for (name,) in rows:
+            match = PARTITION_NAME.match(name)
+            if not match:
+                continue
+            start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            # A partition covers [start, start + 1 month), so it is expired once that month ends
+            if months_before(start, -1) <= cutoff:
+                expired.append(name)
+        return expired
+
+    def _archive_path(self, partition: str) -> str:
+        return os.path.join(self.archive_dir, f"{partition}.csv.gz")
+
+    def archive_partition(self, conn: psycopg.Connection, partition: str) -> str:
+        """
+        Write a detached partition to <archive_dir>/<partition>.csv.gz.
+
+        The file is written under a temporary name, fsynced and renamed, so
+        an archive that exists is always complete. Returns the archive path.
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self._archive_path(partition)
+        tmp_path = f"{path}.tmp"
+
+        copy_sql = sql.SQL("COPY {} TO STDOUT (FORMAT csv, HEADER)").format(sql.Identifier(partition))
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as out:
+                with conn.cursor().copy(copy_sql) as copy:
+                    for chunk in copy:
+                        out.write(chunk)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    def _row_count(self, conn: psycopg.Connection, partition: str) -> int:
+        return conn.execute(
+            sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(partition))
+        ).fetchone()[0]
+
+    def _archived_row_count(self, partition: str) -> int:
+        """Count records in an archive by parsing it back, so multi-line values count once."""
+        with gzip.open(self._archive_path(partition), "rt", encoding="utf-8", newline="") as f:
+            return sum(1 for _ in csv.reader(f)) - 1
+
+    def retire_partition(self, conn: psycopg.Connection, partition: str, dry_run: bool = False) -> Dict:
+        """Detach, archive, verify, record its summary counts and drop one partition."""
+        result = {"partition": partition, "rows": self._row_count(conn, partition), "archived": False}
+        if dry_run:
+            return result
+
+        # Detaching first keeps the partition out of live queries while it is copied.
+        # A partition left detached by an interrupted run is picked up again below.
+        attached = conn.execute(
+            "SELECT 1 FROM pg_inherits JOIN pg_class ON pg_class.oid = pg_inherits.inhrelid "
+            "WHERE pg_class.relname = %s",
+            (partition,)
+        ).fetchone()
+        if attached:
+            conn.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                sql.Identifier(PARENT_TABLE), sql.Identifier(partition)
+            ))
+
+        self.archive_partition(conn, partition)
+        archived = self._archived_row_count(partition)
+        if archived != result["rows"]:
+            raise RuntimeError(
+                f"Archive of {partition} has {archived} rows, table has {result['rows']}; not dropping"
+            )
+
+        with conn.transaction():
+            conn.execute("SELECT archive_conversation_partition_counts(%s)", (partition,))
+            conn.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(partition)))
+        result["archived"] = True
+        return result
+
+    def _detached_partitions(self, conn: psycopg.Connection) -> List[str]:
+        """Monthly partition tables left detached by an interrupted run."""
+        rows = conn.execute(
+            """
+            SELECT relname FROM pg_class
+            WHERE relkind = 'r'
+              AND relname LIKE 'conversation\\_history\\_y%%'
+              AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = pg_class.oid)
+            ORDER BY relname
+            """
+        ).fetchall()
+        return [name for (name,) in rows if PARTITION_NAME.match(name)]
+
+    def run(self, dry_run: bool = False) -> Dict:
+        """
+        Run one maintenance pass.
+
+        Returns:
+            Dict with the number of partitions created and the per-partition
+            results of the retention step
+        """
+        with self._connect() as conn:
+            created = 0 if dry_run else self.ensure_partitions(conn)
+            partitions = self.expired_partitions(conn)
+            if not dry_run:
+                partitions = sorted(set(partitions) | set(self._detached_partitions(conn)))
+            results = []
+            for partition in partitions:
+                try:
+                    results.append(self.retire_partition(conn, partition, dry_run=dry_run))
+                except Exception as e:
+                    print(f"Error archiving partition {partition}: {str(e)}")
+                    results.append({"partition": partition, "archived": False, "error": str(e)})
+            return {"created": created, "retired": results}
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    from config.config import DATABASE_URL, HISTORY_ARCHIVE_DIR, HISTORY_RETENTION_MONTHS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL, help="Postgres connection string (defaults to DATABASE_URL)")
+    parser.add_argument("--archive-dir", default=HISTORY_ARCHIVE_DIR)
+    parser.add_argument("--retention-months", type=int, default=HISTORY_RETENTION_MONTHS)
+    parser.add_argument("--months-ahead", type=int, default=3)
+    parser.add_argument("--dry-run", action="store_true", help="Only list partitions that would be archived")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("DATABASE_URL is not set and --dsn was not given")
+
+    job = HistoryRetention(args.dsn, args.archive_dir, args.retention_months, args.months_ahead)
+    summary = job.run(dry_run=args.dry_run)
+    print(f"Created {summary['created']} partitions")
+    for result in summary["retired"]:
+        status = "archived" if result["archived"] else ("would archive" if args.dry_run else "FAILED")
+        print(f"{result['partition']}: {status} ({result.get('rows', '?')} rows)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+from functools import lru_cache
+import uuid
+
+# Fixed namespace so a Telegram user always maps to the same UUID
+TELEGRAM_NAMESPACE = uuid.UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')
+
+@lru_cache(maxsize=100000)
+def telegram_id_to_uuid(telegram_id: int) -> str:
+    """Convert a Telegram user ID to a UUID v5, memoized per process."""
+    return str(uuid.uuid5(TELEGRAM_NAMESPACE, str(telegram_id)))
+
+# Separate namespace for row ids derived from outbox idempotency keys
+OUTBOX_ROW_NAMESPACE = uuid.UUID('0b8f3a52-6c1e-5d57-9a3e-4f2d7c9e1b60')
+
+def outbox_key_to_uuid(key: str) -> str:
+    """Stable client_row_id for an outbox idempotency key."""
+    return str(uuid.uuid5(OUTBOX_ROW_NAMESPACE, key))
@@ -1,82 +1,200 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
-from supabase import Client
-import uuid
+import copy
+from config.config import PREFERENCES_CACHE_SIZE, PREFERENCES_CACHE_TTL
+from services.memory.cache import TTLCache, MISSING
+from services.memory.identity import telegram_id_to_uuid
+from services.supabase_data import SupabaseDataLayer
 
 class UserPreferences:
-    def __init__(self, supabase_client: Client):
-        """Initialize user preferences with Supabase client."""
-        self.supabase = supabase_client
+    def __init__(self, db: SupabaseDataLayer, cache_size: int = PREFERENCES_CACHE_SIZE,
+                 cache_ttl: float = PREFERENCES_CACHE_TTL):
+        """Initialize user preferences with the shared data layer and a read-through cache."""
+        self.db = db
         self.table = "user_preferences"
+        # Caches the stored document per Telegram user, including "no preferences" (None)
+        self.cache = TTLCache(max_entries=cache_size, ttl_seconds=cache_ttl)
+        self.batch_size = 500  # Users per merge_user_preferences_batch call
+        # Users with a read in flight -> [write generation, readers]; a read only
+        # fills the cache if no write for that user finished while it waited
+        self.reads: Dict[int, List[int]] = {}
 
     def _telegram_id_to_uuid(self, telegram_id: int) -> str:
         """Convert a Telegram user ID to a UUID v5 using a namespace."""
-        # Use a fixed namespace UUID for consistency
-        namespace = uuid.UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')
-        # Convert the telegram_id to a string and use it as the name
-        return str(uuid.uuid5(namespace, str(telegram_id)))
+        return telegram_id_to_uuid(telegram_id)
 
-    def save_preferences(self, user_id: int, preferences: Dict) -> None:
+    def _begin_read(self, user_id: int) -> int:
+        entry = self.reads.setdefault(user_id, [0, 0])
+        entry[1] += 1
+        return entry[0]
+
+    def _end_read(self, user_id: int, generation: int) -> bool:
+        """Finish a read; True when no write for the user landed since _begin_read."""
+        entry = self.reads[user_id]
+        entry[1] -= 1
+        if not entry[1]:
+            del self.reads[user_id]
+        return entry[0] == generation
+
+    def _written(self, user_id: int) -> None:
+        """Mark reads in flight for the user as stale."""
+        entry = self.reads.get(user_id)
+        if entry is not None:
+            entry[0] += 1
+
+    def cache_stats(self) -> Dict:
+        """Hit/miss counters of the preferences cache."""
+        return self.cache.stats()
+
+    async def save_preferences(self, user_id: int, preferences: Dict) -> None:
         """Save or update user preferences."""
         try:
             # Convert Telegram user_id to UUID
             user_uuid = self._telegram_id_to_uuid(user_id)
             
-            self.supabase.table(self.table)\
-                .upsert({
+            await self.db.execute(
+                self.db.table(self.table).upsert({
                     "user_id": user_uuid,
                     "preferences": preferences,
                     "updated_at": datetime.utcnow().isoformat()
-                })\
-                .execute()
+                }),
+                "user_preferences.upsert"
+            )
+
+            # Write through so the next read is served from memory
+            self._written(user_id)
+            self.cache.set(user_id, copy.deepcopy(preferences))
         except Exception as e:
+            self._written(user_id)
+            self.cache.invalidate(user_id)
             print(f"Error saving user preferences: {str(e)}")
             raise
 
-    def get_preferences(self, user_id: int) -> Optional[Dict]:
-        """Get user preferences."""
+    async def get_preferences(self, user_id: int) -> Optional[Dict]:
+        """Get user preferences, from the cache when possible."""
         try:
+            cached = self.cache.get(user_id)
+            if cached is not MISSING:
+                # Callers may modify the result; never hand out the cached object
+                return copy.deepcopy(cached)
+
             # Convert Telegram user_id to UUID
             user_uuid = self._telegram_id_to_uuid(user_id)
             
-            response = self.supabase.table(self.table)\
-                .select("*")\
-                .eq("user_id", user_uuid)\
-                .execute()
+            generation = self._begin_read(user_id)
+            try:
+                response = await self.db.execute(
+                    self.db.table(self.table).select("preferences").eq("user_id", user_uuid),
+                    "user_preferences.select"
+                )
+            finally:
+                fresh = self._end_read(user_id, generation)
             
             # Return preferences if found, otherwise return None
+            preferences = None
             if response.data and len(response.data) > 0:
-                return response.data[0].get("preferences")
-            return None
+                preferences = response.data[0].get("preferences")
+            if fresh:
+                self.cache.set(user_id, preferences)
+            return copy.deepcopy(preferences)
         except Exception as e:
             print(f"Error retrieving user preferences: {str(e)}")
             return None
 
-    def update_preference(self, user_id: int, key: str, value: any) -> None:
+    async def patch_preferences(self, user_id: int, patch: Dict) -> Optional[Dict]:
+        """
+        Merge keys into a user's preferences in one round trip.
+
+        Uses the merge_user_preferences RPC, which applies a JSONB merge on the
+        server, so concurrent patches of different keys do not overwrite each
+        other. Returns the merged preferences.
+        """
+        try:
+            # Convert Telegram user_id to UUID
+            user_uuid = self._telegram_id_to_uuid(user_id)
+
+            response = await self.db.execute(
+                self.db.rpc('merge_user_preferences', {'p_user_id': user_uuid, 'p_patch': patch}),
+                "rpc.merge_user_preferences"
+            )
+
+            merged = response.data
+            self._written(user_id)
+            if isinstance(merged, dict):
+                self.cache.set(user_id, copy.deepcopy(merged))
+            else:
+                self.cache.invalidate(user_id)
+            return merged
+        except Exception as e:
+            self._written(user_id)
+            self.cache.invalidate(user_id)
+            print(f"Error patching user preferences: {str(e)}")
+            raise
+
+    async def patch_preferences_batch(self, patches: Dict[int, Dict]) -> Dict[int, Dict]:
+        """
+        Merge keys into many users' preferences with one RPC per chunk.
+
+        Args:
+            patches: Telegram user ID -> keys to merge
+
+        Returns:
+            Telegram user ID -> merged preferences
+        """
+        merged = {}
+        user_ids = {self._telegram_id_to_uuid(user_id): user_id for user_id in patches}
+        items = [
+            {'user_id': user_uuid, 'patch': patches[user_id]}
+            for user_uuid, user_id in user_ids.items()
+        ]
+
+        try:
+            for start in range(0, len(items), self.batch_size):
+                response = await self.db.execute(
+                    self.db.rpc(
+                        'merge_user_preferences_batch',
+                        {'p_patches': items[start:start + self.batch_size]}
+                    ),
+                    "rpc.merge_user_preferences_batch"
+                )
+
+                for record in response.data or []:
+                    user_id = user_ids.get(record.get('user_id'))
+                    if user_id is not None:
+                        merged[user_id] = record.get('preferences')
+                        self._written(user_id)
+                        self.cache.set(user_id, copy.deepcopy(record.get('preferences')))
+            return merged
+        except Exception as e:
+            for user_id in patches:
+                if user_id not in merged:
+                    self._written(user_id)
+                    self.cache.invalidate(user_id)
+            print(f"Error patching user preferences in batch: {str(e)}")
+            raise
+
+    async def update_preference(self, user_id: int, key: str, value: any) -> None:
         """Update a single preference value."""
         try:
-            # Get current preferences
-            current_prefs = self.get_preferences(user_id) or {}
-            
-            # Update the specific preference
-            current_prefs[key] = value
-            
-            # Save updated preferences
-            self.save_preferences(user_id, current_prefs)
+            await self.patch_preferences(user_id, {key: value})
         except Exception as e:
             print(f"Error updating user preference: {str(e)}")
             raise
 
-    def delete_preferences(self, user_id: int) -> None:
+    async def delete_preferences(self, user_id: int) -> None:
         """Delete user preferences."""
         try:
             # Convert Telegram user_id to UUID
             user_uuid = self._telegram_id_to_uuid(user_id)
             
-            self.supabase.table(self.table)\
-                .delete()\
-                .eq("user_id", user_uuid)\
-                .execute()
+            await self.db.execute(
+                self.db.table(self.table).delete().eq("user_id", user_uuid),
+                "user_preferences.delete"
+            )
+            self._written(user_id)
+            self.cache.set(user_id, None)
         except Exception as e:
+            self._written(user_id)
+            self.cache.invalidate(user_id)
             print(f"Error deleting user preferences: {str(e)}")
             raise 
\ No newline at end of file
@@ -0,0 +1,130 @@
+from typing import Callable, Dict, List, Optional
+import asyncio
+import inspect
+
+_STOP = object()
+
+class WriteBehindBuffer:
+    def __init__(self, flush_fn: Callable[[List[Dict]], None], max_batch_size: int = 200,
+                 flush_interval: float = 1.0, max_pending: int = 10000, max_retries: int = 3,
+                 name: str = "write_behind"):
+        """
+        Collect rows in memory and write them as multi-row bulk inserts.
+
+        A batch is flushed when it reaches `max_batch_size` rows or when
+        `flush_interval` seconds have passed since its first row. `flush_fn`
+        receives the whole batch; synchronous functions run in a worker thread
+        so the event loop is never blocked. At most `max_pending` rows are
+        queued: `submit` reports a full buffer and `put` waits for room.
+        """
+        self.flush_fn = flush_fn
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.name = name
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.stats = {
+            "rows_submitted": 0,
+            "rows_rejected": 0,
+            "rows_written": 0,
+            "rows_dropped": 0,
+            "batches_written": 0
+        }
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done() and not self.stopping
+
+    def start(self) -> None:
+        """Start the background flusher on the running event loop."""
+        if self.running:
+            return
+        self.stopping = False
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, row: Dict) -> bool:
+        """
+        Queue a row without waiting.
+
+        Returns False when the buffer is not running or is full; the caller
+        then decides whether to write synchronously or retry.
+        """
+        if not self.running:
+            return False
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.stats["rows_rejected"] += 1
+            return False
+        self.stats["rows_submitted"] += 1
+        return True
+
+    async def put(self, row: Dict) -> bool:
+        """Queue a row, waiting for room when the buffer is full (backpressure)."""
+        if not self.running:
+            return False
+        await self.queue.put(row)
+        self.stats["rows_submitted"] += 1
+        return True
+
+    async def stop(self) -> None:
+        """Stop accepting rows, flush everything pending and wait for the flusher."""
+        if self.task is None:
+            return
+        if not self.task.done():
+            self.stopping = True
+            await self.queue.put(_STOP)
+            await self.task
+        self.task = None
+
+    async def _run(self) -> None:
+        """Gather rows into batches on size or time thresholds and write them."""
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            first = await self.queue.get()
+            if first is _STOP:
+                break
+
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch_size:
+                # Drain whatever is already queued before waiting on the clock
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        row = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    row = self.queue.get_nowait()
+                if row is _STOP:
+                    done = True
+                    break
+                batch.append(row)
+
+            await self._write(batch)
+
+    async def _write(self, batch: List[Dict]) -> None:
+        """Write one batch, retrying with exponential backoff before dropping it."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                if inspect.iscoroutinefunction(self.flush_fn):
+                    await self.flush_fn(batch)
+                else:
+                    await asyncio.to_thread(self.flush_fn, batch)
+                self.stats["rows_written"] += len(batch)
+                self.stats["batches_written"] += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Error flushing {self.name} batch of {len(batch)} rows: {str(e)}")
+                    self.stats["rows_dropped"] += len(batch)
+                    return
+                await asyncio.sleep(0.5 * (2 ** attempt))
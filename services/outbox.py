@@ -0,0 +1,432 @@
+from typing import Callable, Dict, List, Optional
+import asyncio
+import inspect
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+# Destinations used by the bot
+CONVERSATION_ROWS = "supabase.conversation_history"
+ESCALATION_EMAILS = "gmail.escalation"
+ESCALATION_UPDATES = "gmail.escalation_update"
+SHEET_ROWS = "sheets.append_row"
+
+class Deferred(Exception):
+    def __init__(self, retry_after: float, reason: str = "deferred"):
+        """
+        Raised by a handler that cannot deliver yet for reasons unrelated to the entry.
+
+        The entry is rescheduled `retry_after` seconds out without counting an
+        attempt, e.g. while a circuit breaker in front of the destination is open.
+        """
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+# SQLSTATE classes caused by the row itself: data exceptions and constraint violations
+ROW_ERROR_SQLSTATE_CLASSES = ("22", "23")
+
+def is_row_error(error: Exception) -> bool:
+    """
+    Whether a batch handler's error is caused by particular rows rather than the destination.
+
+    Recognises postgrest APIError codes (SQLSTATE classes 22 and 23, PGRST1xx
+    request errors, or the HTTP status when the body was not JSON) and
+    googleapiclient HttpError statuses. Client errors count as row errors
+    except 401, 403, 408 and 429. Transport errors, timeouts, 5xx and
+    anything unrecognised do not.
+    """
+    code = getattr(error, 'code', None)
+    if isinstance(code, str):
+        return code.startswith(ROW_ERROR_SQLSTATE_CLASSES) or code.startswith("PGRST1")
+    status = code if isinstance(code, int) else getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return 400 <= status < 500 and status not in (401, 403, 408, 429)
+
+class OutboxEntry:
+    __slots__ = ("id", "destination", "idempotency_key", "payload", "attempts")
+
+    def __init__(self, id: int, destination: str, idempotency_key: str, payload: Dict, attempts: int):
+        self.id = id
+        self.destination = destination
+        self.idempotency_key = idempotency_key
+        self.payload = payload
+        self.attempts = attempts
+
+class _Handler:
+    __slots__ = ("fn", "batch", "batch_size", "linger", "split_on", "keyed")
+
+    def __init__(self, fn: Callable, batch: bool, batch_size: int, linger: float = 0.0,
+                 split_on: Optional[Callable[[Exception], bool]] = None, keyed: bool = False):
+        self.fn = fn
+        self.batch = batch
+        self.batch_size = batch_size
+        self.linger = linger
+        self.split_on = split_on
+        self.keyed = keyed
+
+class OutboxChannel:
+    def __init__(self, outbox: "Outbox", destination: str):
+        """Row sink for one destination, interchangeable with WriteBehindBuffer."""
+        self.outbox = outbox
+        self.destination = destination
+
+    def submit(self, row: Dict) -> bool:
+        """Durably queue a row; False only once the outbox is closed."""
+        return self.outbox.enqueue(self.destination, row) is not None
+
+    async def put(self, row: Dict) -> bool:
+        return self.submit(row)
+
+class Outbox:
+    def __init__(self, path: str, commit_interval: float = 0.05, poll_interval: float = 1.0,
+                 max_attempts: int = 10, base_backoff: float = 2.0, max_backoff: float = 300.0,
+                 retention_seconds: float = 7 * 24 * 3600, shutdown_timeout: float = 10.0):
+        """
+        Local append-only outbox for external side effects.
+
+        `enqueue` only appends to an in-memory list; a committer thread writes
+        everything pending to SQLite (WAL) in one transaction every
+        `commit_interval` seconds, so a burst of side effects shares one fsync.
+        One worker per registered destination drains due entries, retries
+        failures with exponential backoff and marks entries dead after
+        `max_attempts`. Entries survive restarts and are replayed on start.
+        Delivery is at-least-once; idempotency keys dedupe enqueues and are
+        available to handlers.
+        """
+        self.path = path
+        self.commit_interval = commit_interval
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.retention_seconds = retention_seconds
+        self.shutdown_timeout = shutdown_timeout
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                destination TEXT NOT NULL,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT
+            )
+        """)
+        self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_outbox_due
+            ON outbox(destination, status, next_attempt_at)
+        """)
+        self.db_lock = threading.Lock()
+
+        self.pending: List[tuple] = []
+        self.pending_lock = threading.Lock()
+        self.commit_event = threading.Event()
+        self.committer: Optional[threading.Thread] = None
+        self.closed = False
+
+        self.handlers: Dict[str, _Handler] = {}
+        self.workers: Dict[str, asyncio.Task] = {}
+        self.wake_events: Dict[str, asyncio.Event] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.last_prune = 0.0
+
+    def register(self, destination: str, handler: Callable) -> None:
+        """
+        Deliver entries one at a time as handler(**payload).
+
+        An exception or a falsy return value counts as a failed attempt;
+        raising Deferred reschedules the entry without counting one.
+        """
+        self.handlers[destination] = _Handler(handler, batch=False, batch_size=1)
+
+    def register_batch(self, destination: str, handler: Callable, batch_size: int = 200,
+                       linger: float = 0.0,
+                       split_on: Callable[[Exception], bool] = is_row_error,
+                       keyed: bool = False) -> None:
+        """
+        Deliver up to batch_size payloads per call as handler([payload, ...]).
+
+        A batch failing with an error `split_on` attributes to its rows is split
+        in halves and retried down to single payloads, so the handler must
+        accept any subset of a batch. Any other error (outage, timeout, 5xx,
+        429) fails the whole batch, which retries with backoff.
+
+        With `linger`, a partial batch waits that many seconds for more entries
+        before it is delivered, trading latency for fewer calls.
+
+        With `keyed`, the handler is called as handler(payloads, keys) with
+        each entry's idempotency key. Keys are the same on every retry, so the
+        handler can make a resend of rows it already wrote a no-op (a batch
+        whose acknowledgement was lost, or one that partly succeeded).
+        """
+        self.handlers[destination] = _Handler(handler, batch=True, batch_size=batch_size, linger=linger,
+                                              split_on=split_on, keyed=keyed)
+
+    def channel(self, destination: str) -> OutboxChannel:
+        return OutboxChannel(self, destination)
+
+    def enqueue(self, destination: str, payload: Dict, idempotency_key: Optional[str] = None) -> Optional[str]:
+        """
+        Queue a side effect and return its idempotency key.
+
+        The payload is serialised immediately so later mutation by the caller
+        cannot change what is delivered. Without an idempotency_key a random
+        one is generated; either way it is stored with the entry and handed
+        to keyed batch handlers unchanged on every retry. Re-enqueueing a key
+        that is already stored is a no-op.
+        """
+        if self.closed:
+            return None
+        key = idempotency_key or uuid.uuid4().hex
+        now = time.time()
+        record = (destination, key, json.dumps(payload, default=str), now)
+        with self.pending_lock:
+            self.pending.append(record)
+        self.commit_event.set()
+        return key
+
+    def flush(self) -> int:
+        """Commit everything pending now; returns the number of rows written."""
+        with self.pending_lock:
+            records, self.pending = self.pending, []
+        if not records:
+            return 0
+
+        with self.db_lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO outbox "
+                    "(destination, idempotency_key, payload, next_attempt_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(dest, key, payload, now, now, now) for dest, key, payload, now in records]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                with self.pending_lock:
+                    self.pending = records + self.pending
+                raise
+
+        self._wake({record[0] for record in records})
+        return len(records)
+
+    def _commit_loop(self) -> None:
+        """Group-commit pending entries until the outbox is closed."""
+        while not self.closed:
+            self.commit_event.wait()
+            self.commit_event.clear()
+            # Let a burst accumulate so it shares one transaction and fsync
+            time.sleep(self.commit_interval)
+            try:
+                self.flush()
+                self._prune()
+            except Exception as e:
+                print(f"Error committing outbox entries: {str(e)}")
+                time.sleep(1)
+                self.commit_event.set()
+
+    def _prune(self) -> None:
+        """Forget delivered entries once they are past the dedupe window."""
+        now = time.time()
+        if now - self.last_prune < 3600:
+            return
+        self.last_prune = now
+        with self.db_lock:
+            self.conn.execute(
+                "DELETE FROM outbox WHERE status = 'done' AND updated_at < ?",
+                (now - self.retention_seconds,)
+            )
+
+    def _wake(self, destinations) -> None:
+        """Wake the workers of destinations that just received entries."""
+        if self.loop is None or self.loop.is_closed():
+            return
+        for destination in destinations:
+            event = self.wake_events.get(destination)
+            if event is not None:
+                self.loop.call_soon_threadsafe(event.set)
+
+    async def start(self) -> None:
+        """Start committing and replay every pending entry left from earlier runs."""
+        self.loop = asyncio.get_running_loop()
+        if self.committer is None:
+            self.committer = threading.Thread(target=self._commit_loop, name="outbox-commit", daemon=True)
+            self.committer.start()
+        self.commit_event.set()
+        for destination in self.handlers:
+            if destination not in self.workers:
+                self.wake_events[destination] = asyncio.Event()
+                self.workers[destination] = asyncio.create_task(self._worker(destination))
+
+    async def stop(self) -> None:
+        """Stop the workers, commit anything still pending and close the database."""
+        if self.closed:
+            return
+        self.closed = True
+        for event in self.wake_events.values():
+            event.set()
+        # Let in-flight deliveries settle; anything cut off is replayed next start
+        if self.workers:
+            _, unfinished = await asyncio.wait(self.workers.values(), timeout=self.shutdown_timeout)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.workers = {}
+        self.commit_event.set()
+        if self.committer is not None:
+            await asyncio.to_thread(self.committer.join)
+        self.flush()
+        with self.db_lock:
+            self.conn.close()
+
+    def _claim(self, destination: str, limit: int) -> List[OutboxEntry]:
+        """Fetch the oldest due entries for a destination."""
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT id, idempotency_key, payload, attempts FROM outbox "
+                "WHERE destination = ? AND status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY id LIMIT ?",
+                (destination, time.time(), limit)
+            ).fetchall()
+        return [
+            OutboxEntry(row[0], destination, row[1], json.loads(row[2]), row[3])
+            for row in rows
+        ]
+
+    def _settle(self, delivered: List[OutboxEntry], failed: List[tuple], deferred: List[tuple] = ()) -> None:
+        """Mark delivered entries done, reschedule deferred ones and retry or bury failed ones."""
+        now = time.time()
+        with self.db_lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'done', updated_at = ? WHERE id = ?",
+                [(now, entry.id) for entry in delivered]
+            )
+            self.conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ?, updated_at = ?, last_error = ? WHERE id = ?",
+                [(now + retry_after, now, reason[:1000], entry.id) for entry, retry_after, reason in deferred]
+            )
+            for entry, error in failed:
+                attempts = entry.attempts + 1
+                if attempts >= self.max_attempts:
+                    status, next_attempt = 'dead', now
+                else:
+                    delay = min(self.max_backoff, self.base_backoff * (2 ** (attempts - 1)))
+                    status, next_attempt = 'pending', now + delay * random.uniform(1.0, 1.2)
+                self.conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, "
+                    "updated_at = ?, last_error = ? WHERE id = ?",
+                    (status, attempts, next_attempt, now, error[:1000], entry.id)
+                )
+            self.conn.execute("COMMIT")
+
+    async def _call(self, fn: Callable, *args, **kwargs):
+        """Await async handlers, run sync ones in a worker thread."""
+        if inspect.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def _deliver_batch(self, handler: _Handler, entries: List[OutboxEntry]):
+        """
+        Deliver a batch, bisecting it when the handler raises a row error.
+
+        One bad row (a constraint or type violation) would otherwise fail
+        every row batched with it on every retry; splitting isolates it so
+        only rows that fail on their own count an attempt. Errors of the
+        destination itself fail the batch whole instead of costing up to
+        2n - 1 calls per retry.
+        """
+        try:
+            payloads = [entry.payload for entry in entries]
+            if handler.keyed:
+                await self._call(handler.fn, payloads, [entry.idempotency_key for entry in entries])
+            else:
+                await self._call(handler.fn, payloads)
+            return entries, [], []
+        except Deferred as e:
+            return [], [], [(entry, e.retry_after, str(e)) for entry in entries]
+        except Exception as e:
+            if len(entries) == 1 or handler.split_on is None or not handler.split_on(e):
+                return [], [(entry, str(e)) for entry in entries], []
+        middle = len(entries) // 2
+        delivered, failed, deferred = await self._deliver_batch(handler, entries[:middle])
+        more = await self._deliver_batch(handler, entries[middle:])
+        return delivered + more[0], failed + more[1], deferred + more[2]
+
+    async def _deliver(self, handler: _Handler, entries: List[OutboxEntry]):
+        """Run the handler over claimed entries; returns (delivered, failed, deferred)."""
+        if handler.batch:
+            return await self._deliver_batch(handler, entries)
+
+        delivered, failed, deferred = [], [], []
+        for entry in entries:
+            try:
+                if await self._call(handler.fn, **entry.payload):
+                    delivered.append(entry)
+                else:
+                    failed.append((entry, "handler reported failure"))
+            except Deferred as e:
+                deferred.append((entry, e.retry_after, str(e)))
+            except Exception as e:
+                failed.append((entry, str(e)))
+        return delivered, failed, deferred
+
+    async def _worker(self, destination: str) -> None:
+        """Drain one destination until stopped."""
+        handler = self.handlers[destination]
+        wake = self.wake_events[destination]
+        while not self.closed:
+            try:
+                entries = await asyncio.to_thread(self._claim, destination, handler.batch_size)
+                if not entries:
+                    if self.closed:
+                        break
+                    wake.clear()
+                    try:
+                        await asyncio.wait_for(wake.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if handler.linger and len(entries) < handler.batch_size and not self.closed:
+                    await asyncio.sleep(handler.linger)
+                    entries = await asyncio.to_thread(self._claim, destination, handler.batch_size)
+
+                delivered, failed, deferred = await self._deliver(handler, entries)
+                await asyncio.to_thread(self._settle, delivered, failed, deferred)
+                if failed:
+                    print(f"Outbox delivery to {destination} failed for {len(failed)} entries: {failed[0][1]}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in outbox worker for {destination}: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Entry counts per destination and status."""
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT destination, status, COUNT(*) FROM outbox GROUP BY destination, status"
+            ).fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for destination, status, count in rows:
+            counts.setdefault(destination, {})[status] = count
+        return counts
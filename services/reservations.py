@@ -0,0 +1,341 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import asyncio
+import threading
+import time
+import uuid
+from googleapiclient.errors import HttpError
+from config.config import (
+    TIMEZONE,
+    RESERVATION_HOLD_SECONDS,
+    RESERVATION_BATCH_SIZE,
+    RESERVATION_CONFIRM_LINGER,
+    RESERVATION_SWEEP_INTERVAL
+)
+from services.slot_engine import to_epoch
+
+HELD = "held"
+CONFIRMING = "confirming"
+BOOKED = "booked"
+
+class Hold:
+    __slots__ = ("hold_id", "calendar_id", "start_ts", "end_ts", "user_id", "expires_at", "status")
+
+    def __init__(self, hold_id: str, calendar_id: str, start_ts: float, end_ts: float,
+                 user_id: Optional[str], expires_at: float):
+        self.hold_id = hold_id  # Also used as the calendar event ID, so a retried insert is a no-op
+        self.calendar_id = calendar_id
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.user_id = user_id
+        self.expires_at = expires_at  # time.monotonic() deadline while HELD
+        self.status = HELD
+
+    def overlaps(self, start_ts: float, end_ts: float) -> bool:
+        return self.start_ts < end_ts and start_ts < self.end_ts
+
+class _Confirmation:
+    __slots__ = ("hold", "body", "future")
+
+    def __init__(self, hold: Hold, body: Dict, future: asyncio.Future):
+        self.hold = hold
+        self.body = body
+        self.future = future
+
+class ReservationLedger:
+    def __init__(self, calendar_service, hold_seconds: float = RESERVATION_HOLD_SECONDS,
+                 batch_size: int = RESERVATION_BATCH_SIZE,
+                 confirm_linger: float = RESERVATION_CONFIRM_LINGER,
+                 sweep_interval: float = RESERVATION_SWEEP_INTERVAL):
+        """
+        In-process ledger of short-lived holds on calendar slots.
+
+        `hold` claims a slot atomically: it fails if the slot overlaps another
+        live hold, a booking in flight, or a busy interval in the calendar's
+        local event cache, so no calendar read is needed per attempt. Only a
+        calendar the cache has not synced yet costs a freebusy query, which
+        runs in a worker thread.
+        `confirm` turns a hold into an event; confirmations arriving within
+        `confirm_linger` seconds are inserted with one batch HTTP request.
+        `book` does both; GoogleCalendarService.create_event goes through it
+        when the ledger is attached.
+        Expired holds are released by a background sweep.
+
+        Args:
+            calendar_service: GoogleCalendarService (its event_cache is used when set)
+            hold_seconds: How long an unconfirmed hold blocks the slot
+            batch_size: Inserts per batch request (the Calendar API allows 50)
+            confirm_linger: Seconds a confirmation waits for others to share its batch
+            sweep_interval: Seconds between expired-hold sweeps
+        """
+        self.calendar_service = calendar_service
+        self.hold_seconds = hold_seconds
+        self.batch_size = min(batch_size, 50)
+        self.confirm_linger = confirm_linger
+        self.sweep_interval = sweep_interval
+
+        self.holds: Dict[str, Hold] = {}
+        self.by_calendar: Dict[str, Dict[str, Hold]] = {}
+        self.lock = threading.Lock()
+        self.pending: List[_Confirmation] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"holds": 0, "conflicts": 0, "expired": 0, "booked": 0, "failed": 0, "batches": 0}
+
+    async def _conflicts_with_calendar(self, calendar_id: str, start: datetime, end: datetime) -> bool:
+        """Check the local event cache; without one the caller's offer is trusted."""
+        cache = getattr(self.calendar_service, 'event_cache', None)
+        if cache is None:
+            return False
+        busy = cache.busy_intervals(calendar_id, start, end)
+        if busy is None:
+            # Not synced yet: ask the API for this slot only, off the event loop
+            try:
+                busy = (await asyncio.to_thread(
+                    self.calendar_service.get_busy_times, start, end, [calendar_id]
+                )).get(calendar_id, [])
+            except Exception as e:
+                print(f"Error checking calendar {calendar_id} for a hold: {str(e)}")
+                return True
+        return bool(busy)
+
+    async def hold(self, calendar_id: str, start: datetime, end: datetime,
+                   user_id: Optional[str] = None) -> Optional[Hold]:
+        """
+        Claim a slot for `hold_seconds`.
+
+        A user asking again for the slot they already hold gets the same hold
+        with a fresh deadline.
+
+        Returns:
+            The Hold, or None if the slot is taken
+        """
+        start_ts, end_ts = to_epoch(start), to_epoch(end)
+        if await self._conflicts_with_calendar(calendar_id, start, end):
+            self.stats["conflicts"] += 1
+            return None
+        now = time.monotonic()
+        with self.lock:
+            for other in self.by_calendar.get(calendar_id, {}).values():
+                if not other.overlaps(start_ts, end_ts) or (other.status == HELD and other.expires_at <= now):
+                    continue
+                if (other.status == HELD and user_id is not None and other.user_id == user_id
+                        and (other.start_ts, other.end_ts) == (start_ts, end_ts)):
+                    other.expires_at = now + self.hold_seconds
+                    return other
+                self.stats["conflicts"] += 1
+                return None
+            hold = Hold(uuid.uuid4().hex, calendar_id, start_ts, end_ts, user_id, now + self.hold_seconds)
+            self.holds[hold.hold_id] = hold
+            self.by_calendar.setdefault(calendar_id, {})[hold.hold_id] = hold
+            self.stats["holds"] += 1
+            return hold
+
+    def _drop(self, hold: Hold) -> None:
+        """Remove a hold; caller holds the lock."""
+        self.holds.pop(hold.hold_id, None)
+        calendar_holds = self.by_calendar.get(hold.calendar_id)
+        if calendar_holds is not None:
+            calendar_holds.pop(hold.hold_id, None)
+            if not calendar_holds:
+                del self.by_calendar[hold.calendar_id]
+
+    def release(self, hold_id: str) -> bool:
+        """Give up an unconfirmed hold; False if it is unknown or already being booked."""
+        with self.lock:
+            hold = self.holds.get(hold_id)
+            if hold is None or hold.status != HELD:
+                return False
+            self._drop(hold)
+            return True
+
+    def release_expired(self) -> int:
+        """Drop holds past their deadline and bookings whose slot has ended."""
+        now, wall = time.monotonic(), time.time()
+        with self.lock:
+            expired = [
+                hold for hold in self.holds.values()
+                if (hold.status == HELD and hold.expires_at <= now) or (hold.status == BOOKED and hold.end_ts <= wall)
+            ]
+            for hold in expired:
+                self._drop(hold)
+        self.stats["expired"] += sum(hold.status == HELD for hold in expired)
+        return len(expired)
+
+    def held_intervals(self, calendar_id: str) -> List[Tuple[float, float]]:
+        """Epoch intervals blocked by live holds and bookings on a calendar."""
+        now = time.monotonic()
+        with self.lock:
+            return sorted(
+                (hold.start_ts, hold.end_ts) for hold in self.by_calendar.get(calendar_id, {}).values()
+                if hold.status != HELD or hold.expires_at > now
+            )
+
+    def is_held(self, calendar_id: str, start_ts: float, end_ts: float) -> bool:
+        return any(start < end_ts and start_ts < end for start, end in self.held_intervals(calendar_id))
+
+    async def confirm(self, hold_id: str, summary: str, description: str = None,
+                      attendees: list = None) -> Optional[Dict]:
+        """
+        Book a held slot as a calendar event.
+
+        Returns:
+            The created event, or None if the hold had expired or the insert failed
+        """
+        with self.lock:
+            hold = self.holds.get(hold_id)
+            if hold is None or hold.status != HELD or hold.expires_at <= time.monotonic():
+                return None
+            hold.status = CONFIRMING
+        tz = ZoneInfo(TIMEZONE)
+        body = {
+            'id': hold.hold_id,
+            'summary': summary,
+            'start': {'dateTime': datetime.fromtimestamp(hold.start_ts, tz).isoformat(), 'timeZone': TIMEZONE},
+            'end': {'dateTime': datetime.fromtimestamp(hold.end_ts, tz).isoformat(), 'timeZone': TIMEZONE},
+        }
+        if description:
+            body['description'] = description
+        if attendees:
+            body['attendees'] = [{'email': email} for email in attendees]
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(_Confirmation(hold, body, future))
+        if self.wakeup is not None:
+            self.wakeup.set()
+        else:
+            await self._flush()
+        return await future
+
+    async def book(self, calendar_id: str, start: datetime, end: datetime, summary: str,
+                   description: str = None, attendees: list = None,
+                   user_id: Optional[str] = None) -> Optional[Dict]:
+        """
+        Hold and confirm a slot in one step.
+
+        Returns:
+            The created event, or None if the slot is taken or the insert failed
+        """
+        hold = await self.hold(calendar_id, start, end, user_id)
+        if hold is None:
+            return None
+        return await self.confirm(hold.hold_id, summary, description, attendees)
+
+    def book_from_thread(self, calendar_id: str, start: datetime, end: datetime, summary: str,
+                         description: str = None, attendees: list = None,
+                         user_id: Optional[str] = None) -> Optional[Dict]:
+        """`book` for blocking callers in a worker thread; runs on the ledger's event loop."""
+        if self.loop is None or self.loop.is_closed():
+            raise RuntimeError("reservation ledger is not running")
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        if current is self.loop:
+            raise RuntimeError("book_from_thread would block the ledger's event loop; await book() instead")
+        future = asyncio.run_coroutine_threadsafe(
+            self.book(calendar_id, start, end, summary, description, attendees, user_id), self.loop
+        )
+        return future.result()
+
+    def _insert_batch(self, batch: List[_Confirmation]) -> List[Tuple[Optional[Dict], Optional[Exception]]]:
+        """Insert events with one batch HTTP request; results are in batch order."""
+        results: Dict[str, Tuple[Optional[Dict], Optional[Exception]]] = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+
+        service = self.calendar_service.service
+        request = service.new_batch_http_request(callback=callback)
+        for confirmation in batch:
+            request.add(
+                service.events().insert(
+                    calendarId=confirmation.hold.calendar_id,
+                    body=confirmation.body,
+                    sendUpdates='all'
+                ),
+                request_id=confirmation.hold.hold_id
+            )
+        request.execute()
+        return [results.get(confirmation.hold.hold_id, (None, None)) for confirmation in batch]
+
+    def _settle(self, confirmation: _Confirmation, event: Optional[Dict],
+                error: Optional[Exception]) -> Optional[Dict]:
+        """Resolve one confirmation on the event loop; returns the booked event, if any."""
+        hold = confirmation.hold
+        # 409: an earlier attempt already created the event with this ID
+        if event is None and isinstance(error, HttpError) and getattr(error.resp, 'status', None) == 409:
+            event = dict(confirmation.body, status='confirmed')
+            error = None
+        with self.lock:
+            if event is not None:
+                hold.status = BOOKED
+            else:
+                self._drop(hold)
+        if event is not None:
+            self.stats["booked"] += 1
+        else:
+            self.stats["failed"] += 1
+            print(f"Error confirming reservation {hold.hold_id}: {str(error)}")
+        if not confirmation.future.done():
+            confirmation.future.set_result(event)
+        return event
+
+    def _cache_bookings(self, booked: List[Tuple[str, Dict]]) -> None:
+        """Add new events to the local event cache; takes the cache's lock, so runs off the loop."""
+        cache = getattr(self.calendar_service, 'event_cache', None)
+        if cache is None:
+            return
+        for calendar_id, event in booked:
+            cache.apply_event(calendar_id, event, TIMEZONE)
+
+    async def _flush(self) -> None:
+        """Send everything pending, `batch_size` inserts per request."""
+        while self.pending:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            self.stats["batches"] += 1
+            try:
+                results = await asyncio.to_thread(self._insert_batch, batch)
+            except Exception as e:
+                results = [(None, e)] * len(batch)
+            booked = []
+            for confirmation, (event, error) in zip(batch, results):
+                event = self._settle(confirmation, event, error)
+                if event is not None:
+                    booked.append((confirmation.hold.calendar_id, event))
+            # Booked holds keep blocking their slots in the ledger until the cache has the event
+            if booked:
+                await asyncio.to_thread(self._cache_bookings, booked)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.sweep_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self.wakeup.is_set():
+                self.wakeup.clear()
+                # Let concurrent confirmations join the same batch
+                await asyncio.sleep(self.confirm_linger)
+                # Shielded so stop() never abandons a batch already sent
+                await asyncio.shield(self._flush())
+            self.release_expired()
+
+    def start(self) -> None:
+        """Start batching confirmations and sweeping holds on the running event loop."""
+        if self.task is None or self.task.done():
+            self.loop = asyncio.get_running_loop()
+            self.wakeup = asyncio.Event()
+            self.task = self.loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Send confirmations still queued, then stop."""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+            self.wakeup = None
+        await self._flush()
+        self.loop = None
@@ -0,0 +1,111 @@
+from typing import Dict, List, Optional, Set, Union
+import re
+
+_TOKEN = re.compile(r"\w+")
+
+class SheetSnapshot:
+    def __init__(self, sheet_name: str, values: List[list], modified_time: Optional[str] = None):
+        """
+        Read-only, indexed copy of one sheet.
+
+        Cells are stored column by column as lowercase strings, and every
+        lowercase word maps to the rows that contain it. Searches narrow the
+        candidate rows with the token index and only then check the exact
+        substring, so results match a full case-insensitive scan.
+        """
+        self.sheet_name = sheet_name
+        self.modified_time = modified_time
+        self.rows = values  # As returned by the API, for results
+        self.header = [str(cell).strip().lower() for cell in values[0]] if values else []
+
+        width = max((len(row) for row in values), default=0)
+        self.columns: List[List[str]] = [
+            [str(row[i]).lower() if i < len(row) else '' for row in values]
+            for i in range(width)
+        ]
+        # Only cells the API returned count, as in the original row-by-row scan
+        self.widths = [len(row) for row in values]
+
+        self.token_rows: Dict[str, Set[int]] = {}
+        for column in self.columns:
+            for row_index, cell in enumerate(column):
+                for token in _TOKEN.findall(cell):
+                    self.token_rows.setdefault(token, set()).add(row_index)
+
+        self.column_values: Dict[int, Dict[str, Set[int]]] = {}
+        self.max_cached_fragments = 256
+        self._fragment_cache: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _rows_with_fragment(self, fragment: str) -> Set[int]:
+        """Rows holding a word that contains `fragment` (cached per fragment)."""
+        cached = self._fragment_cache.get(fragment)
+        if cached is not None:
+            return cached
+        rows = set(self.token_rows.get(fragment, ()))
+        for token, token_rows in self.token_rows.items():
+            if fragment in token and token != fragment:
+                rows |= token_rows
+        if len(self._fragment_cache) >= self.max_cached_fragments:
+            self._fragment_cache.clear()
+        self._fragment_cache[fragment] = rows
+        return rows
+
+    def _column_index(self, column: Union[str, int]) -> Optional[int]:
+        """Resolve a header name (case-insensitive) or zero-based index."""
+        if isinstance(column, int):
+            return column if 0 <= column < len(self.columns) else None
+        name = str(column).strip().lower()
+        return self.header.index(name) if name in self.header else None
+
+    def _rows_with_value(self, column: int, value: str) -> Set[int]:
+        """Rows whose cell in `column` equals `value` (case-insensitive, trimmed)."""
+        values = self.column_values.get(column)
+        if values is None:
+            values = {}
+            for row_index, cell in enumerate(self.columns[column]):
+                if column < self.widths[row_index]:
+                    values.setdefault(cell.strip(), set()).add(row_index)
+            self.column_values[column] = values
+        return values.get(str(value).strip().lower(), set())
+
+    def search(self, search_term: str, filters: Optional[Dict[Union[str, int], str]] = None,
+               limit: Optional[int] = None) -> List[list]:
+        """
+        Rows with a cell containing `search_term`, case-insensitively.
+
+        Args:
+            search_term: Substring to look for ('' matches every non-empty row)
+            filters: Column (header name or index) -> exact cell value
+            limit: Maximum number of rows to return
+
+        Returns:
+            Matching rows in sheet order
+        """
+        term = str(search_term).lower()
+        candidates: Optional[Set[int]] = None
+
+        for fragment in _TOKEN.findall(term):
+            rows = self._rows_with_fragment(fragment)
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return []
+
+        for column, value in (filters or {}).items():
+            index = self._column_index(column)
+            rows = self._rows_with_value(index, value) if index is not None else set()
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return []
+
+        ordered = sorted(candidates) if candidates is not None else range(len(self.rows))
+        matches = []
+        for row_index in ordered:
+            width = self.widths[row_index]
+            if any(term in self.columns[i][row_index] for i in range(width)):
+                matches.append(self.rows[row_index])
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
@@ -0,0 +1,252 @@
+"""
+Interval arithmetic and slot search across many calendars and days.
+
+Times are handled internally as epoch seconds. Busy intervals are sorted and
+merged once (O(n log n)), and the free time of each tutor falls out of a
+single sweep over its working windows and busy intervals, so the cost no
+longer grows with slots x events.
+"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+import heapq
+import itertools
+import math
+
+Interval = Tuple[float, float]  # (start, end) in epoch seconds
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Sort intervals and merge overlapping or touching ones."""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def subtract_intervals(windows: List[Interval], busy: List[Interval]) -> List[Interval]:
+    """
+    Free parts of sorted, disjoint windows once merged busy intervals are removed.
+
+    One forward sweep: a busy interval is revisited only when it spans
+    more than one window.
+    """
+    free: List[Interval] = []
+    first = 0
+    for window_start, window_end in windows:
+        cursor = window_start
+        while first < len(busy) and busy[first][1] <= cursor:
+            first += 1
+        i = first
+        while i < len(busy) and busy[i][0] < window_end:
+            if busy[i][0] > cursor:
+                free.append((cursor, busy[i][0]))
+            cursor = max(cursor, busy[i][1])
+            i += 1
+        if cursor < window_end:
+            free.append((cursor, window_end))
+    return free
+
+def cut_slots(free: Iterable[Interval], duration: float, step: Optional[float] = None,
+              origin: float = 0.0) -> Iterator[Interval]:
+    """
+    Candidate slots of `duration` seconds inside free intervals.
+
+    With `step`, slot starts lie on a grid of `step` seconds counted from
+    `origin` (e.g. local midnight), so offers start on the quarter hour.
+    Without it, slots run back to back from the start of each free interval.
+    """
+    for start, end in free:
+        if step:
+            start = origin + math.ceil((start - origin) / step) * step
+        increment = step or duration
+        while start + duration <= end:
+            yield start, start + duration
+            start += increment
+
+def to_epoch(moment: datetime) -> float:
+    """Epoch seconds of an aware datetime (naive datetimes are taken as UTC)."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt_timezone.utc)
+    return moment.timestamp()
+
+class TutorSchedule:
+    __slots__ = ("tutor_id", "calendar_id", "tz", "working_hours", "date_hours",
+                 "buffer_before", "buffer_after")
+
+    def __init__(self, tutor_id: str, calendar_id: str,
+                 working_hours: Dict[int, List[Tuple[time, time]]], timezone: str = 'UTC',
+                 date_hours: Optional[Dict[date, List[Tuple[time, time]]]] = None,
+                 buffer_before_minutes: int = 0, buffer_after_minutes: int = 0):
+        """
+        A tutor's calendar and working hours.
+
+        Args:
+            tutor_id: Identifier returned with each slot
+            calendar_id: Calendar whose busy times block the tutor
+            working_hours: Weekday (0 = Monday) -> local (start, end) windows;
+                an end at or before the start runs past midnight
+            timezone: IANA zone the working hours are expressed in
+            date_hours: Per-date windows replacing the weekday hours
+                (an empty list marks a day off)
+            buffer_before_minutes: Free time required before each busy event
+            buffer_after_minutes: Free time required after each busy event
+        """
+        self.tutor_id = tutor_id
+        self.calendar_id = calendar_id
+        self.tz = ZoneInfo(timezone)
+        self.working_hours = working_hours
+        self.date_hours = date_hours or {}
+        self.buffer_before = buffer_before_minutes * 60
+        self.buffer_after = buffer_after_minutes * 60
+
+    def windows(self, start: datetime, end: datetime) -> List[Interval]:
+        """Working windows between start and end as merged epoch intervals."""
+        range_start, range_end = to_epoch(start), to_epoch(end)
+        day = datetime.fromtimestamp(range_start, self.tz).date() - timedelta(days=1)
+        last_day = datetime.fromtimestamp(range_end, self.tz).date()
+        windows = []
+        while day <= last_day:
+            hours = self.date_hours.get(day, self.working_hours.get(day.weekday(), []))
+            for open_time, close_time in hours:
+                window_start = datetime.combine(day, open_time, tzinfo=self.tz)
+                window_end = datetime.combine(day, close_time, tzinfo=self.tz)
+                if window_end <= window_start:
+                    window_end += timedelta(days=1)
+                clipped = (max(window_start.timestamp(), range_start), min(window_end.timestamp(), range_end))
+                if clipped[0] < clipped[1]:
+                    windows.append(clipped)
+            day += timedelta(days=1)
+        return merge_intervals(windows)
+
+    def local_midnight(self, moment: float) -> float:
+        """Epoch of local midnight on the day containing `moment`."""
+        local = datetime.fromtimestamp(moment, self.tz)
+        return datetime.combine(local.date(), time.min, tzinfo=self.tz).timestamp()
+
+class Slot:
+    __slots__ = ("tutor_id", "start_ts", "end_ts", "score", "tz")
+
+    def __init__(self, tutor_id: str, start_ts: float, end_ts: float, score: float, tz: ZoneInfo):
+        self.tutor_id = tutor_id
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.score = score
+        self.tz = tz
+
+    # Converted on access: callers usually format only the few slots they show
+    @property
+    def start(self) -> datetime:
+        return datetime.fromtimestamp(self.start_ts, self.tz)
+
+    @property
+    def end(self) -> datetime:
+        return datetime.fromtimestamp(self.end_ts, self.tz)
+
+    def to_dict(self) -> Dict:
+        return {'tutor': self.tutor_id, 'start': self.start.isoformat(), 'end': self.end.isoformat()}
+
+def preference_rank(preferred_hours: Optional[Tuple[time, time]] = None,
+                    preferred_tutors: Optional[List[str]] = None,
+                    timezone: str = 'UTC', off_hours_penalty: float = 2 * 86400,
+                    other_tutor_penalty: float = 86400) -> Callable[[str, float], float]:
+    """
+    Ranking function for find_slots: earlier is better, with penalties.
+
+    A slot outside `preferred_hours` (local to `timezone`) ranks as if it were
+    `off_hours_penalty` seconds later; a tutor outside `preferred_tutors` as
+    if `other_tutor_penalty` seconds later.
+    """
+    tz = ZoneInfo(timezone)
+    tutors = set(preferred_tutors or [])
+
+    def rank(tutor_id: str, start: float) -> float:
+        score = start
+        if preferred_hours:
+            local = datetime.fromtimestamp(start, tz).time()
+            if not preferred_hours[0] <= local < preferred_hours[1]:
+                score += off_hours_penalty
+        if tutors and tutor_id not in tutors:
+            score += other_tutor_penalty
+        return score
+
+    return rank
+
+class SlotEngine:
+    def __init__(self, calendar_service=None):
+        """Find open slots; busy times come from calendar_service.get_busy_times."""
+        self.calendar_service = calendar_service
+
+    def fetch_busy(self, tutors: List[TutorSchedule], start: datetime, end: datetime) -> Dict[str, List[Interval]]:
+        """Busy intervals for every tutor calendar from one batched freebusy query."""
+        calendar_ids = sorted({tutor.calendar_id for tutor in tutors})
+        busy = self.calendar_service.get_busy_times(start, end, calendar_ids)
+        return {
+            calendar_id: [(to_epoch(busy_start), to_epoch(busy_end)) for busy_start, busy_end in periods]
+            for calendar_id, periods in busy.items()
+        }
+
+    def free_intervals(self, tutor: TutorSchedule, start: datetime, end: datetime,
+                       busy: List[Interval]) -> List[Interval]:
+        """A tutor's free time: working windows minus buffered busy intervals."""
+        blocked = merge_intervals(
+            (busy_start - tutor.buffer_before, busy_end + tutor.buffer_after)
+            for busy_start, busy_end in busy
+        )
+        return subtract_intervals(tutor.windows(start, end), blocked)
+
+    def find_slots(self, tutors: List[TutorSchedule], start: datetime, end: datetime,
+                   duration_minutes: int = 60, step_minutes: Optional[int] = 15,
+                   k: Optional[int] = 10, rank: Optional[Callable[[str, float], float]] = None,
+                   busy: Optional[Dict[str, List[Interval]]] = None,
+                   not_before: Optional[datetime] = None) -> List[Slot]:
+        """
+        Best open slots across tutors and days.
+
+        Args:
+            tutors: Schedules to search
+            start, end: Search range (timezone-aware)
+            duration_minutes: Slot length
+            step_minutes: Grid for slot starts in each tutor's local time;
+                None packs slots back to back from the start of free time
+            k: Number of slots to return (None = all)
+            rank: f(tutor_id, start_epoch) -> score, lower is better
+                (defaults to earliest first)
+            busy: Calendar ID -> busy epoch intervals; fetched when omitted
+            not_before: Earliest allowed slot start (e.g. now plus notice)
+
+        Returns:
+            Slots ordered by score
+        """
+        if busy is None:
+            busy = self.fetch_busy(tutors, start, end) if tutors else {}
+        if not_before is not None and not_before > start:
+            start = not_before
+        duration = duration_minutes * 60
+        step = step_minutes * 60 if step_minutes else None
+        score = rank or (lambda tutor_id, slot_start: slot_start)
+
+        def candidates(tutor: TutorSchedule) -> Iterator[Tuple[float, float, str, float, TutorSchedule]]:
+            free = self.free_intervals(tutor, start, end, busy.get(tutor.calendar_id, []))
+            for interval in free:
+                origin = tutor.local_midnight(interval[0]) if step else 0.0
+                for slot_start, slot_end in cut_slots([interval], duration, step, origin):
+                    yield score(tutor.tutor_id, slot_start), slot_start, tutor.tutor_id, slot_end, tutor
+
+        key = lambda item: item[:3]
+        if rank is None:
+            # Each tutor's candidates already come out earliest first, so a lazy
+            # k-way merge stops after k slots instead of scoring every candidate
+            merged = heapq.merge(*(candidates(tutor) for tutor in tutors), key=key)
+            ranked = list(merged) if k is None else list(itertools.islice(merged, k))
+        else:
+            every = itertools.chain.from_iterable(candidates(tutor) for tutor in tutors)
+            ranked = sorted(every, key=key) if k is None else heapq.nsmallest(k, every, key=key)
+        return [
+            Slot(tutor_id, slot_start, slot_end, slot_score, tutor.tz)
+            for slot_score, slot_start, tutor_id, slot_end, tutor in ranked
+        ]
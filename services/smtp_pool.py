@@ -0,0 +1,243 @@
+from typing import List, Optional, Tuple
+from email.message import Message
+import asyncio
+import logging
+import queue
+import smtplib
+import time
+
+logger = logging.getLogger(__name__)
+
+class _PooledConnection:
+    __slots__ = ("smtp", "last_used", "last_checked")
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+
+class SMTPConnectionPool:
+    def __init__(self, host: str, port: int, username: Optional[str], password: Optional[str],
+                 use_ssl: bool = True, size: int = 2, timeout: float = 30.0,
+                 idle_timeout: float = 240.0, health_check_interval: float = 30.0):
+        """
+        Persistent, logged-in SMTP connections shared between senders.
+
+        A connection is opened and authenticated once and reused for every
+        message. Before reuse it is checked with NOOP if it sat idle longer
+        than `health_check_interval`, and replaced if it sat idle longer than
+        `idle_timeout` (servers drop idle sessions) or the check fails.
+
+        Args:
+            host, port: SMTP server
+            username, password: Login; skipped when username is empty
+            use_ssl: Implicit TLS (SMTP_SSL); otherwise plain SMTP with STARTTLS if offered
+            size: Maximum open connections
+            timeout: Socket timeout in seconds
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.idle: "queue.LifoQueue[Optional[_PooledConnection]]" = queue.LifoQueue()
+        # Each token is the right to hold one connection
+        for _ in range(size):
+            self.idle.put(None)
+        self.stats = {"connects": 0, "reused": 0, "health_failures": 0, "sent": 0}
+
+    def _connect(self) -> _PooledConnection:
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            smtp.ehlo()
+            if smtp.has_extn('starttls'):
+                smtp.starttls()
+                smtp.ehlo()
+        if self.username:
+            smtp.login(self.username, self.password)
+        self.stats["connects"] += 1
+        return _PooledConnection(smtp)
+
+    @staticmethod
+    def _close(connection: _PooledConnection) -> None:
+        try:
+            connection.smtp.quit()
+        except Exception:
+            connection.smtp.close()
+
+    def _healthy(self, connection: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if now - connection.last_used > self.idle_timeout:
+            return False
+        if now - connection.last_checked < self.health_check_interval:
+            return True
+        try:
+            healthy = connection.smtp.noop()[0] == 250
+        except OSError:  # Includes SMTPException
+            healthy = False
+        connection.last_checked = now
+        if not healthy:
+            self.stats["health_failures"] += 1
+        return healthy
+
+    def acquire(self) -> _PooledConnection:
+        """Take a healthy connection, opening one if needed; blocks while all are in use."""
+        connection = self.idle.get()
+        try:
+            if connection is not None and self._healthy(connection):
+                self.stats["reused"] += 1
+                return connection
+            if connection is not None:
+                self._close(connection)
+            return self._connect()
+        except Exception:
+            self.idle.put(None)
+            raise
+
+    def release(self, connection: _PooledConnection, broken: bool = False) -> None:
+        """Return a connection; a broken one is closed and its place freed."""
+        if broken:
+            self._close(connection)
+            self.idle.put(None)
+            return
+        connection.last_used = time.monotonic()
+        self.idle.put(connection)
+
+    def send_messages(self, messages: List[Message]) -> List[Tuple[bool, Optional[str]]]:
+        """
+        Send messages back to back over one connection.
+
+        A message that fails on a dropped connection is retried once on a
+        fresh one. Returns (sent, error) per message, in order.
+        """
+        results: List[Tuple[bool, Optional[str]]] = []
+        connection = self.acquire()
+        broken = False
+        try:
+            for message in messages:
+                try:
+                    connection.smtp.send_message(message)
+                    connection.last_used = time.monotonic()
+                    self.stats["sent"] += 1
+                    results.append((True, None))
+                except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                    # Rejected by the server (e.g. bad recipient); the session is still usable
+                    results.append((False, str(e)))
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    # Connection dropped mid-session: reconnect and retry this message once
+                    self._close(connection)
+                    connection = self._connect()
+                    try:
+                        connection.smtp.send_message(message)
+                        self.stats["sent"] += 1
+                        results.append((True, None))
+                    except Exception as e:
+                        results.append((False, str(e)))
+        except Exception as e:
+            broken = True
+            results.extend((False, str(e)) for _ in messages[len(results):])
+        finally:
+            self.release(connection, broken=broken)
+        return results
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        for _ in range(self.size):
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if connection is not None:
+                self._close(connection)
+            self.idle.put(None)
+
+class AsyncMailer:
+    def __init__(self, pool: SMTPConnectionPool, queue_size: int = 100, batch_size: int = 20):
+        """
+        Asynchronous front end for an SMTPConnectionPool.
+
+        `send` puts the message on a bounded queue (waiting when it is full)
+        and resolves once the message is delivered. One worker per pooled
+        connection drains the queue in a thread, sending every message
+        already waiting (up to `batch_size`) over its connection in one go,
+        so the event loop never blocks on SMTP.
+        """
+        self.pool = pool
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+
+    async def send(self, message: Message) -> bool:
+        """Deliver a message; True once the server accepted it."""
+        if self.queue is None:
+            # Not started: send directly, still off the event loop
+            sent, error = (await asyncio.to_thread(self.pool.send_messages, [message]))[0]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((message, future))
+            sent, error = await future
+        if not sent:
+            logger.error(f"Error sending email: {error}")
+        return sent
+
+    async def _worker(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                results = await asyncio.to_thread(self.pool.send_messages, [message for message, _ in batch])
+            except asyncio.CancelledError:
+                # Stopped mid-send: the outcome is unknown to the senders waiting on it
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("mailer stopped"))
+                raise
+            except Exception as e:
+                results = [(False, str(e))] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            for _ in batch:
+                self.queue.task_done()
+
+    def start(self) -> None:
+        """Start one sending worker per pooled connection on the running loop."""
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
+        self.workers = [loop.create_task(self._worker()) for _ in range(self.pool.size)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Wait for queued messages (up to `timeout`), then close the connections.
+
+        Senders still waiting on messages that were not delivered get a
+        RuntimeError instead of waiting forever.
+        """
+        if self.queue is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Email queue not drained; {self.queue.qsize()} messages dropped")
+            for worker in self.workers:
+                worker.cancel()
+            await asyncio.gather(*self.workers, return_exceptions=True)
+            # Draining frees slots for senders blocked on a full queue, so repeat until they are done too
+            while not self.queue.empty():
+                while not self.queue.empty():
+                    _, future = self.queue.get_nowait()
+                    if not future.done():
+                        future.set_exception(RuntimeError("mailer stopped"))
+                await asyncio.sleep(0)
+            self.queue = None
+            self.workers = []
+        await asyncio.to_thread(self.pool.close)
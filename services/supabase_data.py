@@ -0,0 +1,147 @@
+from typing import Dict, Optional
+from collections import deque
+import time
+
+import httpx
+from postgrest import AsyncPostgrestClient
+from config.config import (
+    SUPABASE_TIMEOUT,
+    SUPABASE_CONNECT_TIMEOUT,
+    SUPABASE_MAX_CONNECTIONS,
+    SUPABASE_MAX_KEEPALIVE_CONNECTIONS,
+    SUPABASE_SLOW_QUERY_MS
+)
+from utils.tracing import span
+
+class _PooledPostgrestClient(AsyncPostgrestClient):
+    """AsyncPostgrestClient whose httpx session uses explicit pool limits."""
+
+    def __init__(self, base_url: str, limits: httpx.Limits,
+                 transport: Optional[httpx.AsyncBaseTransport] = None, **kwargs):
+        self.limits = limits
+        self.transport = transport
+        super().__init__(base_url, **kwargs)
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=self.transport,
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            proxy=proxy,
+            follow_redirects=True,
+            http2=True,
+            limits=self.limits
+        )
+
+class QueryStats:
+    __slots__ = ("count", "errors", "total_ms", "max_ms", "samples")
+
+    def __init__(self, sample_size: int):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=sample_size)  # Recent latencies for percentiles
+
+    def record(self, elapsed_ms: float, failed: bool) -> None:
+        self.count += 1
+        self.errors += failed
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.samples.append(elapsed_ms)
+
+    def summary(self) -> Dict:
+        ordered = sorted(self.samples)
+
+        def percentile(q: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "max_ms": self.max_ms
+        }
+
+class SupabaseDataLayer:
+    def __init__(self, supabase_url: str, supabase_key: str, timeout: float = SUPABASE_TIMEOUT,
+                 connect_timeout: float = SUPABASE_CONNECT_TIMEOUT,
+                 max_connections: int = SUPABASE_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = SUPABASE_MAX_KEEPALIVE_CONNECTIONS,
+                 slow_query_ms: Optional[float] = SUPABASE_SLOW_QUERY_MS, sample_size: int = 1000,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        """
+        Async PostgREST access shared by every service.
+
+        One HTTP/2 connection pool serves all tables and RPCs, so services do
+        not open their own clients. Queries are built with `table` / `rpc`
+        and run through `execute`, which records latency per query name.
+        `transport` replaces the network (e.g. a local stand-in for load tests).
+        """
+        self.client = _PooledPostgrestClient(
+            f"{supabase_url.rstrip('/')}/rest/v1",
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections
+            ),
+            transport=transport,
+            headers={
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+                "apiKey": supabase_key,
+                "Authorization": f"Bearer {supabase_key}"
+            },
+            timeout=httpx.Timeout(timeout, connect=connect_timeout)
+        )
+        self.slow_query_ms = slow_query_ms
+        self.sample_size = sample_size
+        self.stats: Dict[str, QueryStats] = {}
+
+    def table(self, name: str):
+        """Start a query on a table (same builder API as supabase-py)."""
+        return self.client.from_(name)
+
+    def rpc(self, function: str, params: Dict):
+        """Start a call to a Postgres function."""
+        return self.client.rpc(function, params)
+
+    async def execute(self, query, name: str):
+        """
+        Run a built query and record its latency.
+
+        Args:
+            query: Request builder from `table` or `rpc`
+            name: Metric label, e.g. "conversation_history.select"
+
+        Returns:
+            The PostgREST response (with `.data`)
+        """
+        started = time.perf_counter()
+        failed = True
+        try:
+            with span(f"supabase.{name}"):
+                response = await query.execute()
+            failed = False
+            return response
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = QueryStats(self.sample_size)
+            stats.record(elapsed_ms, failed)
+            if self.slow_query_ms is not None and elapsed_ms >= self.slow_query_ms:
+                print(f"Slow Supabase query {name}: {elapsed_ms:.0f} ms")
+
+    def metrics(self) -> Dict[str, Dict]:
+        """Latency summary per query name."""
+        return {name: stats.summary() for name, stats in sorted(self.stats.items())}
+
+    async def close(self) -> None:
+        """Close the pooled HTTP connections."""
+        await self.client.aclose()
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 
 from telegram import Update
 from telegram.constants import ChatAction
@@ -14,15 +14,25 @@ from telegram.ext import (
     CommandHandler
 )
 
+from config.config import SESSION_HISTORY_LIMIT, HISTORY_HYDRATION_LIMIT
+from services.outbox import ESCALATION_EMAILS
+from utils.tracing import trace, span, traced, current_trace_id
+
 class TelegramBot:
-    def __init__(self, telegram_token: str, llm_service, vector_store, sheet_service, gmail_service):
+    def __init__(self, telegram_token: str, llm_service, vector_store, sheet_service, gmail_service,
+                 outbox=None, conversation_memory=None, availability_service=None, escalation_manager=None):
         """Initialize the Telegram bot with required services."""
         self.token = telegram_token
         self.llm_service = llm_service
         self.vector_store = vector_store
         self.sheet_service = sheet_service
         self.gmail_service = gmail_service
+        self.outbox = outbox  # Durable queue for escalation emails, if configured
+        self.conversation_memory = conversation_memory  # Persistent history behind self.sessions
+        self.availability_service = availability_service  # Precomputed open slots
+        self.escalation_manager = escalation_manager  # Coalesces escalations into one thread per case
         self.sessions = {}
+        self.history_loads: Dict[int, asyncio.Future] = {}
         self.logger = logging.getLogger(__name__)
         self.application = None
 
@@ -33,8 +43,64 @@ class TelegramBot:
         except Exception as e:
             self.logger.error(f"Error sending typing indicator: {str(e)}")
 
+    async def get_session(self, user_id: int) -> Dict:
+        """
+        Return the user's session, hydrating its history on first use.
+
+        The in-memory session is the hot tier. When it is missing (new user or
+        after a restart) the last few messages are loaded from conversation
+        memory once; concurrent first messages share that single fetch.
+        """
+        session = self.sessions.get(user_id)
+        if session is not None:
+            return session
+
+        history = await self._load_history(user_id)
+        return self.sessions.setdefault(user_id, {
+            'conversation_history': history,
+            'preferences': {},
+            'last_interaction': datetime.now()
+        })
+
+    async def _load_history(self, user_id: int) -> List[Dict]:
+        """Fetch recent history from conversation memory, collapsing concurrent loads."""
+        if not self.conversation_memory:
+            return []
+
+        pending = self.history_loads.get(user_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self.conversation_memory.get_recent_history(
+                user_id,
+                HISTORY_HYDRATION_LIMIT,
+                "role,content,timestamp"
+            ))
+            self.history_loads[user_id] = pending
+            pending.add_done_callback(lambda _: self.history_loads.pop(user_id, None))
+
+        try:
+            records = await asyncio.shield(pending)
+        except Exception as e:
+            self.logger.error(f"Error loading conversation history: {str(e)}")
+            return []
+        return [{"role": record["role"], "content": record["content"]} for record in records]
+
+    async def _persist_exchange(self, user_id: int, text: str, response: str, analysis: Dict):
+        """Queue both sides of an exchange for conversation memory; waits only while the buffer is full."""
+        if not self.conversation_memory:
+            return
+        try:
+            metadata = {'intent': analysis.get('intent', 'unknown')}
+            await self.conversation_memory.save_message(user_id, {"role": "user", "content": text}, metadata)
+            await self.conversation_memory.save_message(user_id, {"role": "assistant", "content": response}, metadata)
+        except Exception as e:
+            self.logger.error(f"Error persisting conversation: {str(e)}")
+
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle incoming messages."""
+        """Handle incoming messages, each one timed as a trace."""
+        with trace("bot.handle_message", update_id=getattr(update, 'update_id', None)):
+            await self._handle_message(update, context)
+
+    async def _handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             message = update.message
             if not message or not message.text:
@@ -45,15 +111,12 @@ class TelegramBot:
             text = message.text
 
             # Start typing indicator
-            await self.start_typing(chat_id)
+            with span("bot.typing"):
+                await self.start_typing(chat_id)
 
-            # Get or create session
-            if user_id not in self.sessions:
-                self.sessions[user_id] = {
-                    'conversation_history': [],
-                    'preferences': {},
-                    'last_interaction': datetime.now()
-                }
+            # Get or create session (hydrated from conversation memory on first use)
+            with span("bot.session"):
+                await self.get_session(user_id)
 
             # Update last interaction time
             self.sessions[user_id]['last_interaction'] = datetime.now()
@@ -69,7 +132,7 @@ class TelegramBot:
                 )
 
                 # Get relevant context
-                context_data = await self.get_context(analysis, user_id)
+                context_data = await self.get_context(analysis, user_id, text)
 
                 # Generate response
                 response = self.llm_service.generate_response(
@@ -89,8 +152,8 @@ class TelegramBot:
                 })
 
                 # Keep conversation history within limits
-                if len(self.sessions[user_id]['conversation_history']) > 10:
-                    self.sessions[user_id]['conversation_history'] = self.sessions[user_id]['conversation_history'][-10:]
+                if len(self.sessions[user_id]['conversation_history']) > SESSION_HISTORY_LIMIT:
+                    self.sessions[user_id]['conversation_history'] = self.sessions[user_id]['conversation_history'][-SESSION_HISTORY_LIMIT:]
 
                 # Cancel typing task
                 typing_task.cancel()
@@ -101,23 +164,30 @@ class TelegramBot:
 
                 # Send response with retry logic
                 max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        await message.reply_text(
-                            response,
-                            read_timeout=30,
-                            write_timeout=30,
-                            connect_timeout=30
-                        )
-                        break
-                    except Exception as e:
-                        if attempt == max_retries - 1:
-                            raise
-                        await asyncio.sleep(1)  # Wait before retry
+                with span("bot.reply") as reply_span:
+                    for attempt in range(max_retries):
+                        reply_span.set("attempts", attempt + 1)
+                        try:
+                            await message.reply_text(
+                                response,
+                                read_timeout=30,
+                                write_timeout=30,
+                                connect_timeout=30
+                            )
+                            break
+                        except Exception as e:
+                            if attempt == max_retries - 1:
+                                raise
+                            await asyncio.sleep(1)  # Wait before retry
+
+                # Persist after replying so a backed-up write buffer never delays the answer
+                with span("bot.persist"):
+                    await self._persist_exchange(user_id, text, response, analysis)
 
                 # Handle escalation if needed
                 if analysis.get('escalation_required', False):
-                    await self.handle_escalation(update, context, analysis)
+                    with span("bot.escalation"):
+                        await self.handle_escalation(update, context, analysis)
 
             finally:
                 # Ensure typing task is cancelled
@@ -129,7 +199,7 @@ class TelegramBot:
                         pass
 
         except Exception as e:
-            self.logger.error(f"Error handling message: {str(e)}")
+            self.logger.error(f"Error handling message (trace {current_trace_id()}): {str(e)}")
             await message.reply_text(
                 "I apologize, but I encountered an error processing your message. Please try again later.",
                 read_timeout=30,
@@ -170,12 +240,30 @@ class TelegramBot:
             self.logger.info(f"Message: {message.text}")
             self.logger.info(f"Analysis: {analysis}")
 
-            # Send escalation email
-            email_sent = self.gmail_service.send_escalation_email(
-                parent_info=user_info,
-                conversation_context=message.text,
-                conversation_history=conversation_history
-            )
+            # Send escalation email: coalesced per case by the escalation
+            # manager, otherwise through the outbox when available so a
+            # Gmail outage delays the email instead of losing it
+            if self.escalation_manager:
+                await self.escalation_manager.submit(user_info, message.text, conversation_history, analysis)
+                email_sent = True
+            elif self.outbox:
+                key = f"escalation:{message.chat_id}:{message.message_id}"
+                email_sent = self.outbox.enqueue(
+                    ESCALATION_EMAILS,
+                    {
+                        'parent_info': user_info,
+                        'conversation_context': message.text,
+                        'conversation_history': conversation_history,
+                        'message_id': f"<{key.replace(':', '.')}@teachpro-bot>"
+                    },
+                    idempotency_key=key
+                ) is not None
+            else:
+                email_sent = await self.gmail_service.send_escalation_email_async(
+                    parent_info=user_info,
+                    conversation_context=message.text,
+                    conversation_history=conversation_history
+                )
 
             # Notify user
             await message.reply_text(
@@ -189,7 +277,8 @@ class TelegramBot:
         except Exception as e:
             self.logger.error(f"Error handling escalation: {str(e)}")
 
-    async def get_context(self, analysis: Dict, user_id: int) -> Dict:
+    @traced("bot.get_context")
+    async def get_context(self, analysis: Dict, user_id: int, message_text: str = '') -> Dict:
         """Gather relevant context for the response."""
         try:
             context = {
@@ -200,17 +289,29 @@ class TelegramBot:
                 'escalation_required': analysis.get('escalation_required', False)
             }
 
-            # Get relevant information from vector store
-            if analysis.get('intent') in ['question', 'help', 'information']:
-                context['vector_store_results'] = self.vector_store.search(
-                    analysis.get('entities', {}).get('query', ''),
-                    limit=3
+            # Get relevant information from vector store, narrowed by intent and subjects
+            search_filter = self.vector_store.build_filter(analysis)
+            if analysis.get('intent') in ['question', 'help', 'information'] or search_filter:
+                entities = analysis.get('entities') or {}
+                query = (entities.get('query') if isinstance(entities, dict) else None) or message_text
+                if query:
+                    context['vector_store_results'] = await self.vector_store.search(
+                        query,
+                        limit=3,
+                        filter=search_filter
+                    )
+
+            # Open slots, served from the availability service's memory
+            if analysis.get('intent') in ['schedule', 'booking', 'availability'] and self.availability_service:
+                entities = analysis.get('entities') or {}
+                if not isinstance(entities, dict):
+                    entities = {}
+                subject = entities.get('subject')
+                context['sheet_data'] = self.availability_service.get_availability(
+                    subject=subject if isinstance(subject, str) else None,
+                    tutor=entities.get('tutor') if isinstance(entities.get('tutor'), str) else None
                 )
 
-            # Get relevant sheet data
-            if analysis.get('intent') in ['schedule', 'booking', 'availability']:
-                context['sheet_data'] = self.sheet_service.get_availability()
-
             return context
 
         except Exception as e:
@@ -304,7 +405,7 @@ class TelegramBot:
             }
 
             # Send a test notification email
-            email_sent = self.gmail_service.send_notification_email(
+            email_sent = await self.gmail_service.send_notification_email_async(
                 subject="Test Email from TeachPro Bot",
                 body=f"""
 This is a test email from the TeachPro Bot.
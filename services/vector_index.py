@@ -0,0 +1,275 @@
+from typing import Dict, List, Optional, Tuple
+import json
+import numpy as np
+
+def metadata_matches(metadata, filter) -> bool:
+    """Containment check modelled on jsonb `metadata @> filter` in match_documents."""
+    if isinstance(filter, dict):
+        if not isinstance(metadata, dict):
+            return False
+        return all(key in metadata and metadata_matches(metadata[key], value)
+                   for key, value in filter.items())
+    if isinstance(filter, list):
+        if not isinstance(metadata, list):
+            metadata = [metadata]
+        return all(any(metadata_matches(item, value) for item in metadata) for value in filter)
+    return metadata == filter
+
+class LocalVectorIndex:
+    def __init__(self, coarse_dimensions: int = 256, candidate_multiplier: int = 10,
+                 partition_key: str = 'category'):
+        """
+        In-memory coarse-to-fine index over document embeddings.
+
+        text-embedding-3 models are trained so that the first N dimensions of an
+        embedding, re-normalised, behave like an embedding requested with
+        `dimensions=N`. Stage one therefore scans truncated vectors to pick
+        candidates cheaply and stage two reranks them with the full vectors.
+
+        Rows are partitioned by the `partition_key` metadata value so that a
+        filtered search only scans the matching category.
+        """
+        self.coarse_dimensions = coarse_dimensions
+        self.candidate_multiplier = candidate_multiplier
+        self.partition_key = partition_key
+        self.documents: List[Dict] = []
+        self.full_matrix: Optional[np.ndarray] = None
+        self.coarse_matrix: Optional[np.ndarray] = None
+        self.partitions: Dict[str, np.ndarray] = {}
+        self.id_to_row: Dict = {}
+        self.max_cached_filters = 128
+        self._filter_cache: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        """L2-normalise the rows of a matrix (or a single vector)."""
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    @staticmethod
+    def _has_vector(vector) -> bool:
+        """True for a non-empty list or array."""
+        return vector is not None and len(vector) > 0
+
+    def _truncate(self, matrix: np.ndarray) -> np.ndarray:
+        """Shorten embeddings to the coarse dimensionality and re-normalise."""
+        return self._normalize(matrix[..., :self.coarse_dimensions])
+
+    def build(self, documents: List[Dict]) -> None:
+        """
+        Build the index from documents carrying an 'embedding' list.
+
+        Args:
+            documents: Dicts with 'content', 'metadata' and 'embedding' keys
+        """
+        documents = [doc for doc in documents if self._has_vector(doc.get('embedding'))]
+        self._filter_cache = {}
+        self.partitions = {}
+        self.id_to_row = {}
+        if not documents:
+            self.documents = []
+            self.full_matrix = None
+            self.coarse_matrix = None
+            return
+
+        full = np.asarray([doc['embedding'] for doc in documents], dtype=np.float32)
+        self.full_matrix = self._normalize(full)
+        self.coarse_matrix = np.ascontiguousarray(self._truncate(self.full_matrix))
+        self.documents = [
+            {
+                'id': doc.get('id'),
+                'content': doc.get('content'),
+                'metadata': doc.get('metadata') or {}
+            }
+            for doc in documents
+        ]
+
+        self.id_to_row = {doc['id']: i for i, doc in enumerate(self.documents) if doc['id'] is not None}
+
+        partitions: Dict[str, List[int]] = {}
+        for i, doc in enumerate(self.documents):
+            value = doc['metadata'].get(self.partition_key)
+            if value is not None:
+                partitions.setdefault(str(value), []).append(i)
+        self.partitions = {
+            value: np.asarray(rows, dtype=np.int64) for value, rows in partitions.items()
+        }
+
+    def vectors_for(self, ids: List) -> Optional[np.ndarray]:
+        """Full normalised embeddings for document ids, or None if any is unknown."""
+        if self.full_matrix is None or any(doc_id not in self.id_to_row for doc_id in ids):
+            return None
+        return self.full_matrix[[self.id_to_row[doc_id] for doc_id in ids]]
+
+    def _rows_for(self, filter: Optional[Dict]) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """
+        Resolve a metadata filter to (row indices, coarse sub-matrix).
+
+        Row indices are None when the whole index is searched. The partition
+        key selects a precomputed partition; any remaining keys are checked
+        with containment semantics. Results are cached per distinct filter.
+        """
+        if not filter:
+            return None, self.coarse_matrix
+
+        cache_key = json.dumps(filter, sort_keys=True, default=str)
+        cached = self._filter_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        if self.partition_key in filter:
+            rows = self.partitions.get(str(filter[self.partition_key]), np.empty(0, dtype=np.int64))
+        else:
+            rows = np.arange(len(self.documents), dtype=np.int64)
+
+        remaining = {key: value for key, value in filter.items() if key != self.partition_key}
+        if remaining:
+            rows = np.asarray(
+                [i for i in rows.tolist() if metadata_matches(self.documents[i]['metadata'], remaining)],
+                dtype=np.int64
+            )
+
+        if len(self._filter_cache) >= self.max_cached_filters:
+            self._filter_cache.clear()
+        self._filter_cache[cache_key] = (rows, np.ascontiguousarray(self.coarse_matrix[rows]))
+        return self._filter_cache[cache_key]
+
+    def _top_k(self, scores: np.ndarray, k: int) -> np.ndarray:
+        """Return indices of the k highest scores, best first."""
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < scores.shape[0]:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(scores.shape[0])
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    def _results(self, indices: np.ndarray, scores: np.ndarray) -> List[Dict]:
+        """Format index hits the same way as the match_documents RPC."""
+        return [
+            {
+                'id': self.documents[i]['id'],
+                'content': self.documents[i]['content'],
+                'metadata': self.documents[i]['metadata'],
+                'similarity': float(score)
+            }
+            for i, score in zip(indices.tolist(), scores.tolist())
+        ]
+
+    def search(self, query_embedding: List[float], limit: int = 3,
+               candidate_count: Optional[int] = None, filter: Optional[Dict] = None) -> List[Dict]:
+        """
+        Two-stage search: truncated-vector candidate scan, full-vector rerank.
+
+        Args:
+            query_embedding: Full-size query embedding
+            limit: Maximum number of results to return
+            candidate_count: Stage-one candidates (defaults to limit * multiplier)
+            filter: Metadata filter with match_documents containment semantics
+
+        Returns:
+            Results ordered by full-dimension cosine similarity
+        """
+        if self.full_matrix is None or not self._has_vector(query_embedding):
+            return []
+
+        query = self._normalize(np.asarray(query_embedding, dtype=np.float32))
+        if candidate_count is None:
+            candidate_count = limit * self.candidate_multiplier
+        candidate_count = max(candidate_count, limit)
+
+        rows, coarse_matrix = self._rows_for(filter)
+        coarse_scores = coarse_matrix @ self._truncate(query)
+        candidates = self._top_k(coarse_scores, candidate_count)
+        if rows is not None:
+            candidates = rows[candidates]
+
+        full_scores = self.full_matrix[candidates] @ query
+        order = self._top_k(full_scores, limit)
+        return self._results(candidates[order], full_scores[order])
+
+    def exact_search(self, query_embedding: List[float], limit: int = 3,
+                     filter: Optional[Dict] = None) -> List[Dict]:
+        """Brute-force search over the full vectors (the recall baseline)."""
+        if self.full_matrix is None or not self._has_vector(query_embedding):
+            return []
+
+        query = self._normalize(np.asarray(query_embedding, dtype=np.float32))
+        rows, _ = self._rows_for(filter)
+        if rows is None:
+            scores = self.full_matrix @ query
+            order = self._top_k(scores, limit)
+            return self._results(order, scores[order])
+        scores = self.full_matrix[rows] @ query
+        order = self._top_k(scores, limit)
+        return self._results(rows[order], scores[order])
+
+def mmr_select(query_embedding: List[float], candidates: List[Dict],
+               embeddings: Optional[np.ndarray], limit: int = 3,
+               lambda_mult: float = 0.5, max_per_source: Optional[int] = None,
+               source_key: str = 'source') -> List[Dict]:
+    """
+    Pick a diverse subset of candidates with maximal marginal relevance.
+
+    Each step takes the candidate maximising
+    lambda * sim(query, doc) - (1 - lambda) * max sim(doc, already selected),
+    skipping candidates whose metadata source already hit `max_per_source`.
+
+    Args:
+        query_embedding: Full-size query embedding
+        candidates: Over-fetched results, best first
+        embeddings: Candidate embeddings in the same order, or None to apply
+            only the per-source cap
+        limit: Number of results to keep
+        lambda_mult: 1.0 is pure relevance, 0.0 is pure diversity
+        max_per_source: Cap on results sharing a metadata source (None = no cap)
+        source_key: Metadata key identifying the source document
+
+    Returns:
+        Selected candidates in selection order
+    """
+    def source_of(candidate: Dict):
+        return (candidate.get('metadata') or {}).get(source_key)
+
+    def under_cap(candidate: Dict, counts: Dict) -> bool:
+        source = source_of(candidate)
+        return max_per_source is None or source is None or counts.get(source, 0) < max_per_source
+
+    selected: List[int] = []
+    counts: Dict = {}
+
+    if embeddings is None or len(embeddings) != len(candidates):
+        for i, candidate in enumerate(candidates):
+            if len(selected) >= limit:
+                break
+            if under_cap(candidate, counts):
+                selected.append(i)
+                source = source_of(candidate)
+                counts[source] = counts.get(source, 0) + 1
+        return [candidates[i] for i in selected]
+
+    vectors = LocalVectorIndex._normalize(np.asarray(embeddings, dtype=np.float32))
+    query = LocalVectorIndex._normalize(np.asarray(query_embedding, dtype=np.float32))
+    relevance = vectors @ query
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+
+    while len(selected) < limit and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        available[best] = False
+        if not under_cap(candidates[best], counts):
+            continue
+
+        selected.append(best)
+        source = source_of(candidates[best])
+        counts[source] = counts.get(source, 0) + 1
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+
+    return [candidates[i] for i in selected]
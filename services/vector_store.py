@@ -1,79 +1,294 @@
 from typing import List, Dict, Optional
-from supabase import Client
+import asyncio
+import json
 import openai
-from config.config import OPENAI_API_KEY
+from config.config import (
+    OPENAI_API_KEY,
+    EMBEDDING_MODEL,
+    VECTOR_SEARCH_MODE,
+    COARSE_EMBEDDING_DIMENSIONS,
+    COARSE_CANDIDATE_MULTIPLIER,
+    DOCUMENT_PARTITION_KEY,
+    INTENT_DOCUMENT_CATEGORIES,
+    SUBJECTS,
+    SUBJECT_ALIASES,
+    MMR_ENABLED,
+    MMR_LAMBDA,
+    MMR_FETCH_MULTIPLIER,
+    MMR_MAX_PER_SOURCE
+)
+from services.vector_index import LocalVectorIndex, mmr_select
+from services.supabase_data import SupabaseDataLayer
+from utils.tracing import span, traced
 
 class VectorStore:
-    def __init__(self, supabase_url: str, supabase_key: str):
-        """Initialize vector store with Supabase client."""
-        self.supabase = Client(supabase_url, supabase_key)
+    def __init__(self, db: SupabaseDataLayer, search_mode: str = VECTOR_SEARCH_MODE):
+        """Initialize vector store with the shared Supabase data layer."""
+        self.db = db
         self.table = "documents"  # Changed to match the actual table name
-        self.openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        self.model = "text-embedding-3-small"  # Using the latest embedding model
+        self.openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+        self.model = EMBEDDING_MODEL  # Using the latest embedding model
+        self.search_mode = search_mode
+        self.local_index = LocalVectorIndex(
+            coarse_dimensions=COARSE_EMBEDDING_DIMENSIONS,
+            candidate_multiplier=COARSE_CANDIDATE_MULTIPLIER,
+            partition_key=DOCUMENT_PARTITION_KEY
+        )
+        self.page_size = 1000
+        self.index_loaded = False
+        self.index_lock = asyncio.Lock()
+        self.rpc_embeddings = True  # Cleared if match_documents_with_embeddings is not deployed
 
-    def search(self, query: str, limit: int = 3) -> List[Dict]:
+    async def load_documents(self) -> List[Dict]:
+        """Fetch every document with its stored embedding, page by page."""
+        documents = []
+        start = 0
+        while True:
+            response = await self.db.execute(
+                self.db.table(self.table)
+                    .select("id,content,metadata,embedding")
+                    .order("id")
+                    .range(start, start + self.page_size - 1),
+                "documents.load"
+            )
+
+            for doc in response.data:
+                embedding = doc.get('embedding')
+                # pgvector columns come back from PostgREST as '[0.1,0.2,...]' strings
+                if isinstance(embedding, str):
+                    embedding = json.loads(embedding)
+                documents.append({
+                    'id': doc.get('id'),
+                    'content': doc.get('content'),
+                    'metadata': doc.get('metadata') or {},
+                    'embedding': embedding
+                })
+
+            if len(response.data) < self.page_size:
+                return documents
+            start += self.page_size
+
+    async def load_local_index(self) -> int:
+        """Build the in-memory two-stage index from the documents table."""
+        self.index_loaded = True
+        try:
+            documents = await self.load_documents()
+            await asyncio.to_thread(self.local_index.build, documents)
+        except Exception as e:
+            print(f"Error loading local vector index: {str(e)}")
+        return len(self.local_index)
+
+    def build_filter(self, analysis: Dict) -> Dict:
+        """
+        Map message analysis to a document metadata filter.
+
+        The intent selects a document category and subject entities become a
+        'subjects' containment filter. Unknown intents and subjects are ignored.
+        """
+        filter = {}
+        intent = str(analysis.get('intent') or '').strip().lower()
+        category = INTENT_DOCUMENT_CATEGORIES.get(intent)
+        if category:
+            filter[DOCUMENT_PARTITION_KEY] = category
+
+        entities = analysis.get('entities') or {}
+        if not isinstance(entities, dict):
+            entities = {}
+        mentioned = entities.get('subjects') or entities.get('subject') or []
+        if isinstance(mentioned, str):
+            mentioned = [mentioned]
+        subjects = set()
+        for subject in mentioned:
+            subject = str(subject).strip().lower()
+            subject = SUBJECT_ALIASES.get(subject, subject)
+            if subject in SUBJECTS:
+                subjects.add(subject)
+        if subjects:
+            filter['subjects'] = sorted(subjects)
+
+        return filter
+
+    def _filter_fallbacks(self, filter: Optional[Dict]) -> List[Dict]:
+        """Filters to try in order: as given, category only, then unfiltered."""
+        fallbacks = []
+        if filter:
+            fallbacks.append(filter)
+            if DOCUMENT_PARTITION_KEY in filter and len(filter) > 1:
+                fallbacks.append({DOCUMENT_PARTITION_KEY: filter[DOCUMENT_PARTITION_KEY]})
+        fallbacks.append({})
+        return fallbacks
+
+    @traced("vector_store.search")
+    async def search(self, query: str, limit: int = 3, filter: Optional[Dict] = None,
+               diversify: Optional[bool] = None, lambda_mult: Optional[float] = None) -> List[Dict]:
         """
         Search the vector store for relevant documentation.
         
         Args:
             query: The search query from the parent
             limit: Maximum number of results to return
+            filter: Metadata filter (see build_filter); relaxed when nothing matches
+            diversify: Over-fetch and rerank with MMR (defaults to MMR_ENABLED)
+            lambda_mult: MMR relevance/diversity trade-off (defaults to MMR_LAMBDA)
             
         Returns:
             List of relevant documentation entries with their content and metadata
         """
         try:
             # Generate embedding for the query
-            query_embedding = self._generate_embedding(query)
-            
-            # Perform vector similarity search in Supabase
-            response = self.supabase.rpc(
-                'match_documents',
-                {
-                    'filter': {},  # Empty filter to search all documents
-                    'match_count': limit,
-                    'query_embedding': query_embedding
-                }
-            ).execute()
-            
-            # Process and return results
-            results = []
-            for doc in response.data:
-                results.append({
-                    'content': doc.get('content'),
-                    'metadata': doc.get('metadata', {}),
-                    'similarity': doc.get('similarity', 0)
-                })
-            
-            return results
+            query_embedding = await self._generate_embedding(query)
+            if not query_embedding:
+                return []
+
+            # Coarse-to-fine search over the local index when enabled
+            use_local = False
+            if self.search_mode == 'two_stage':
+                if not self.index_loaded:
+                    # Concurrent first searches share one load
+                    async with self.index_lock:
+                        if not self.index_loaded:
+                            await self.load_local_index()
+                use_local = len(self.local_index) > 0
+
+            if diversify is None:
+                diversify = MMR_ENABLED
+            fetch_count = limit * MMR_FETCH_MULTIPLIER if diversify else limit
+
+            for candidate_filter in self._filter_fallbacks(filter):
+                if use_local:
+                    with span("vector_store.local_search"):
+                        results = self.local_index.search(query_embedding, limit=fetch_count, filter=candidate_filter)
+                else:
+                    results = await self._rpc_search(query_embedding, fetch_count, candidate_filter,
+                                                     with_embeddings=diversify)
+                if results:
+                    if diversify:
+                        with span("vector_store.mmr"):
+                            results = mmr_select(
+                                query_embedding,
+                                results,
+                                await self._candidate_embeddings(results),
+                                limit=limit,
+                                lambda_mult=MMR_LAMBDA if lambda_mult is None else lambda_mult,
+                                max_per_source=MMR_MAX_PER_SOURCE
+                            )
+                    return results
+
+            return []
 
         except Exception as e:
             print(f"Error searching vector store: {str(e)}")
             return []
 
-    def _generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for text using OpenAI's API."""
+    async def _rpc_search(self, query_embedding: List[float], limit: int, filter: Dict,
+                          with_embeddings: bool = False) -> List[Dict]:
+        """
+        Run the match_documents RPC with a metadata filter.
+
+        With `with_embeddings`, match_documents_with_embeddings is called
+        instead and each result carries its 'embedding' for MMR, which
+        _candidate_embeddings takes off again.
+        """
+        params = {
+            'filter': filter,  # Empty filter searches all documents
+            'match_count': limit,
+            'query_embedding': query_embedding
+        }
+        response = None
+        if with_embeddings and self.rpc_embeddings:
+            try:
+                response = await self.db.execute(
+                    self.db.rpc('match_documents_with_embeddings', params),
+                    "rpc.match_documents_with_embeddings"
+                )
+            except Exception as e:
+                # Database without the function yet: fetch embeddings separately from now on
+                print(f"Error calling match_documents_with_embeddings, falling back: {str(e)}")
+                self.rpc_embeddings = False
+        if response is None:
+            response = await self.db.execute(self.db.rpc('match_documents', params), "rpc.match_documents")
+
+        # Process and return results
+        results = []
+        for doc in response.data:
+            result = {
+                'id': doc.get('id'),
+                'content': doc.get('content'),
+                'metadata': doc.get('metadata', {}),
+                'similarity': doc.get('similarity', 0)
+            }
+            embedding = doc.get('embedding')
+            if embedding is not None:
+                result['embedding'] = json.loads(embedding) if isinstance(embedding, str) else embedding
+            results.append(result)
+
+        return results
+
+    async def _candidate_embeddings(self, results: List[Dict]):
+        """
+        Embeddings for search results, used by MMR reranking.
+
+        Taken from the results when the RPC returned them (and removed, so
+        they never reach the prompt), else served from the local index when
+        it holds every result, else fetched for the candidate ids in one
+        query. None disables the similarity term and leaves only the
+        per-source cap.
+        """
+        embeddings = [result.pop('embedding', None) for result in results]
+        if all(embeddings):
+            return embeddings
+
+        ids = [result.get('id') for result in results]
+        if any(doc_id is None for doc_id in ids):
+            return None
+
+        vectors = self.local_index.vectors_for(ids)
+        if vectors is not None:
+            return vectors
+
         try:
-            response = self.openai_client.embeddings.create(
-                model=self.model,
-                input=text
+            response = await self.db.execute(
+                self.db.table(self.table).select("id,embedding").in_("id", ids),
+                "documents.embeddings"
             )
+            by_id = {}
+            for doc in response.data:
+                embedding = doc.get('embedding')
+                if isinstance(embedding, str):
+                    embedding = json.loads(embedding)
+                by_id[doc.get('id')] = embedding
+            if any(not by_id.get(doc_id) for doc_id in ids):
+                return None
+            return [by_id[doc_id] for doc_id in ids]
+        except Exception as e:
+            print(f"Error fetching candidate embeddings: {str(e)}")
+            return None
+
+    @traced("vector_store.embedding")
+    async def _generate_embedding(self, text: str, dimensions: Optional[int] = None) -> List[float]:
+        """Generate embedding for text using OpenAI's API, optionally shortened."""
+        try:
+            params = {'model': self.model, 'input': text}
+            if dimensions:
+                params['dimensions'] = dimensions
+            response = await self.openai_client.embeddings.create(**params)
             return response.data[0].embedding
         except Exception as e:
             print(f"Error generating embedding: {str(e)}")
             return []
 
-    def get_relevant_context(self, query: str) -> str:
+    async def get_relevant_context(self, query: str, filter: Optional[Dict] = None) -> str:
         """
         Get formatted context from vector store for LLM.
         
         Args:
             query: The parent's question
+            filter: Optional metadata filter
             
         Returns:
             Formatted string with relevant documentation
         """
-        results = self.search(query)
+        results = await self.search(query, filter=filter)
         
         if not results:
             return "No relevant documentation found."
@@ -1,122 +1,134 @@
-from typing import Dict, List, Tuple
-import re
+from typing import Dict, Hashable, Iterator, List
+from collections import OrderedDict
 from datetime import datetime
-from config.config import ESCALATION_KEYWORDS
+import time
+from config.config import (
+    MESSAGE_HISTORY_SIZE,
+    MESSAGE_HISTORY_IDLE_TIMEOUT,
+    MESSAGE_HISTORY_MAX_USERS
+)
+from utils.text_analysis import TextAnalyzer, default_analyzer
+
+class HistoryEntry:
+    __slots__ = ("message", "timestamp")
+
+    def __init__(self, message: str, timestamp: float):
+        self.message = message
+        self.timestamp = timestamp  # time.monotonic()
+
+class HistoryRing:
+    __slots__ = ("slots", "head", "size", "last_seen")
+
+    def __init__(self, capacity: int):
+        """Fixed-capacity ring of entries; once full, each append overwrites the oldest."""
+        self.slots: List[HistoryEntry] = [None] * capacity
+        self.head = 0  # Slot the next entry goes into
+        self.size = 0
+        self.last_seen = 0.0
+
+    def append(self, entry: HistoryEntry) -> None:
+        self.slots[self.head] = entry
+        self.head = (self.head + 1) % len(self.slots)
+        self.size = min(self.size + 1, len(self.slots))
+        self.last_seen = entry.timestamp
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[HistoryEntry]:
+        """Oldest entry first."""
+        capacity = len(self.slots)
+        start = (self.head - self.size) % capacity
+        for i in range(self.size):
+            yield self.slots[(start + i) % capacity]
 
 class MessageProcessor:
-    def __init__(self):
-        self.conversation_history = {}
-
-    def process_message(self, message: str, user_id: str) -> Dict:
-        """
-        Process incoming message and extract relevant information
-        """
-        # Initialize conversation history for new users
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-
-        # Add message to conversation history
-        self.conversation_history[user_id].append({
-            'message': message,
-            'timestamp': datetime.now().isoformat()
-        })
-
-        # Analyze message
-        analysis = {
-            'requires_escalation': self._check_escalation(message),
-            'intent': self._detect_intent(message),
-            'entities': self._extract_entities(message),
-            'sentiment': self._analyze_sentiment(message)
-        }
-
-        return analysis
-
-    def _check_escalation(self, message: str) -> bool:
-        """
-        Check if message requires human escalation
-        """
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in ESCALATION_KEYWORDS)
-
-    def _detect_intent(self, message: str) -> str:
-        """
-        Detect the intent of the message
-        """
-        message_lower = message.lower()
-        
-        if any(word in message_lower for word in ['schedule', 'book', 'appointment']):
-            return 'schedule'
-        elif any(word in message_lower for word in ['price', 'cost', 'fee']):
-            return 'pricing'
-        elif any(word in message_lower for word in ['program', 'course', 'curriculum']):
-            return 'program_info'
-        elif any(word in message_lower for word in ['teacher', 'tutor', 'instructor']):
-            return 'teacher_info'
+    def __init__(self, analyzer: TextAnalyzer = None, history_size: int = MESSAGE_HISTORY_SIZE,
+                 idle_timeout: float = MESSAGE_HISTORY_IDLE_TIMEOUT,
+                 max_users: int = MESSAGE_HISTORY_MAX_USERS):
+        """
+        Analyze messages and keep a short, bounded history per user.
+
+        Each user gets a ring of `history_size` entries. Users are kept in
+        least-recently-active order; those idle for `idle_timeout` seconds,
+        and the least recently active beyond `max_users`, are evicted.
+        """
+        self.conversation_history: "OrderedDict[Hashable, HistoryRing]" = OrderedDict()
+        self.history_size = history_size
+        self.idle_timeout = idle_timeout
+        self.max_users = max_users
+        self.evictions = 0
+        # Converts monotonic entry timestamps to wall-clock time for callers
+        self.clock_offset = time.time() - time.monotonic()
+        # Compiled once per process and shared by every processor
+        self.analyzer = analyzer or default_analyzer()
+
+    def _ring(self, user_id: Hashable, now: float) -> HistoryRing:
+        """The user's ring, created if needed and marked most recently active."""
+        self.evict_idle(now)
+        ring = self.conversation_history.get(user_id)
+        if ring is None:
+            ring = self.conversation_history[user_id] = HistoryRing(self.history_size)
+            ring.last_seen = now
+            self.evict_idle(now)  # Over max_users now: the least recently active user goes
         else:
-            return 'general_inquiry'
+            self.conversation_history.move_to_end(user_id)
+        return ring
 
-    def _extract_entities(self, message: str) -> Dict:
-        """
-        Extract relevant entities from the message
-        """
-        entities = {
-            'dates': self._extract_dates(message),
-            'times': self._extract_times(message),
-            'subjects': self._extract_subjects(message),
-            'grades': self._extract_grades(message)
-        }
-        return entities
-
-    def _extract_dates(self, message: str) -> List[str]:
+    def evict_idle(self, now: float = None) -> int:
         """
-        Extract dates from message
-        """
-        # Basic date pattern matching
-        date_pattern = r'\d{1,2}[-/]\d{1,2}[-/]\d{2,4}|\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4}'
-        return re.findall(date_pattern, message)
+        Drop users idle past the timeout, then the least recently active beyond max_users.
 
-    def _extract_times(self, message: str) -> List[str]:
-        """
-        Extract times from message
-        """
-        # Basic time pattern matching
-        time_pattern = r'\d{1,2}:\d{2}\s*(?:AM|PM|am|pm)?|\d{1,2}\s*(?:AM|PM|am|pm)'
-        return re.findall(time_pattern, message)
+        Only the front of the order is inspected, so this is cheap enough to
+        run on every message.
 
-    def _extract_subjects(self, message: str) -> List[str]:
+        Returns:
+            Number of users evicted
         """
-        Extract subject mentions from message
-        """
-        subjects = ['math', 'science', 'english', 'history', 'physics', 'chemistry', 'biology']
-        return [subject for subject in subjects if subject in message.lower()]
+        now = time.monotonic() if now is None else now
+        history = self.conversation_history
+        evicted = 0
+        while history:
+            user_id, ring = next(iter(history.items()))
+            if len(history) <= self.max_users and now - ring.last_seen < self.idle_timeout:
+                break
+            del history[user_id]
+            evicted += 1
+        self.evictions += evicted
+        return evicted
 
-    def _extract_grades(self, message: str) -> List[str]:
+    def process_message(self, message: str, user_id: str) -> Dict:
         """
-        Extract grade levels from message
+        Process incoming message and extract relevant information
         """
-        grade_pattern = r'grade\s+\d{1,2}|\d{1,2}(?:st|nd|rd|th)\s+grade'
-        return re.findall(grade_pattern, message.lower())
+        now = time.monotonic()
+        self._ring(user_id, now).append(HistoryEntry(message, now))
 
-    def _analyze_sentiment(self, message: str) -> str:
+        # Escalation, intent, entities and sentiment in one scan
+        return self.analyzer.analyze(message)
+
+    def process_messages(self, messages: List[str], user_id: str) -> List[Dict]:
         """
-        Basic sentiment analysis
+        Process several messages from one user; results are in order
         """
-        positive_words = ['good', 'great', 'excellent', 'happy', 'thanks', 'thank']
-        negative_words = ['bad', 'poor', 'terrible', 'unhappy', 'angry', 'upset']
-
-        message_lower = message.lower()
-        positive_count = sum(1 for word in positive_words if word in message_lower)
-        negative_count = sum(1 for word in negative_words if word in message_lower)
-
-        if positive_count > negative_count:
-            return 'positive'
-        elif negative_count > positive_count:
-            return 'negative'
-        else:
-            return 'neutral'
+        now = time.monotonic()
+        ring = self._ring(user_id, now)
+        # Only the newest history_size messages would survive anyway
+        for message in messages[-self.history_size:]:
+            ring.append(HistoryEntry(message, now))
+        return self.analyzer.analyze_batch(messages)
 
     def get_conversation_history(self, user_id: str) -> List[Dict]:
         """
-        Get conversation history for a user
-        """
-        return self.conversation_history.get(user_id, []) 
\ No newline at end of file
+        Get conversation history for a user, oldest first
+        """
+        ring = self.conversation_history.get(user_id)
+        if ring is None:
+            return []
+        return [
+            {
+                'message': entry.message,
+                'timestamp': datetime.fromtimestamp(entry.timestamp + self.clock_offset).isoformat()
+            }
+            for entry in ring
+        ]
@@ -0,0 +1,214 @@
+"""
+Single-pass keyword and entity analysis for incoming messages.
+
+Every keyword list (escalation, intent, topic, subjects, sentiment) is compiled
+into one dict from word form to the lists it belongs to, and the date, time
+and grade patterns into one regular expression. A message is lowercased and
+split into words once; each word is a single lookup, instead of one substring
+scan per keyword per list. Keywords match whole words only, so "unhappy" no
+longer counts as "happy", but plural, -ed and -ing forms still match
+("booking" counts as "book").
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import re
+from config.config import (
+    ESCALATION_KEYWORDS,
+    INTENT_KEYWORDS,
+    TOPIC_KEYWORDS,
+    SUBJECTS,
+    SUBJECT_ALIASES,
+    POSITIVE_WORDS,
+    NEGATIVE_WORDS
+)
+
+DATE_PATTERN = r'\d{1,2}[-/]\d{1,2}[-/]\d{2,4}|\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4}'
+TIME_PATTERN = r'\d{1,2}:\d{2}\s*(?:AM|PM|am|pm)?|\d{1,2}\s*(?:AM|PM|am|pm)\b'
+GRADE_PATTERN = r'grade\s+\d{1,2}|\d{1,2}(?:st|nd|rd|th)\s+grade'
+
+ESCALATION = 'escalation'
+INTENT = 'intent'
+TOPIC = 'topic'
+SUBJECT = 'subject'
+POSITIVE = 'positive'
+NEGATIVE = 'negative'
+
+_WORD = re.compile(r"[a-z]+")
+_DIGIT = re.compile(r"\d")
+
+def word_forms(keyword: str) -> Set[str]:
+    """The keyword plus its plural, -ed and -ing forms (dropping a final 'e')."""
+    keyword = ' '.join(keyword.lower().split())
+    if ' ' in keyword:
+        return {keyword}
+    forms = {keyword, keyword + 's', keyword + 'es', keyword + 'ed', keyword + 'ing'}
+    if keyword.endswith('e'):
+        forms |= {keyword + 'd', keyword[:-1] + 'ing'}
+    return forms
+
+class TextAnalyzer:
+    def __init__(self, escalation_keywords: List[str] = ESCALATION_KEYWORDS,
+                 intent_keywords: Dict[str, List[str]] = INTENT_KEYWORDS,
+                 topic_keywords: Dict[str, List[str]] = TOPIC_KEYWORDS,
+                 subjects: List[str] = SUBJECTS, subject_aliases: Dict[str, str] = SUBJECT_ALIASES,
+                 positive_words: List[str] = POSITIVE_WORDS, negative_words: List[str] = NEGATIVE_WORDS,
+                 default_intent: str = 'general_inquiry'):
+        """
+        Compile the keyword lists into one lookup table.
+
+        Args:
+            escalation_keywords: Words or phrases that need a human
+            intent_keywords: Intent -> keywords, in priority order
+            topic_keywords: Topic -> keywords, in priority order
+            subjects: Subject names, reported in this order
+            subject_aliases: Alternative subject names -> subject
+            positive_words, negative_words: Sentiment vocabularies
+            default_intent: Intent when no intent keyword matches
+        """
+        self.intents = list(intent_keywords)
+        self.topics = list(topic_keywords)
+        self.subjects = list(subjects)
+        self.default_intent = default_intent
+
+        # Surface form -> (list, label) tags
+        self.tags: Dict[str, Set[Tuple[str, str]]] = {}
+        def add(keywords: Iterable[str], kind: str, label_of=lambda keyword: keyword):
+            for keyword in keywords:
+                for form in word_forms(keyword):
+                    self.tags.setdefault(form, set()).add((kind, label_of(keyword)))
+
+        add(escalation_keywords, ESCALATION)
+        for intent, keywords in intent_keywords.items():
+            add(keywords, INTENT, lambda keyword, intent=intent: intent)
+        for topic, keywords in topic_keywords.items():
+            add(keywords, TOPIC, lambda keyword, topic=topic: topic)
+        add(subjects, SUBJECT)
+        add(subject_aliases, SUBJECT, lambda alias: subject_aliases[alias])
+        add(positive_words, POSITIVE)
+        add(negative_words, NEGATIVE)
+        # Freeze tag sets so lookups share them
+        self.tags = {form: frozenset(tags) for form, tags in self.tags.items()}
+
+        # Multi-word keywords, looked up only from their first word
+        self.phrases: Dict[str, List[Tuple[str, ...]]] = {}
+        for form in self.tags:
+            words = tuple(form.split())
+            if len(words) > 1:
+                self.phrases.setdefault(words[0], []).append(words)
+        self.words = frozenset(form for form in self.tags if ' ' not in form)
+        self.phrase_starts = frozenset(self.phrases)
+
+        # Dates, times and grades all contain a digit; one pattern for the three
+        self.entity_pattern = re.compile(
+            # The lookahead rejects most positions before any alternative is tried
+            rf'(?=[\dg])(?:'
+            rf'(?P<date>(?<!\d)(?:{DATE_PATTERN}))'
+            rf'|(?P<time>(?<!\d)(?:{TIME_PATTERN}))'
+            rf'|(?P<grade>\b(?:{GRADE_PATTERN})))',
+            re.IGNORECASE
+        )
+
+    def analyze(self, message: str) -> Dict:
+        """
+        Escalation, intent, entities and sentiment of one message.
+
+        The lowercased text is split into words once and every word is a
+        single dict lookup; the entity pattern runs only on text with digits.
+
+        Returns:
+            Dict with 'requires_escalation', 'intent', 'entities' (dates,
+            times, subjects, grades) and 'sentiment'
+        """
+        message = message or ''
+        words = _WORD.findall(message.lower())
+        tags, phrases = self.tags, self.phrases
+        hits: Set[Tuple[str, str]] = set()
+        # Set intersection runs in C; only keyword hits reach Python code
+        for word in self.words.intersection(words):
+            hits |= tags[word]
+        for first in self.phrase_starts.intersection(words):
+            for i, word in enumerate(words):
+                if word != first:
+                    continue
+                for phrase in phrases[first]:
+                    if tuple(words[i:i + len(phrase)]) == phrase:
+                        hits |= tags[' '.join(phrase)]
+
+        dates, times, grades = [], [], []
+        if _DIGIT.search(message):
+            for match in self.entity_pattern.finditer(message):
+                kind = match.lastgroup
+                if kind == 'date':
+                    dates.append(match.group())
+                elif kind == 'time':
+                    times.append(match.group())
+                else:
+                    grades.append(match.group().lower())
+
+        intent = self.default_intent
+        for candidate in self.intents:
+            if (INTENT, candidate) in hits:
+                intent = candidate
+                break
+        positive = negative = 0
+        requires_escalation = False
+        subjects = set()
+        for kind, label in hits:
+            if kind == POSITIVE:
+                positive += 1
+            elif kind == NEGATIVE:
+                negative += 1
+            elif kind == ESCALATION:
+                requires_escalation = True
+            elif kind == SUBJECT:
+                subjects.add(label)
+        return {
+            'requires_escalation': requires_escalation,
+            'intent': intent,
+            'entities': {
+                'dates': dates,
+                'times': times,
+                'subjects': [subject for subject in self.subjects if subject in subjects],
+                'grades': grades
+            },
+            'sentiment': 'positive' if positive > negative else 'negative' if negative > positive else 'neutral'
+        }
+
+    def topic(self, message: str) -> Optional[str]:
+        """
+        First topic, in topic_keywords order, with a keyword in the message.
+
+        Single words only, like the batch tagging in
+        services.memory.history_reclassify, so live and stored topics agree.
+        Returns None when no topic keyword matches.
+        """
+        words = self.words.intersection(_WORD.findall((message or '').lower()))
+        found = {label for word in words for kind, label in self.tags[word] if kind == TOPIC}
+        for topic in self.topics:
+            if topic in found:
+                return topic
+        return None
+
+    def analyze_batch(self, messages: List[str], processes: Optional[int] = None,
+                      chunksize: int = 2000) -> List[Dict]:
+        """
+        Analyze many messages, in order.
+
+        With `processes` > 1 the list is split into chunks analyzed in a
+        process pool; otherwise everything runs in this process.
+        """
+        if not processes or processes <= 1 or len(messages) <= chunksize:
+            analyze = self.analyze
+            return [analyze(message) for message in messages]
+        chunks = [messages[i:i + chunksize] for i in range(0, len(messages), chunksize)]
+        results: List[Dict] = []
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for chunk_results in pool.map(self.analyze_batch, chunks):
+                results.extend(chunk_results)
+        return results
+
+@functools.lru_cache(maxsize=1)
+def default_analyzer() -> TextAnalyzer:
+    """Process-wide analyzer built from config.config."""
+    return TextAnalyzer()
@@ -0,0 +1,255 @@
+"""
+Span-based latency tracing for the message pipeline.
+
+A trace covers one Telegram update and spans inside it time the stages
+(analysis, context lookup, LLM calls, vector search, Sheets and Gmail
+requests). The current span is kept in a ContextVar, so it follows the
+update through awaits and into tasks created from it without being passed
+as an argument. Every span's duration also goes into a per-stage histogram
+kept in process; traces slower than a threshold are sampled to a JSONL file.
+
+Code outside any trace (background refreshes, pool threads) can still use
+spans: they only feed the histograms.
+"""
+from typing import Any, Dict, List, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import bisect
+import functools
+import inspect
+import json
+import os
+import random
+import threading
+import time
+from config.config import TRACE_SLOW_MS, TRACE_SLOW_SAMPLE_RATE, TRACE_SINK_PATH, TRACE_MAX_SPANS
+
+# Histogram bucket upper bounds: 0.25 ms to about 65 s, four buckets per doubling
+BUCKET_BOUNDS_MS = [0.25 * 2 ** (i / 4) for i in range(73)]
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "errors", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)  # Last bucket is overflow
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float, failed: bool) -> None:
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.errors += failed
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th value (within 19% of the true value)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                bound = BUCKET_BOUNDS_MS[bucket] if bucket < len(BUCKET_BOUNDS_MS) else self.max_ms
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms
+        }
+
+class Trace:
+    __slots__ = ("trace_id", "started", "wall_started", "spans", "next_span_id")
+
+    def __init__(self):
+        self.trace_id = os.urandom(8).hex()
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.spans: List["Span"] = []
+        self.next_span_id = 0
+
+class Span:
+    __slots__ = ("name", "trace", "span_id", "parent_id", "started", "duration_ms", "attributes", "error")
+
+    def __init__(self, name: str, trace: Optional[Trace], parent_id: Optional[int], attributes: Dict):
+        self.name = name
+        self.trace = trace
+        self.parent_id = parent_id
+        self.span_id = None
+        if trace is not None:
+            self.span_id = trace.next_span_id
+            trace.next_span_id += 1
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.duration_ms = 0.0
+        self.started = time.perf_counter()
+
+    def set(self, key: str, value: Any) -> None:
+        """Attach an attribute, e.g. the number of retries a stage needed."""
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "offset_ms": round((self.started - self.trace.started) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+class Tracer:
+    def __init__(self, slow_trace_ms: Optional[float] = TRACE_SLOW_MS,
+                 sample_rate: float = TRACE_SLOW_SAMPLE_RATE,
+                 sink_path: Optional[str] = TRACE_SINK_PATH, max_spans: int = TRACE_MAX_SPANS):
+        """
+        Collect stage histograms and sample slow traces.
+
+        Args:
+            slow_trace_ms: Traces at least this long may be written to the sink
+                (None disables the sink)
+            sample_rate: Fraction of slow traces written
+            sink_path: JSONL file slow traces are appended to
+            max_spans: Spans recorded per trace
+        """
+        self.slow_trace_ms = slow_trace_ms
+        self.sample_rate = sample_rate
+        self.sink_path = sink_path
+        self.max_spans = max_spans
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.lock = threading.Lock()  # Spans may close in worker threads
+        self.sink = None
+        self.traces = 0
+        self.slow_traces = 0
+        self.sampled_traces = 0
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Start a new trace whose root span is `name`."""
+        trace = Trace()
+        root = None
+        try:
+            with self._span(name, trace, None, attributes) as root:
+                yield root
+        finally:
+            # Runs for failed updates too: those are often the slow ones
+            self.traces += 1
+            if self.slow_trace_ms is not None and root.duration_ms >= self.slow_trace_ms:
+                self.slow_traces += 1
+                if random.random() < self.sample_rate:
+                    self._write(trace, root)
+
+    def span(self, name: str, **attributes):
+        """Time a stage as a child of the current span (only a histogram entry outside a trace)."""
+        parent = _current_span.get()
+        if parent is None:
+            return self._span(name, None, None, attributes)
+        return self._span(name, parent.trace, parent.span_id, attributes)
+
+    @contextmanager
+    def _span(self, name: str, trace: Optional[Trace], parent_id: Optional[int], attributes: Dict):
+        span = Span(name, trace, parent_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration_ms = (time.perf_counter() - span.started) * 1000
+            _current_span.reset(token)
+            with self.lock:
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = LatencyHistogram()
+                histogram.record(span.duration_ms, span.error is not None)
+                if trace is not None and len(trace.spans) < self.max_spans:
+                    trace.spans.append(span)
+
+    def _write(self, trace: Trace, root: Span) -> None:
+        """Append one slow trace to the sink; slow traces are rare, so this writes inline."""
+        spans = sorted((span for span in trace.spans if span is not root), key=lambda span: span.started)
+        record = {
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "started_at": datetime.fromtimestamp(trace.wall_started).isoformat(),
+            "duration_ms": round(root.duration_ms, 3),
+            "error": root.error,
+            "attributes": root.attributes,
+            "spans": [span.to_dict() for span in spans]
+        }
+        try:
+            with self.lock:
+                if self.sink is None:
+                    directory = os.path.dirname(self.sink_path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self.sink = open(self.sink_path, "a", encoding="utf-8")
+                self.sink.write(json.dumps(record, default=str) + "\n")
+                self.sink.flush()
+            self.sampled_traces += 1
+        except Exception as e:
+            print(f"Error writing slow trace: {str(e)}")
+
+    def metrics(self) -> Dict[str, Dict]:
+        """Latency summary per stage."""
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.histograms.clear()
+        self.traces = self.slow_traces = self.sampled_traces = 0
+
+    def close(self) -> None:
+        with self.lock:
+            if self.sink is not None:
+                self.sink.close()
+                self.sink = None
+
+# Process-wide tracer used by the module-level helpers
+tracer = Tracer()
+
+def trace(name: str, **attributes):
+    """Start a trace on the process-wide tracer."""
+    return tracer.trace(name, **attributes)
+
+def span(name: str, **attributes):
+    """Time a stage on the process-wide tracer."""
+    return tracer.span(name, **attributes)
+
+def current_trace_id() -> Optional[str]:
+    """ID of the trace the caller runs in, for log lines."""
+    current = _current_span.get()
+    return current.trace.trace_id if current is not None and current.trace is not None else None
+
+def traced(name: str):
+    """Decorator that runs a function or coroutine function inside a span."""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate